@@ -19,10 +19,13 @@ from .plugins_common import Metadata
 from .deltarepos import DeltaRepos, DeltaRepoRecord
 from .deltametadata import DeltaMetadata, PluginBundle
 from .applicator import DeltaRepoApplicator
+from .fusedapplicator import FusedDeltaRepoApplicator
+from .composer import DeltaRepoComposer
 from .generator import DeltaRepoGenerator
 from .plugins import PLUGINS
 from .plugins import needed_delta_metadata
 from .errors import DeltaRepoError, DeltaRepoPluginError
+from .errors import DeltaRepoCompositionError
 
 __all__ = ['VERSION_MAJOR', 'VERSION_MINOR', 'VERSION_PATCH',
            'VERSION', 'VERBOSE_VERSION',
@@ -33,9 +36,12 @@ __all__ = ['VERSION_MAJOR', 'VERSION_MINOR', 'VERSION_PATCH',
            'DeltaRepos', 'DeltaRepoRecord',
            'DeltaMetadata', 'PluginBundle',
            'DeltaRepoApplicator',
+           'FusedDeltaRepoApplicator',
+           'DeltaRepoComposer',
            'DeltaRepoGenerator',
            'needed_delta_metadata',
-           'DeltaRepoError', 'DeltaRepoPluginError']
+           'DeltaRepoError', 'DeltaRepoPluginError',
+           'DeltaRepoCompositionError']
 
 VERSION = "{0}.{1}.{2}".format(VERSION_MAJOR, VERSION_MINOR, VERSION_PATCH)
 VERBOSE_VERSION = "%s (createrepo_c: %s)" % (VERSION, cr.VERSION)
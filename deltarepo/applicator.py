@@ -13,9 +13,12 @@ import shutil
 import createrepo_c as cr
 from .common import LoggingInterface
 from .plugins_common import GlobalBundle, Metadata
+from .plugins_common import repomd_record_to_dict, repomd_record_from_dict
 from .deltametadata import DeltaMetadata
 from .common import DEFAULT_CHECKSUM_TYPE, DEFAULT_COMPRESSION_TYPE
 from .plugins import GlobalBundle, PLUGINS, GENERAL_PLUGIN
+from .plugins import needed_delta_metadata
+from .parallel import run_in_processes, split_workers
 from .util import calculate_content_hash, pkg_id_str
 from .errors import DeltaRepoError
 
@@ -29,16 +32,28 @@ class DeltaRepoApplicator(LoggingInterface):
                  out_path=None,
                  logger=None,
                  force_database=False,
-                 ignore_missing=False):
+                 ignore_missing=False,
+                 patch_databases=False,
+                 target_metadata=None,
+                 max_workers=None):
 
         # Initialization
 
         LoggingInterface.__init__(self, logger)
 
+        # Types of metadata which are processed (None means all).
+        # Metadata needed to produce the target ones are processed too
+        # (e.g. primary for primary_db).
+        self.processed_types = None
+        if target_metadata is not None:
+            self.processed_types = set(target_metadata)
+            self.processed_types.update(needed_delta_metadata(target_metadata))
+
         self.contenthash_type = None
         self.unique_md_filenames = False
         self.force_database = force_database
         self.ignore_missing = ignore_missing
+        self.max_workers = max_workers  # Max. number of worker processes
         self.deltametadata = DeltaMetadata()
 
         self.out_path = out_path or "./"
@@ -135,6 +150,12 @@ class DeltaRepoApplicator(LoggingInterface):
         self.globalbundle.unique_md_filenames = self.unique_md_filenames
         self.globalbundle.force_database = self.force_database
         self.globalbundle.ignore_missing = self.ignore_missing
+        self.globalbundle.patch_databases = patch_databases
+
+    def _is_processed(self, metadata_type):
+        """Check if the metadata type is processed (see target_metadata)"""
+        return self.processed_types is None or \
+                metadata_type in self.processed_types
 
     def _new_metadata(self, metadata_type):
         """Return Metadata Object for the metadata_type"""
@@ -191,6 +212,22 @@ class DeltaRepoApplicator(LoggingInterface):
 
         return metadata
 
+    def _apply_plugin(self, plugin, pluginbundle, metadata_objects):
+        """Apply the delta of the metadata by the plugin and return
+        tuple (rec_attrs, new_files, contenthashes)"""
+        self._debug("Plugin {0}: Active".format(plugin.NAME))
+        plugin_instance = plugin(pluginbundle, self.globalbundle,
+                                 logger=self._get_logger())
+        repomd_records = plugin_instance.apply(metadata_objects)
+
+        rec_attrs = [repomd_record_to_dict(rec) for rec in repomd_records]
+        new_files = {}
+        for metadata_type, md in metadata_objects.items():
+            new_files[metadata_type] = (md.new_fn, md.new_fn_exists)
+        contenthashes = (self.globalbundle.calculated_old_contenthash,
+                         self.globalbundle.calculated_new_contenthash)
+        return rec_attrs, new_files, contenthashes
+
     def check_content_hashes(self, pri_md):
         self._debug("Checking expected content hashes")
 
@@ -254,11 +291,18 @@ class DeltaRepoApplicator(LoggingInterface):
         processed_metadata = set()
         primary_metadata_object = None
 
+        # Plugins take care of disjoint sets of metadata, so they are
+        # run by independent workers and their repomd records are merged
+        # afterwards
+        jobs = []   # [(plugin, pluginbundle, metadata_objects), ...]
+
         for plugin in PLUGINS:
 
             # Prepare metadata for the plugin
             metadata_objects = {}
             for metadata_name in plugin.METADATA:
+                if not self._is_processed(metadata_name):
+                    continue
                 metadata_object = self._new_metadata(metadata_name)
                 if metadata_name == "primary":
                     primary_metadata_object = metadata_object
@@ -286,18 +330,7 @@ class DeltaRepoApplicator(LoggingInterface):
                     "is only version: {3}".format(metadata_objects.keys(),
                     plugin.NAME, pluginbundle.version, plugin.VERSION))
 
-            # Use the plugin
-            self._debug("Plugin {0}: Active".format(plugin.NAME))
-            plugin_instance = plugin(pluginbundle, self.globalbundle,
-                                     logger=self._get_logger())
-            repomd_records = plugin_instance.apply(metadata_objects)
-
-            # Put repomd records from processed metadatas to repomd
-            self._debug("Plugin {0}: Processed {1} delta record(s) " \
-                "and produced:".format(plugin.NAME, metadata_objects.keys()))
-            for rec in repomd_records:
-                self._debug(" - {0}".format(rec.type))
-                self.new_repomd.set_record(rec)
+            jobs.append((plugin, pluginbundle, metadata_objects))
 
             # Organization stuff
             for md in metadata_objects.keys():
@@ -313,6 +346,10 @@ class DeltaRepoApplicator(LoggingInterface):
                 continue
             if rectype in processed_metadata:
                 continue
+            if not self._is_processed(rectype):
+                self._debug("Not processed: {0} - Not a target "
+                            "metadata".format(rectype))
+                continue
 
             metadata_object = self._new_metadata(rectype)
             if metadata_object is not None:
@@ -323,7 +360,6 @@ class DeltaRepoApplicator(LoggingInterface):
                 self._debug("Not processed: {0} - SKIP".format(rectype))
 
         if metadata_objects and self.deltametadata.get_pluginbundle(GENERAL_PLUGIN.NAME):
-            # Use the plugin
             pluginbundle = self.deltametadata.get_pluginbundle(GENERAL_PLUGIN.NAME)
 
             if pluginbundle.version > GENERAL_PLUGIN.VERSION:
@@ -331,18 +367,42 @@ class DeltaRepoApplicator(LoggingInterface):
                     "plugin {1} with version: {2}, but locally available "
                     "is only version: {3}".format(metadata_objects.keys(),
                     GENERAL_PLUGIN.NAME, pluginbundle.version, GENERAL_PLUGIN.VERSION))
-            self._debug("Plugin {0}: Active".format(GENERAL_PLUGIN.NAME))
-            plugin_instance = GENERAL_PLUGIN(pluginbundle, self.globalbundle,
-                                             logger=self._get_logger())
-            repomd_records = plugin_instance.apply(metadata_objects)
+
+            jobs.append((GENERAL_PLUGIN, pluginbundle, metadata_objects))
+
+        # Use the plugins
+        # Plugins which run simultaneously run their own jobs
+        # in their processes (see parallel.split_workers())
+        max_workers, self.globalbundle.max_workers = split_workers(
+                                                self.max_workers, len(jobs))
+        results = run_in_processes([lambda job=job: self._apply_plugin(*job)
+                                    for job in jobs],
+                                   max_workers=max_workers,
+                                   logger=self._get_logger())
+
+        for (plugin, _, metadata_objects), (rec_attrs, new_files, contenthashes) \
+                in zip(jobs, results):
 
             # Put repomd records from processed metadatas to repomd
             self._debug("Plugin {0}: Processed {1} delta record(s) " \
-                "and produced:".format(GENERAL_PLUGIN.NAME, metadata_objects.keys()))
-            for rec in repomd_records:
+                "and produced:".format(plugin.NAME, metadata_objects.keys()))
+            for attrs in rec_attrs:
+                rec = repomd_record_from_dict(attrs)
                 self._debug(" - {0}".format(rec.type))
                 self.new_repomd.set_record(rec)
 
+            # Files written by the worker
+            for metadata_type, (new_fn, new_fn_exists) in new_files.items():
+                metadata_objects[metadata_type].new_fn = new_fn
+                metadata_objects[metadata_type].new_fn_exists = new_fn_exists
+
+            # Content hashes calculated by the worker
+            old_contenthash, new_contenthash = contenthashes
+            if old_contenthash:
+                self.globalbundle.calculated_old_contenthash = old_contenthash
+            if new_contenthash:
+                self.globalbundle.calculated_new_contenthash = new_contenthash
+
         # Check if calculated contenthashes match
         self.check_content_hashes(primary_metadata_object)
 
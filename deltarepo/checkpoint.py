@@ -0,0 +1,121 @@
+"""
+Checkpoints of application of a resolved path (a chain of deltas).
+
+Updater keeps downloaded delta repos and the last applied intermediate
+repo in a work directory together with a journal (JOURNAL_FILENAME).
+If the update is interrupted, the next update of the same repo resumes
+from the last applied intermediate repo and already downloaded deltas
+are not downloaded again.
+
+Links (deltas) are identified by their keys "src_contenthash-dst_contenthash"
+(the same string as the content hash in repomd.xml of the delta repo).
+Paths in the journal are relative to the work directory.
+"""
+
+import os
+import json
+
+__all__ = ["JOURNAL_FILENAME", "UpdateJournal"]
+
+JOURNAL_FILENAME = "journal.json"
+JOURNAL_VERSION = 1
+
+
+class UpdateJournal(object):
+    """Journal of an update of a repository"""
+
+    def __init__(self, workdir, source=None):
+        """
+        :param workdir: Work directory of the update
+        :type workdir: str
+        :param source: Content hash of the repo before the update
+        :type source: str or None
+        """
+        self.workdir = workdir
+        self.source = source
+        self.downloaded = {}    # { link_key: {"url", "dir", "metadata"} }
+        self.applied = None     # {"dir", "contenthash"} of the last
+                                # applied intermediate repo
+
+    @property
+    def path(self):
+        return os.path.join(self.workdir, JOURNAL_FILENAME)
+
+    @classmethod
+    def load(cls, workdir):
+        """Load journal from the work directory. Empty journal is
+        returned if there is no (valid) journal."""
+        journal = cls(workdir)
+        try:
+            with open(journal.path) as f:
+                data = json.load(f)
+            if data.get("version") != JOURNAL_VERSION:
+                return journal
+            journal.source = data.get("source")
+            journal.downloaded = dict(data.get("downloaded") or {})
+            journal.applied = data.get("applied")
+        except (IOError, ValueError, TypeError, AttributeError):
+            return cls(workdir)
+        return journal
+
+    def save(self):
+        """Write the journal. The old journal is replaced atomically,
+        so an interruption never leaves a broken journal."""
+        data = {"version": JOURNAL_VERSION,
+                "source": self.source,
+                "downloaded": self.downloaded,
+                "applied": self.applied}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, sort_keys=True, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+
+    @staticmethod
+    def _metadata(metadata):
+        if metadata is None:
+            return None
+        return sorted(metadata)
+
+    def add_download(self, link_key, url, dirname, metadata=None):
+        """Record a downloaded (and verified) delta repo"""
+        self.downloaded[link_key] = {"url": url,
+                                     "dir": dirname,
+                                     "metadata": self._metadata(metadata)}
+
+    def get_download(self, link_key, url, metadata=None):
+        """Return directory of the delta repo if it was downloaded from
+        the url with the same metadata, None otherwise"""
+        record = self.downloaded.get(link_key)
+        if not record or record.get("url") != url or \
+                record.get("metadata") != self._metadata(metadata):
+            return None
+        return record.get("dir")
+
+    def remove_download(self, link_key):
+        self.downloaded.pop(link_key, None)
+
+    def set_applied(self, dirname, contenthash):
+        """Record the last applied intermediate repo"""
+        self.applied = {"dir": dirname, "contenthash": contenthash}
+
+    def resume_index(self, link_keys):
+        """Return index of the first link of the chain which is not
+        applied yet (i.e. which starts at the applied intermediate repo).
+        Return 0 if the chain cannot be resumed and len(link_keys)
+        if the whole chain is already applied.
+
+        :param link_keys: Keys of the links of the chain
+        :type link_keys: list
+        :rtype: int
+        """
+        if not self.applied or not link_keys:
+            return 0
+        contenthash = self.applied.get("contenthash")
+        for index, link_key in enumerate(link_keys):
+            if link_key.split("-")[0] == contenthash:
+                return index
+        if link_keys[-1].split("-")[-1] == contenthash:
+            return len(link_keys)
+        return 0
@@ -0,0 +1,557 @@
+"""
+Composition of delta repositories.
+
+A chain of consecutive deltas (A -> B, B -> C, ...) is composed into
+a single delta (A -> C). Only the delta repositories are needed:
+the sets of removed (removedpackage lists in deltametadata.xml)
+and added packages (the delta metadata files) are composed in
+the memory - packages added by a delta and removed by a later one
+cancel out - and the added packages are copied from the deltas
+without parsing.
+
+If the first repository of the chain is available, content hashes
+of all intermediate repositories are verified during the composition
+(they are calculated from package identities, no intermediate metadata
+are written). Without it, only the links of the chain are checked
+and the content hash of the composed delta is verified when the delta
+is applied.
+
+Not every chain could be composed (e.g. when a delta contains element
+level deltas of packages or the whole primary.xml). In such case
+the DeltaRepoCompositionError is raised before anything is written.
+"""
+
+import os
+import shutil
+import collections
+import createrepo_c as cr
+from .common import LoggingInterface
+from .deltametadata import DeltaMetadata, PluginBundle
+from .plugins import PLUGINS, GENERAL_PLUGIN, MainDeltaRepoPlugin
+from .plugins import needed_delta_metadata
+from .scanner import iter_primary_ids, write_raw_packages
+from .util import content_hashes_from_ids
+from .errors import DeltaRepoError, DeltaRepoCompositionError
+
+__all__ = ["DeltaRepoComposer", "PackageChanges"]
+
+# Metadata with packages - their deltas are composed
+# from the sets of removed and added packages
+PACKAGE_METADATA = ("primary", "filelists", "other")
+
+# Notes which describe how a file is obtained (see _apply_basic_delta())
+BASIC_NOTES = ("unchanged", "new_name", "checksum_name",
+               "original", "compressed")
+
+
+class PackageChanges(object):
+    """Composition of changes of a package set made by a chain of deltas.
+
+    Packages are identified by their location (location_href,
+    location_base) - the same way as the removed packages in
+    deltametadata.xml.
+    """
+
+    def __init__(self):
+        # Locations of packages removed from the first repository
+        self.removed = collections.OrderedDict()    # {location: True}
+        # Packages added by the chain
+        self.added = collections.OrderedDict()      # {location: (index, pkgId)}
+
+    def add_delta(self, index, removed, added):
+        """Compose changes of the next delta in the chain.
+
+        :param index: Index of the delta in the chain
+        :type index: int
+        :param removed: Locations (location_href, location_base)
+                        of the packages removed by the delta
+        :type removed: iterable
+        :param added: Identities (pkgId, location_href, location_base)
+                      of the packages added by the delta
+        :type added: iterable
+        """
+        for location in removed:
+            if location in self.added:
+                # Added by a previous delta - they cancel out
+                del self.added[location]
+            elif location in self.removed:
+                raise DeltaRepoCompositionError("Package {0} is removed "
+                        "twice".format(location[0]))
+            else:
+                self.removed[location] = True
+        for pkgid, location_href, location_base in added:
+            self.added[(location_href, location_base)] = (index, pkgid)
+
+    def identities(self, old_identities):
+        """Yield identities of packages of the repository made by
+        the composed deltas from a repository with the old_identities"""
+        for pkg_id_tuple in old_identities:
+            if (pkg_id_tuple[1], pkg_id_tuple[2]) not in self.removed:
+                yield pkg_id_tuple
+        for (location_href, location_base), (_, pkgid) in self.added.items():
+            yield (pkgid, location_href, location_base)
+
+    def added_by(self, index):
+        """Return identities (pkgId, location_href, location_base)
+        of the added packages which come from the delta"""
+        return [(pkgid, location_href, location_base)
+                for (location_href, location_base), (idx, pkgid)
+                in self.added.items() if idx == index]
+
+
+class _DeltaRepo(object):
+    """Delta repository of a chain"""
+
+    def __init__(self, path):
+        self.path = path
+        self.repomd = cr.Repomd(os.path.join(path, "repodata", "repomd.xml"))
+
+        if not self.repomd.contenthash or \
+                len(self.repomd.contenthash.split('-')) != 2:
+            raise DeltaRepoError("Bad content hash of {0}".format(path))
+        self.contenthash_type = self.repomd.contenthash_type
+        self.src_contenthash, self.dst_contenthash = \
+                self.repomd.contenthash.split('-')
+
+        self.records = {}
+        for record in self.repomd.records:
+            self.records[record.type] = record
+
+        if not self.fn("deltametadata"):
+            raise DeltaRepoCompositionError("deltametadata of {0} is "
+                                            "missing".format(path))
+        self.deltametadata = DeltaMetadata()
+        self.deltametadata.load(self.fn("deltametadata"))
+
+        # Metadata notes {metadata_type: (plugin name, notes)}
+        self.notes = {}
+        for bundle in self.deltametadata.usedplugins.values():
+            for notes in bundle.get_list("metadata", []):
+                notes = dict(notes)
+                metadata_type = notes.pop("type", None)
+                if metadata_type:
+                    self.notes[metadata_type] = (bundle.name, notes)
+
+    def fn(self, metadata_type):
+        """Path to the existing file of the metadata or None"""
+        rec = self.records.get(metadata_type)
+        if rec is None:
+            return None
+        fn = os.path.join(self.path, rec.location_href)
+        if not os.path.isfile(fn):
+            return None
+        return fn
+
+    def mode(self, metadata_type):
+        """How the metadata is obtained: "unchanged" (from the previous
+        repository), "original" (the delta file is the target file),
+        "delta" (a real delta) or None (removed)"""
+        notes = self.notes.get(metadata_type, (None, {}))[1]
+        if notes.get("unchanged") == "1":
+            return "unchanged"
+        if notes.get("original") == "1":
+            return "original"
+        if metadata_type in self.records:
+            return "delta"
+        return None
+
+
+class DeltaRepoComposer(LoggingInterface):
+    """Compose a chain of delta repositories into a single delta."""
+
+    def __init__(self,
+                 delta_repo_paths,
+                 old_repo_path=None,
+                 logger=None,
+                 target_metadata=None):
+        """
+        :param delta_repo_paths: Paths to the consecutive delta repos
+        :type delta_repo_paths: list
+        :param old_repo_path: Path to the first repository of the chain
+                              (optional, used only to verify content
+                              hashes of the intermediate repositories)
+        :type old_repo_path: str or None
+        :param target_metadata: Types of metadata which are wanted
+                                in the target repository (None means
+                                all). Other metadata are not composed.
+        :type target_metadata: list or None
+        """
+
+        LoggingInterface.__init__(self, logger)
+
+        if not delta_repo_paths:
+            raise DeltaRepoError("No delta repository to compose")
+
+        self.delta_repo_paths = list(delta_repo_paths)
+        self.old_repo_path = old_repo_path
+
+        # Types of composed metadata (None means all), see
+        # DeltaRepoApplicator
+        self.processed_types = None
+        if target_metadata is not None:
+            self.processed_types = set(target_metadata)
+            self.processed_types.update(needed_delta_metadata(target_metadata))
+
+        self.deltas = [_DeltaRepo(path) for path in self.delta_repo_paths]
+
+        # Check that the deltas make a chain
+        for prev, delta in zip(self.deltas, self.deltas[1:]):
+            if prev.contenthash_type != delta.contenthash_type:
+                raise DeltaRepoCompositionError("Different contenthash types "
+                        "{0} vs {1}".format(prev.contenthash_type,
+                                            delta.contenthash_type))
+            if prev.dst_contenthash != delta.src_contenthash:
+                raise DeltaRepoError("Delta {0} doesn't follow delta "
+                        "{1}".format(delta.path, prev.path))
+
+        # Check plugins used by the deltas
+        plugins = dict((plugin.NAME, plugin)
+                       for plugin in PLUGINS + [GENERAL_PLUGIN])
+        for delta in self.deltas:
+            for bundle in delta.deltametadata.usedplugins.values():
+                plugin = plugins.get(bundle.name)
+                if plugin is None:
+                    raise DeltaRepoCompositionError("Unknown plugin {0} "
+                            "used by {1}".format(bundle.name, delta.path))
+                if bundle.version > plugin.VERSION:
+                    raise DeltaRepoError("Delta {0} is generated by "
+                        "plugin {1} with version: {2}, but locally available "
+                        "is only version: {3}".format(delta.path, plugin.NAME,
+                        bundle.version, plugin.VERSION))
+
+    def _is_processed(self, metadata_type):
+        return self.processed_types is None or \
+                metadata_type in self.processed_types
+
+    def _package_metadata(self):
+        """Return types of package metadata which are composed.
+        Metadata which are not processed or whose delta file is missing
+        (e.g. it was not downloaded) are skipped - the applicator
+        of the composed delta doesn't produce them."""
+        metadata_types = []
+        for metadata_type in PACKAGE_METADATA:
+            if not self._is_processed(metadata_type):
+                continue
+            missing = [delta.path for delta in self.deltas
+                       if delta.mode(metadata_type) == "delta" and
+                       not delta.fn(metadata_type)]
+            if missing and metadata_type != "primary":
+                self._debug("\"{0}\": Delta file is missing in {1} - "
+                            "Skipping".format(metadata_type,
+                                              ", ".join(missing)))
+                continue
+            metadata_types.append(metadata_type)
+        return metadata_types
+
+    def _check_content_hash(self, pkg_id_tuples, expected, what):
+        contenthash_type = self.deltas[0].contenthash_type
+        calculated = content_hashes_from_ids(pkg_id_tuples, [contenthash_type],
+                                             self._get_logger())[contenthash_type]
+        if calculated != expected:
+            raise DeltaRepoCompositionError("Content hash of the {0} doesn't "
+                    "match the expected one ({1} != {2})".format(
+                    what, calculated, expected))
+        self._debug("Content hash of the {0} matches ({1})".format(what,
+                                                                   expected))
+
+    def _old_ids(self):
+        """Return identities of packages of the old repository"""
+        old_repomd = cr.Repomd(os.path.join(self.old_repo_path,
+                                            "repodata", "repomd.xml"))
+        old_primary = None
+        for rec in old_repomd.records:
+            if rec.type == "primary":
+                old_primary = os.path.join(self.old_repo_path,
+                                           rec.location_href)
+        if not old_primary or not os.path.isfile(old_primary):
+            raise DeltaRepoError("Missing \"primary\" metadata in old repo")
+        return list(iter_primary_ids(old_primary))
+
+    def _compose_packages(self):
+        """Compose changes of packages made by the deltas.
+
+        Returns tuple (PackageChanges or None if packages are not changed
+        by any delta, list of types of package metadata)"""
+        changes = PackageChanges()
+        changed = False
+        present = None
+        package_metadata = self._package_metadata()
+
+        old_ids = None
+        if self.old_repo_path:
+            old_ids = self._old_ids()
+            self._check_content_hash(old_ids, self.deltas[0].src_contenthash,
+                                     "old repository")
+        else:
+            self._debug("Old repository is not available, content hashes "
+                        "of the intermediate repositories are not verified")
+
+        for index, delta in enumerate(self.deltas):
+            bundle = delta.deltametadata.get_pluginbundle(
+                                                MainDeltaRepoPlugin.NAME)
+            if bundle is None:
+                raise DeltaRepoCompositionError("{0} doesn't have a delta "
+                        "of packages".format(delta.path))
+            for listname, _, _ in MainDeltaRepoPlugin.ELEMENT_DELTAS.values():
+                if bundle.get_list(listname):
+                    raise DeltaRepoCompositionError("{0} contains element "
+                            "deltas of packages".format(delta.path))
+
+            modes = dict((x, delta.mode(x)) for x in package_metadata)
+            delta_present = [x for x in package_metadata if modes[x]]
+            if present is not None and delta_present != present:
+                raise DeltaRepoCompositionError("{0} changes the set of "
+                        "package metadata".format(delta.path))
+            present = delta_present
+
+            pri_mode = modes["primary"]
+            if pri_mode not in ("unchanged", "delta") or \
+                    [x for x in present if modes[x] != pri_mode]:
+                raise DeltaRepoCompositionError("{0} doesn't contain "
+                        "a composable delta of packages".format(delta.path))
+
+            if pri_mode == "unchanged":
+                if delta.src_contenthash != delta.dst_contenthash:
+                    raise DeltaRepoCompositionError("{0} changes content "
+                            "hash of unchanged packages".format(delta.path))
+                continue
+
+            removed = []
+            for record in bundle.get_list("removedpackage", []):
+                if record.get("location_href"):
+                    removed.append((record.get("location_href"),
+                                    record.get("location_base")))
+            if not delta.fn("primary"):
+                raise DeltaRepoCompositionError("primary of {0} is "
+                                                "missing".format(delta.path))
+            changes.add_delta(index, removed,
+                              iter_primary_ids(delta.fn("primary")))
+            changed = True
+
+            if old_ids is None:
+                continue
+            self._check_content_hash(changes.identities(old_ids),
+                                     delta.dst_contenthash,
+                                     "repository made by {0}".format(
+                                     delta.path))
+
+        return (changes if changed else None), present
+
+    def _compose_basic(self):
+        """Compose metadata which are not deltas (unchanged, original
+        or removed files) - i.e. all metadata except the package ones.
+
+        Returns dict {metadata_type: (index of delta with the file or None
+        for the file from the old repo, plugin name, notes)}"""
+        skipped = set(MainDeltaRepoPlugin.METADATA)
+        skipped.add("deltametadata")
+
+        metadata_types = set()
+        for delta in self.deltas:
+            metadata_types.update(delta.notes.keys())
+            metadata_types.update(delta.records.keys())
+        metadata_types -= skipped
+        metadata_types = set(x for x in metadata_types if self._is_processed(x))
+
+        state = dict((x, (None, None, {})) for x in metadata_types)
+        for index, delta in enumerate(self.deltas):
+            for metadata_type in metadata_types:
+                mode = delta.mode(metadata_type)
+                if metadata_type not in delta.notes or mode is None:
+                    # Removed
+                    state.pop(metadata_type, None)
+                    continue
+
+                plugin_name, notes = delta.notes[metadata_type]
+                if mode == "original":
+                    state[metadata_type] = (index, plugin_name, notes)
+                elif mode == "delta":
+                    raise DeltaRepoCompositionError("{0} contains a delta "
+                            "of {1}".format(delta.path, metadata_type))
+                elif metadata_type not in state:
+                    self._warning("\"{0}\": Unchanged in {1}, but it "
+                                  "doesn't exist".format(metadata_type,
+                                                         delta.path))
+                else:
+                    src_index, _, src_notes = state[metadata_type]
+                    if src_index is not None:
+                        # The file from a previous delta is still used
+                        notes = dict((key, val) for key, val in notes.items()
+                                     if key not in BASIC_NOTES)
+                        notes.update((key, val) for key, val in
+                                     src_notes.items() if key in BASIC_NOTES)
+                    state[metadata_type] = (src_index, plugin_name, notes)
+
+        return state
+
+    def compose(self, delta_repo_path):
+        """Write a delta repository which is equivalent to the chain
+        of the deltas into the directory. The repodata are written
+        into a temporary directory and renamed at the end, so there
+        is no repodata if the composition fails.
+
+        :param delta_repo_path: Existing directory for the composed delta
+        :type delta_repo_path: str
+        """
+        first = self.deltas[0]
+        last = self.deltas[-1]
+
+        changes, package_metadata = self._compose_packages()
+        basic = self._compose_basic()
+
+        final_path = os.path.join(delta_repo_path, "repodata")
+        repodata_path = os.path.join(delta_repo_path, ".repodata")
+        if os.path.exists(final_path):
+            raise DeltaRepoError("Repodata already exist in "
+                                 "{0}".format(delta_repo_path))
+        os.mkdir(repodata_path)
+        try:
+            self._compose(repodata_path, changes, package_metadata, basic)
+        except Exception:
+            shutil.rmtree(repodata_path)
+            raise
+        os.rename(repodata_path, final_path)
+        self._debug("Composed delta {0}-{1} written to {2}".format(
+                    first.src_contenthash, last.dst_contenthash,
+                    delta_repo_path))
+
+    def _compose(self, repodata_path, changes, package_metadata, basic):
+        """Write the composed delta into the repodata directory"""
+        first = self.deltas[0]
+        last = self.deltas[-1]
+
+        deltametadata_rec = last.records["deltametadata"]
+        checksum_type = cr.checksum_type(deltametadata_rec.checksum_type)
+        unique_md_filenames = os.path.basename(
+                deltametadata_rec.location_href).split("deltametadata")[0] != ""
+
+        repomd = cr.Repomd()
+        repomd.set_revision(last.repomd.revision)
+        for tag in last.repomd.distro_tags:
+            repomd.add_distro_tag(tag[1], tag[0])
+        for tag in last.repomd.repo_tags:
+            repomd.add_repo_tag(tag)
+        for tag in last.repomd.content_tags:
+            repomd.add_content_tag(tag)
+
+        bundles = {}
+
+        def get_bundle(name):
+            if name not in bundles:
+                version = max([delta.deltametadata.get_pluginbundle(name).version
+                               for delta in self.deltas
+                               if delta.deltametadata.get_pluginbundle(name)])
+                bundles[name] = PluginBundle(name, version)
+            return bundles[name]
+
+        def add_notes(name, metadata_type, notes):
+            dictionary = {"type": metadata_type}
+            dictionary.update(notes)
+            get_bundle(name).append("metadata", dictionary)
+
+        # Package metadata
+        main_bundle = get_bundle(MainDeltaRepoPlugin.NAME)
+        for metadata_type in package_metadata:
+            last_notes = last.notes[metadata_type][1]
+            if changes is None:
+                # Packages are unchanged in the whole chain
+                add_notes(main_bundle.name, metadata_type, last_notes)
+                continue
+            add_notes(main_bundle.name, metadata_type,
+                      {"database": last_notes.get("database", "0")})
+
+            last_rec = last.records[metadata_type]
+            compression_type = cr.XZ
+            if last.fn(metadata_type):
+                compression_type = cr.detect_compression(last.fn(metadata_type))
+            suffix = cr.compression_suffix(compression_type) or ""
+            fn = os.path.join(repodata_path, "{0}.xml{1}".format(metadata_type,
+                                                                 suffix))
+            md_checksum_type = cr.checksum_type(last_rec.checksum_type)
+            stat = cr.ContentStat(md_checksum_type)
+            xmlclass = MainDeltaRepoPlugin.XML_FILE_CLASSES[metadata_type]
+            delta_f = xmlclass(fn, compression_type, stat)
+            delta_f.set_num_of_pkgs(len(changes.added))
+            for index, delta in enumerate(self.deltas):
+                pkg_id_tuples = changes.added_by(index)
+                if not pkg_id_tuples:
+                    continue
+                if not delta.fn(metadata_type):
+                    raise DeltaRepoCompositionError("{0} of {1} is "
+                            "missing".format(metadata_type, delta.path))
+                missing = write_raw_packages(delta.fn(metadata_type),
+                                             metadata_type, pkg_id_tuples,
+                                             delta_f)
+                if missing:
+                    raise DeltaRepoCompositionError("Packages {0} are missing "
+                            "in {1} of {2}".format(missing, metadata_type,
+                                                   delta.path))
+            delta_f.close()
+
+            rec = cr.RepomdRecord(metadata_type, fn)
+            rec.load_contentstat(stat)
+            rec.fill(md_checksum_type)
+            if unique_md_filenames:
+                rec.rename_file()
+            repomd.set_record(rec)
+
+        if changes is not None:
+            main_bundle.set("contenthash_type", first.contenthash_type)
+            main_bundle.set("src_contenthash", first.src_contenthash)
+            main_bundle.set("dst_contenthash", last.dst_contenthash)
+            for location_href, location_base in changes.removed:
+                dictionary = {"location_href": location_href}
+                if location_base:
+                    dictionary["location_base"] = location_base
+                main_bundle.append("removedpackage", dictionary)
+
+        # Other metadata
+        for metadata_type, (index, plugin_name, notes) in sorted(basic.items()):
+            if index is not None:
+                delta = self.deltas[index]
+                src_fn = delta.fn(metadata_type)
+                if not src_fn:
+                    self._warning("\"{0}\": Delta file is missing in "
+                                  "{1}".format(metadata_type, delta.path))
+                    continue
+                fn = os.path.join(repodata_path, os.path.basename(src_fn))
+                shutil.copy2(src_fn, fn)
+                rec = cr.RepomdRecord(metadata_type, fn)
+                rec.fill(cr.checksum_type(
+                            delta.records[metadata_type].checksum_type))
+                repomd.set_record(rec)
+            add_notes(plugin_name, metadata_type, notes)
+
+        # Deltametadata
+        deltametadata = DeltaMetadata()
+        deltametadata.revision_src = first.deltametadata.revision_src
+        deltametadata.revision_dst = last.deltametadata.revision_dst
+        deltametadata.contenthash_type = first.contenthash_type
+        deltametadata.contenthash_src = first.src_contenthash
+        deltametadata.contenthash_dst = last.dst_contenthash
+        deltametadata.timestamp_src = first.deltametadata.timestamp_src
+        deltametadata.timestamp_dst = last.deltametadata.timestamp_dst
+        for bundle in bundles.values():
+            deltametadata.add_pluginbundle(bundle)
+
+        compression_type = cr.detect_compression(last.fn("deltametadata"))
+        if compression_type == cr.UNKNOWN_COMPRESSION:
+            compression_type = cr.XZ
+        stat = cr.ContentStat(checksum_type)
+        deltametadata_path = deltametadata.dump(
+                os.path.join(repodata_path, "deltametadata.xml"),
+                compression_type=compression_type, stat=stat)
+        rec = cr.RepomdRecord("deltametadata", deltametadata_path)
+        rec.load_contentstat(stat)
+        rec.fill(checksum_type)
+        if unique_md_filenames:
+            rec.rename_file()
+        repomd.set_record(rec)
+
+        # Repomd
+        repomd.set_contenthash("{0}-{1}".format(first.src_contenthash,
+                                                last.dst_contenthash),
+                               first.contenthash_type)
+        repomd.sort_records()
+        open(os.path.join(repodata_path, "repomd.xml"), "w").write(
+                repomd.xml_dump())
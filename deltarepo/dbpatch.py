@@ -0,0 +1,155 @@
+"""
+Incremental patching of sqlite databases (primary_db, filelists_db
+and other_db) of a repository.
+
+A database of the new repository doesn't have to be built from all
+packages. The database of the old repository is decompressed, rows
+of the removed packages are deleted and only the delta packages are
+inserted (by createrepo_c, which doesn't recreate tables of an existing
+database). Cost of such update is proportional to the number of changed
+packages instead of the size of the repository.
+
+A delta could also contain a database delta - a small database with
+rows of the delta packages. Its rows are inserted directly, so even
+the delta packages don't have to be converted from xml.
+"""
+
+import os
+import sqlite3
+
+__all__ = ["db_checksum", "package_count", "remove_packages",
+           "insert_packages"]
+
+
+def _connect(path):
+    conn = sqlite3.connect(path)
+    conn.text_factory = str
+    return conn
+
+
+def db_checksum(path):
+    """Return checksum of the XML file from which the database was
+    generated (stored in the db_info table) or None"""
+    if not os.path.isfile(path):
+        return None
+    conn = _connect(path)
+    try:
+        row = conn.execute("SELECT checksum FROM db_info").fetchone()
+    except sqlite3.Error:
+        row = None
+    finally:
+        conn.close()
+    if not row:
+        return None
+    return row[0]
+
+
+def package_count(path):
+    """Return number of packages in the database"""
+    conn = _connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM packages").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _columns(conn, table, schema="main"):
+    return [row[1] for row in
+            conn.execute("PRAGMA {0}.table_info('{1}')".format(schema, table))]
+
+
+def _pkgkey_tables(conn):
+    """Return names of tables (except the packages table) with rows
+    that belong to packages (tables with pkgKey column)"""
+    tables = []
+    for (name,) in conn.execute("SELECT name FROM sqlite_master "
+                                "WHERE type='table'"):
+        if name == "packages":
+            continue
+        if "pkgKey" in _columns(conn, name):
+            tables.append(name)
+    return tables
+
+
+def remove_packages(path, pkgids=None, locations=None):
+    """Delete rows of the packages (and all rows that belong to them)
+    from the database.
+
+    :param path: Path to an uncompressed sqlite database
+    :type path: str
+    :param pkgids: pkgIds of the removed packages
+    :type pkgids: iterable or None
+    :param locations: Locations (location_href, location_base)
+                      of the removed packages (primary_db only)
+    :type locations: iterable or None
+    :returns: Number of packages left in the database
+    :rtype: int
+    """
+    conn = _connect(path)
+    try:
+        conn.execute("CREATE TEMP TABLE removed (pkgKey INTEGER PRIMARY KEY)")
+        if pkgids:
+            conn.executemany("INSERT OR IGNORE INTO removed SELECT pkgKey "
+                             "FROM packages WHERE pkgId=?",
+                             ((pkgid,) for pkgid in pkgids))
+        if locations:
+            conn.executemany("INSERT OR IGNORE INTO removed SELECT pkgKey "
+                             "FROM packages WHERE location_href=? AND "
+                             "IFNULL(location_base, '')=?",
+                             ((href, base or "") for href, base in locations))
+
+        # Databases usually delete the rows by triggers, but not
+        # every database has them
+        for table in _pkgkey_tables(conn):
+            conn.execute("DELETE FROM {0} WHERE pkgKey IN "
+                         "(SELECT pkgKey FROM removed)".format(table))
+        conn.execute("DELETE FROM packages WHERE pkgKey IN "
+                     "(SELECT pkgKey FROM removed)")
+        conn.commit()
+        return conn.execute("SELECT COUNT(*) FROM packages").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def insert_packages(path, payload_path):
+    """Insert all packages (and all rows that belong to them) from
+    the payload database into the database. Keys of the inserted
+    packages follow keys of the packages already in the database.
+    Nothing is inserted if the databases don't have the same tables.
+
+    :param path: Path to an uncompressed sqlite database
+    :type path: str
+    :param payload_path: Path to an uncompressed database (of the same
+                         type) with the packages
+    :type payload_path: str
+    :returns: Number of inserted packages
+    :rtype: int
+    :raises: sqlite3.Error
+    """
+    conn = _connect(path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS payload", (payload_path,))
+        offset = conn.execute("SELECT IFNULL(MAX(pkgKey), 0) "
+                              "FROM packages").fetchone()[0]
+        # Pragmas (implicitly) commit the transaction, the columns
+        # must be known before the first insert
+        tables = [(x, _columns(conn, x))
+                  for x in ["packages"] + _pkgkey_tables(conn)]
+        try:
+            for table, columns in tables:
+                values = ["pkgKey + ?" if x == "pkgKey" else x
+                          for x in columns]
+                conn.execute("INSERT INTO {0} ({1}) SELECT {2} FROM "
+                             "payload.{0}".format(table, ", ".join(columns),
+                                                  ", ".join(values)),
+                             (offset,))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        inserted = conn.execute("SELECT COUNT(*) FROM "
+                                "payload.packages").fetchone()[0]
+        conn.execute("DETACH DATABASE payload")
+        return inserted
+    finally:
+        conn.close()
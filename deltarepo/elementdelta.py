@@ -0,0 +1,151 @@
+"""
+Deltas of repeated child elements of packages (changelogs and files).
+
+A new build of a package usually carries almost the same changelog
+as its previous build, just with a few new entries. If the previous
+build (a package with the same name.arch) was removed from the repo,
+only the new elements are stored in the delta and an edit script
+describes how to rebuild the full list from the elements of
+the previous build.
+
+Edit script is a string of comma separated operations:
+
+    kSTART:END  - keep elements START..END-1 of the base (old) package
+    iCOUNT      - insert next COUNT elements from the delta package
+
+E.g. "k0:12,i1" means: Take the first twelve elements of the base
+package and append the only element from the delta package.
+"""
+
+import re
+import difflib
+
+from .scanner import iter_package_ranges, package_attrs
+from .errors import DeltaRepoError
+
+__all__ = ["ELEMENT_RES", "diff_sequences", "patch_sequence",
+           "index_base_fragments", "delta_fragment"]
+
+# Regular expressions of supported child elements
+ELEMENT_RES = {
+    "other": re.compile(r'<changelog\b[^>]*?(?:/>|>[^<]*</changelog>)'),
+    "filelists": re.compile(r'<file\b[^>]*?(?:/>|>[^<]*</file>)'),
+}
+
+
+def diff_sequences(old, new):
+    """Diff two sequences of comparable items.
+
+    :returns: Tuple (script, inserted), where inserted is a list of
+              indexes (to the new sequence) of the items that are
+              not taken from the old sequence
+    :rtype: tuple
+    """
+    ops = []
+    inserted = []
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append("k{0}:{1}".format(i1, i2))
+        elif tag in ("replace", "insert"):
+            ops.append("i{0}".format(j2 - j1))
+            inserted.extend(xrange(j1, j2))
+    return ",".join(ops), inserted
+
+
+def patch_sequence(old, script, inserted):
+    """Rebuild a new sequence from the old one.
+
+    :param old: Items of the base (old) package
+    :type old: list
+    :param script: Edit script returned by diff_sequences()
+    :type script: str
+    :param inserted: Items stored in the delta (in the original order)
+    :type inserted: list
+    :returns: Rebuilt list of items
+    :rtype: list
+    """
+    new = []
+    next_inserted = 0
+    for op in script.split(",") if script else []:
+        try:
+            if op[0] == "k":
+                start, end = [int(x) for x in op[1:].split(":")]
+                if not 0 <= start <= end <= len(old):
+                    raise ValueError
+                new.extend(old[start:end])
+            elif op[0] == "i":
+                count = int(op[1:])
+                if count < 0 or next_inserted + count > len(inserted):
+                    raise ValueError
+                new.extend(inserted[next_inserted:next_inserted+count])
+                next_inserted += count
+            else:
+                raise ValueError
+        except (ValueError, IndexError):
+            raise DeltaRepoError("Bad edit script operation \"{0}\" "
+                                 "in \"{1}\"".format(op, script))
+
+    if next_inserted != len(inserted):
+        raise DeltaRepoError("Edit script \"{0}\" doesn't use all "
+                             "inserted items".format(script))
+    return new
+
+
+def index_base_fragments(data, metadata_type, pkgids):
+    """Find <package> elements of the packages with the pkgids
+    in uncompressed filelists.xml or other.xml data.
+
+    :returns: Dict {(name, arch): (pkgId, start, end)}. Name.arch
+              pairs shared by more than one of the packages are
+              omitted (the base package would be ambiguous).
+    :rtype: dict
+    """
+    index = {}
+    ambiguous = set()
+    for pkgid, start, end in iter_package_ranges(data, metadata_type):
+        if pkgid not in pkgids:
+            continue
+        attrs = package_attrs(data[start:end])
+        key = (attrs.get("name"), attrs.get("arch"))
+        if key in index:
+            ambiguous.add(key)
+        index[key] = (pkgid, start, end)
+
+    for key in ambiguous:
+        del index[key]
+    return index
+
+
+def delta_fragment(fragment, base_fragment, element_re):
+    """Make a delta of <package> element against <package> element
+    of its previous build.
+
+    :param fragment: <package> element of the new package
+    :type fragment: str
+    :param base_fragment: <package> element of the base package
+    :type base_fragment: str
+    :param element_re: Regular expression of the child elements
+    :returns: Tuple (delta_fragment, script) or (None, None) if the
+              packages don't share any child element
+    :rtype: tuple
+    """
+    matches = list(element_re.finditer(fragment))
+    base_elements = element_re.findall(base_fragment)
+    script, inserted = diff_sequences(base_elements,
+                                      [m.group(0) for m in matches])
+    if len(inserted) == len(matches):
+        # Nothing could be taken from the base package
+        return None, None
+
+    # Each element is written with its preceding whitespaces
+    inserted = set(inserted)
+    parts = []
+    prev_end = len(fragment[:matches[0].start()].rstrip())
+    parts.append(fragment[:prev_end])
+    for i, match in enumerate(matches):
+        if i in inserted:
+            parts.append(fragment[prev_end:match.end()])
+        prev_end = match.end()
+    parts.append(fragment[prev_end:])
+    return "".join(parts), script
@@ -1,5 +1,6 @@
 
-__all__ = ["DeltaRepoError", "DeltaRepoPluginError"]
+__all__ = ["DeltaRepoError", "DeltaRepoPluginError",
+           "DeltaRepoCompositionError"]
 
 class DeltaRepoError(Exception):
     """Exception raised by deltarepo library"""
@@ -11,4 +12,9 @@ class DeltaRepoPluginError(DeltaRepoError):
 
 class DeltaRepoParseError(DeltaRepoError):
     """Exception raised when a parse error occurs"""
-    pass
\ No newline at end of file
+    pass
+
+class DeltaRepoCompositionError(DeltaRepoError):
+    """Exception raised when deltas cannot be composed into a single delta
+    (they have to be applied one by one)"""
+    pass
@@ -0,0 +1,236 @@
+"""
+Store of raw <package> elements shared by many repository revisions.
+
+The <package> elements of a package (from primary.xml, filelists.xml
+and other.xml) are the same in all revisions of a repository which
+contain the package. A mirror that keeps several revisions
+of a repository can store each element just once (in a sqlite
+database) and assemble any delta from lists of package identities
+(see the manifest module) and lookups into the store. No XML
+file has to be scanned during such generation.
+
+Elements from filelists.xml and other.xml are keyed by pkgId.
+Elements from primary.xml also contain location of the package,
+so they are keyed by the whole identity (pkgId, location_href,
+location_base).
+"""
+
+import os
+import zlib
+import sqlite3
+
+from .scanner import mapped, iter_package_ranges, iter_primary_ranges
+from .manifest import repomd_records
+from .util import log_debug
+
+__all__ = ["FragmentStore"]
+
+# Metadata types with stored elements
+FRAGMENT_METADATA = ("primary", "filelists", "other")
+
+# Number of elements fetched by one query
+_QUERY_CHUNK = 500
+
+
+class FragmentStore(object):
+    """Content-addressed store of raw <package> elements.
+
+    The database is opened lazily (and reopened in a forked worker
+    process), so the object could be shared by worker processes.
+    The object is picklable, only the path to the database is pickled.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._connect().execute("""CREATE TABLE IF NOT EXISTS fragments (
+                                    type TEXT,
+                                    pkgid TEXT,
+                                    href TEXT,
+                                    base TEXT,
+                                    fragment BLOB,
+                                    PRIMARY KEY (type, pkgid, href, base))""")
+        # Already added repositories (identified by primary.xml checksum)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS repos (
+                                checksum TEXT PRIMARY KEY)""")
+        self._conn.commit()
+
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            # A sqlite connection must not be used across fork()
+            self._conn = sqlite3.connect(self.path)
+            self._conn.text_factory = str
+            self._pid = os.getpid()
+        return self._conn
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._conn = None
+        self._pid = None
+
+    @staticmethod
+    def _key(metadata_type, pkg_id_tuple):
+        pkgid, href, base = pkg_id_tuple
+        if metadata_type != "primary":
+            href = base = None
+        return (metadata_type, pkgid or "", href or "", base or "")
+
+    def close(self):
+        """Close the database (it is reopened on demand)"""
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.commit()
+            self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    def __len__(self):
+        return self._connect().execute(
+                "SELECT COUNT(*) FROM fragments").fetchone()[0]
+
+    def has(self, metadata_type, pkg_id_tuple):
+        """Check if the <package> element of the package is stored"""
+        return self._connect().execute(
+                "SELECT 1 FROM fragments WHERE type=? AND pkgid=? AND "
+                "href=? AND base=?",
+                self._key(metadata_type, pkg_id_tuple)).fetchone() is not None
+
+    def add(self, metadata_type, pkg_id_tuple, fragment):
+        """Add a <package> element (if it is not already stored).
+
+        :param metadata_type: "primary", "filelists" or "other"
+        :type metadata_type: str
+        :param pkg_id_tuple: Identity (pkgId, location_href, location_base)
+        :type pkg_id_tuple: tuple
+        :param fragment: Raw <package> element
+        :type fragment: str
+        """
+        self._connect().execute(
+                "INSERT OR IGNORE INTO fragments VALUES (?, ?, ?, ?, ?)",
+                self._key(metadata_type, pkg_id_tuple) +
+                (sqlite3.Binary(zlib.compress(fragment)),))
+
+    def commit(self):
+        """Write out all added elements"""
+        self._connect().commit()
+
+    def get_many(self, metadata_type, pkg_id_tuples):
+        """Return list of <package> elements of the packages
+        (in the same order) or None if any of them is not stored.
+
+        :param metadata_type: "primary", "filelists" or "other"
+        :type metadata_type: str
+        :param pkg_id_tuples: Identities (pkgId, location_href, location_base)
+        :type pkg_id_tuples: list
+        :rtype: list or None
+        """
+        conn = self._connect()
+        keys = [self._key(metadata_type, x) for x in pkg_id_tuples]
+        found = {}
+        unique_keys = list(set(keys))
+        for i in xrange(0, len(unique_keys), _QUERY_CHUNK):
+            chunk = unique_keys[i:i+_QUERY_CHUNK]
+            query = "SELECT type, pkgid, href, base, fragment FROM " \
+                    "fragments WHERE " + " OR ".join(
+                    ["(type=? AND pkgid=? AND href=? AND base=?)"] * len(chunk))
+            params = [item for key in chunk for item in key]
+            for row in conn.execute(query, params):
+                found[tuple(row[:4])] = row[4]
+        if len(found) != len(unique_keys):
+            return None
+        return [zlib.decompress(str(found[key])) for key in keys]
+
+    def prune(self, manifests):
+        """Remove elements of all packages which are not listed
+        in any of the manifests (e.g. of the removed revisions).
+
+        :param manifests: Manifests of the retained repositories
+        :type manifests: list of manifest.Manifest
+        :returns: Number of removed elements
+        :rtype: int
+        """
+        conn = self._connect()
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS retained "
+                     "(type TEXT, pkgid TEXT, href TEXT, base TEXT)")
+        conn.execute("DELETE FROM retained")
+        for manifest in manifests:
+            for metadata_type in FRAGMENT_METADATA:
+                conn.executemany("INSERT INTO retained VALUES (?, ?, ?, ?)",
+                                 (self._key(metadata_type, x)
+                                  for x in manifest.identities))
+        cur = conn.execute("DELETE FROM fragments WHERE NOT EXISTS "
+                           "(SELECT 1 FROM retained r WHERE "
+                           "r.type=fragments.type AND "
+                           "r.pkgid=fragments.pkgid AND "
+                           "r.href=fragments.href AND "
+                           "r.base=fragments.base)")
+        removed = cur.rowcount
+        conn.execute("DELETE FROM retained")
+        conn.execute("DELETE FROM repos")
+        conn.executemany("INSERT OR IGNORE INTO repos VALUES (?)",
+                         ((m.checksums["primary"][1],) for m in manifests))
+        conn.commit()
+        return removed
+
+    def add_repo(self, repo_path, manifest=None, records=None, logger=None):
+        """Add <package> elements of all packages from the repository.
+        Already added repository (with the same primary.xml) is skipped.
+
+        :param repo_path: Path to a repository (a dir with repodata/)
+        :type repo_path: str
+        :param manifest: Up to date manifest of the repo. If specified,
+                         the stored offsets are used instead of
+                         identification of packages in the XML files
+                         (only the new packages are read).
+        :type manifest: manifest.Manifest or None
+        :param records: Repomd records {metadata_type: record} of the repo
+                        (loaded from repomd.xml if not specified)
+        :type records: dict or None
+        :returns: Number of newly stored elements
+        :rtype: int
+        """
+        if records is None:
+            records = repomd_records(repo_path)
+        if "primary" not in records:
+            return 0
+        checksum = records["primary"].checksum
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM repos WHERE checksum=?",
+                        (checksum,)).fetchone():
+            return 0
+
+        before = len(self)
+        for metadata_type in FRAGMENT_METADATA:
+            rec = records.get(metadata_type)
+            if rec is None:
+                continue
+            path = os.path.join(repo_path, rec.location_href)
+            if not os.path.isfile(path):
+                continue
+
+            log_debug(logger, "Fragment store: Adding {0}".format(path))
+            with mapped(path) as data:
+                if manifest is not None and metadata_type in manifest.offsets:
+                    for pkg_id_tuple, start, end in \
+                            manifest.iter_ranges(metadata_type):
+                        # Skip already stored packages without reading them
+                        if not self.has(metadata_type, pkg_id_tuple):
+                            self.add(metadata_type, pkg_id_tuple,
+                                     data[start:end])
+                elif metadata_type == "primary":
+                    for pkgid, href, base, start, end in \
+                            iter_primary_ranges(data):
+                        self.add(metadata_type, (pkgid, href, base),
+                                 data[start:end])
+                else:
+                    for pkgid, start, end in iter_package_ranges(data,
+                                                            metadata_type):
+                        self.add(metadata_type, (pkgid, None, None),
+                                 data[start:end])
+
+        conn.execute("INSERT INTO repos VALUES (?)", (checksum,))
+        self.commit()
+        return len(self) - before
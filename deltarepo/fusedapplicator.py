@@ -0,0 +1,93 @@
+"""
+Fused application of a chain of delta repositories.
+
+Application of N deltas one by one (old -> r1 -> ... -> new) writes
+(and compresses) the whole repodata N times, although almost all
+packages are just carried over from the old repository. The deltas
+are composed into a single delta (old -> new) instead - only the sets
+of removed and added packages are composed in the memory - and the
+old repository is rewritten just once.
+
+The composition is done by the DeltaRepoComposer. The old repository
+is available, so content hashes of all intermediate repositories are
+verified during the composition.
+
+Not every chain could be composed (e.g. when a delta contains element
+level deltas of packages or the whole primary.xml). In such case
+the DeltaRepoCompositionError is raised before anything is written
+and the deltas have to be applied one by one.
+"""
+
+import shutil
+import tempfile
+from .common import LoggingInterface
+from .applicator import DeltaRepoApplicator
+from .composer import DeltaRepoComposer
+from .errors import DeltaRepoError
+
+__all__ = ["FusedDeltaRepoApplicator"]
+
+
+class FusedDeltaRepoApplicator(LoggingInterface):
+    """Apply a chain of delta repositories at once."""
+
+    def __init__(self,
+                 old_repo_path,
+                 delta_repo_paths,
+                 out_path=None,
+                 logger=None,
+                 force_database=False,
+                 ignore_missing=False,
+                 patch_databases=False,
+                 target_metadata=None):
+
+        LoggingInterface.__init__(self, logger)
+
+        if not delta_repo_paths:
+            raise DeltaRepoError("No delta repository to apply")
+
+        self.old_repo_path = old_repo_path
+        self.delta_repo_paths = list(delta_repo_paths)
+        self.out_path = out_path or "./"
+        self.force_database = force_database
+        self.ignore_missing = ignore_missing
+        self.patch_databases = patch_databases
+        self.target_metadata = target_metadata
+
+        # Deltas are checked before anything is applied
+        self.composer = DeltaRepoComposer(self.delta_repo_paths,
+                                          old_repo_path=self.old_repo_path,
+                                          logger=self._get_logger(),
+                                          target_metadata=target_metadata)
+        self.deltas = self.composer.deltas
+
+    def apply(self):
+        """Apply the chain of deltas. DeltaRepoCompositionError is raised
+        (before anything is written) if the deltas cannot be composed."""
+        if len(self.deltas) == 1:
+            DeltaRepoApplicator(self.old_repo_path,
+                                self.delta_repo_paths[0],
+                                out_path=self.out_path,
+                                logger=self._get_logger(),
+                                force_database=self.force_database,
+                                ignore_missing=self.ignore_missing,
+                                patch_databases=self.patch_databases,
+                                target_metadata=self.target_metadata).apply()
+            return
+
+        tmpdir = tempfile.mkdtemp(prefix="deltarepo-fused-",
+                                  dir=self.out_path)
+        try:
+            self._debug("Composing {0} deltas".format(len(self.deltas)))
+            self.composer.compose(tmpdir)
+            self._debug("Applying the composed delta")
+            DeltaRepoApplicator(self.old_repo_path,
+                                tmpdir,
+                                out_path=self.out_path,
+                                logger=self._get_logger(),
+                                force_database=self.force_database,
+                                ignore_missing=self.ignore_missing,
+                                patch_databases=self.patch_databases,
+                                target_metadata=self.target_metadata).apply()
+        finally:
+            shutil.rmtree(tmpdir)
@@ -10,13 +10,18 @@ Copyright (C) 2013   Tomas Mlcoch
 
 import os
 import shutil
+import traceback
 import createrepo_c as cr
 from .common import LoggingInterface
 from .plugins_common import GlobalBundle, Metadata
+from .plugins_common import repomd_record_to_dict, repomd_record_from_dict
 from .deltametadata import DeltaMetadata, PluginBundle
 from .common import DEFAULT_CHECKSUM_TYPE, DEFAULT_COMPRESSION_TYPE
 from .plugins import GlobalBundle, PLUGINS, GENERAL_PLUGIN
+from .parallel import run_in_processes, split_workers
 from .util import calculate_content_hash, pkg_id_str
+from .util import log_debug, log_error, PrefixLoggerAdapter
+from .manifest import load_manifest, build_manifest, repomd_records
 from .errors import DeltaRepoError
 
 __all__ = ['DeltaRepoGenerator']
@@ -31,7 +36,15 @@ class DeltaRepoGenerator(LoggingInterface):
                  contenthash_type="sha256",
                  compression_type="xz",
                  force_database=False,
-                 ignore_missing=False):
+                 ignore_missing=False,
+                 max_memory=None,
+                 changelog_delta=False,
+                 filelist_delta=False,
+                 db_delta=False,
+                 use_manifests=True,
+                 fragment_store=None,
+                 new_manifest=None,
+                 max_workers=None):
 
         # Initialization
 
@@ -112,6 +125,7 @@ class DeltaRepoGenerator(LoggingInterface):
         self.new_contenthash = self.new_repomd.contenthash
 
         self.deltametadata = DeltaMetadata()
+        self.max_workers = max_workers  # Max. number of worker processes
 
         # Prepare global bundle
         self.globalbundle = GlobalBundle()
@@ -119,6 +133,30 @@ class DeltaRepoGenerator(LoggingInterface):
         self.globalbundle.unique_md_filenames = self.unique_md_filenames
         self.globalbundle.force_database = force_database
         self.globalbundle.ignore_missing = ignore_missing
+        self.globalbundle.max_memory = max_memory
+        self.globalbundle.changelog_delta = changelog_delta
+        self.globalbundle.filelist_delta = filelist_delta
+        self.globalbundle.db_delta = db_delta
+        self.globalbundle.fragment_store = fragment_store
+
+        # Use manifests of the repos (if available and up to date)
+        # Manifest of the new repo could be shared by generators
+        # of deltas from several old repos (see gen_many())
+        if new_manifest is not None and not new_manifest.matches(
+                                                        self.new_records):
+            raise DeltaRepoError("Manifest doesn't match the new repo")
+        self.globalbundle.new_manifest = new_manifest
+        if use_manifests:
+            self.globalbundle.old_manifest = load_manifest(
+                    self.old_repo_path, self.old_records, self._get_logger())
+            if new_manifest is None:
+                self.globalbundle.new_manifest = load_manifest(
+                        self.new_repo_path, self.new_records,
+                        self._get_logger())
+            if self.globalbundle.old_manifest:
+                self._debug("Using manifest of the old repo")
+            if self.globalbundle.new_manifest:
+                self._debug("Using manifest of the new repo")
 
     def fill_deltametadata(self):
         if not self.deltametadata:
@@ -262,6 +300,20 @@ class DeltaRepoGenerator(LoggingInterface):
             self._debug("Content hash of the \"{0}\" is not part of its "\
                         "repomd".format(self.new_repo_path))
 
+    def _gen_plugin(self, plugin, metadata_objects):
+        """Gen delta of the metadata by the plugin and return
+        tuple (rec_attrs, pluginbundle, contenthashes)"""
+        pluginbundle = PluginBundle(plugin.NAME, plugin.BASE_VERSION)
+        self._debug("Plugin {0}: Active".format(plugin.NAME))
+        plugin_instance = plugin(pluginbundle, self.globalbundle,
+                                 logger=self._get_logger())
+        repomd_records = plugin_instance.gen(metadata_objects)
+
+        rec_attrs = [repomd_record_to_dict(rec) for rec in repomd_records]
+        contenthashes = (self.globalbundle.calculated_old_contenthash,
+                         self.globalbundle.calculated_new_contenthash)
+        return rec_attrs, pluginbundle, contenthashes
+
     def gen(self):
 
         # Prepare output path
@@ -270,6 +322,12 @@ class DeltaRepoGenerator(LoggingInterface):
         # Set of types of processed metadata records ("primary", "primary_db"...)
         processed_metadata = set()
 
+        # Plugins take care of disjoint sets of metadata, so they are
+        # run by independent workers. Their repomd records and plugin
+        # bundles are collected in the order of the plugins, so the
+        # output doesn't depend on which worker finishes first.
+        jobs = []   # [(plugin, metadata_objects), ...]
+
         for plugin in PLUGINS:
 
             # Prepare metadata for the plugin
@@ -286,22 +344,7 @@ class DeltaRepoGenerator(LoggingInterface):
                             plugin.NAME, plugin.METADATA))
                 continue
 
-            # Prepare plugin bundle
-            pluginbundle = PluginBundle(plugin.NAME, plugin.VERSION)
-            self.deltametadata.add_pluginbundle(pluginbundle)
-
-            # Use the plugin
-            self._debug("Plugin {0}: Active".format(plugin.NAME))
-            plugin_instance = plugin(pluginbundle, self.globalbundle,
-                                     logger=self._get_logger())
-            repomd_records = plugin_instance.gen(metadata_objects)
-
-            # Put repomd records from processed metadatas to repomd
-            self._debug("Plugin {0}: Processed {1} record(s) " \
-                "and produced:".format(plugin.NAME, metadata_objects.keys()))
-            for rec in repomd_records:
-                self._debug(" - {0}".format(rec.type))
-                self.delta_repomd.set_record(rec)
+            jobs.append((plugin, metadata_objects))
 
             # Organization stuff
             for md in metadata_objects.keys():
@@ -321,21 +364,38 @@ class DeltaRepoGenerator(LoggingInterface):
                                 "plugin: {0}".format(rectype))
 
         if metadata_objects:
-            # Use the plugin
-            pluginbundle = PluginBundle(GENERAL_PLUGIN.NAME, GENERAL_PLUGIN.VERSION)
+            jobs.append((GENERAL_PLUGIN, metadata_objects))
+
+        # Use the plugins
+        # Plugins which run simultaneously run their own jobs
+        # in their processes (see parallel.split_workers())
+        max_workers, self.globalbundle.max_workers = split_workers(
+                                                self.max_workers, len(jobs))
+        results = run_in_processes([lambda job=job: self._gen_plugin(*job)
+                                    for job in jobs],
+                                   max_workers=max_workers,
+                                   logger=self._get_logger())
+
+        for (plugin, metadata_objects), (rec_attrs, pluginbundle, contenthashes) \
+                in zip(jobs, results):
+
             self.deltametadata.add_pluginbundle(pluginbundle)
-            self._debug("Plugin {0}: Active".format(GENERAL_PLUGIN.NAME))
-            plugin_instance = GENERAL_PLUGIN(pluginbundle, self.globalbundle,
-                                             logger=self._get_logger())
-            repomd_records = plugin_instance.gen(metadata_objects)
 
             # Put repomd records from processed metadatas to repomd
             self._debug("Plugin {0}: Processed {1} record(s) " \
-                "and produced:".format(GENERAL_PLUGIN.NAME, metadata_objects.keys()))
-            for rec in repomd_records:
+                "and produced:".format(plugin.NAME, metadata_objects.keys()))
+            for attrs in rec_attrs:
+                rec = repomd_record_from_dict(attrs)
                 self._debug(" - {0}".format(rec.type))
                 self.delta_repomd.set_record(rec)
 
+            # Content hashes calculated by the worker
+            old_contenthash, new_contenthash = contenthashes
+            if old_contenthash:
+                self.globalbundle.calculated_old_contenthash = old_contenthash
+            if new_contenthash:
+                self.globalbundle.calculated_new_contenthash = new_contenthash
+
         # Check if calculated contenthashes match
         # and calculate them if they don't exist
         self.check_content_hashes()
@@ -374,3 +434,80 @@ class DeltaRepoGenerator(LoggingInterface):
         self._debug("Moving %s -> %s" % (self.delta_repodata_path, self.final_path))
         os.rename(self.delta_repodata_path, self.final_path)
 
+    @classmethod
+    def gen_many(cls, old_repo_paths, new_repo_path, out_paths, logger=None,
+                 max_workers=1, **kwargs):
+        """Gen deltas from each of the old repos to the new repo.
+
+        The new repo is scanned only once - its manifest (loaded or built
+        in memory) is shared by all the generators and each old repo
+        is diffed against it. Other keyword arguments are passed
+        to the generators.
+
+        Deltas are generated by max_workers worker processes. Failure
+        of one delta doesn't stop generation of the others, the errors
+        are returned instead. If the deltas are generated simultaneously,
+        each generator runs its plugins in its own process, so
+        max_workers bounds the number of all worker processes.
+
+        :param old_repo_paths: Paths to the old repos
+        :type old_repo_paths: list
+        :param new_repo_path: Path to the new repo
+        :type new_repo_path: str
+        :param out_paths: Output dirs of the deltas (for each old repo)
+        :type out_paths: list
+        :param max_workers: Number of deltas generated simultaneously
+                            (None means number of CPUs)
+        :type max_workers: int or None
+        :returns: Errors (DeltaRepoError or None if the delta was
+                  generated) in the order of the old repos
+        :rtype: list
+        """
+        old_repo_paths = list(old_repo_paths)
+        out_paths = list(out_paths)
+        if len(old_repo_paths) != len(out_paths):
+            raise DeltaRepoError("Each old repo must have an output dir")
+        if not old_repo_paths:
+            return []
+
+        records = repomd_records(new_repo_path)
+        new_manifest = None
+        if kwargs.get("use_manifests", True):
+            new_manifest = load_manifest(new_repo_path, records, logger)
+        if new_manifest is None:
+            log_debug(logger, "Indexing the new repo {0}".format(
+                      new_repo_path))
+            new_manifest = build_manifest(new_repo_path, records, logger)
+
+        # Workers of the generators (see max_workers of the generator)
+        gen_max_workers = None if max_workers == 1 else 1
+
+        def gen(old_repo_path, out_path):
+            # Messages of the jobs are mixed, so they are prefixed
+            job_logger = logger
+            if logger is not None and len(old_repo_paths) > 1:
+                job_logger = PrefixLoggerAdapter(logger, "{0}: ".format(
+                        os.path.basename(os.path.normpath(old_repo_path))))
+            try:
+                generator = cls(old_repo_path,
+                                new_repo_path,
+                                out_path=out_path,
+                                logger=job_logger,
+                                new_manifest=new_manifest,
+                                max_workers=gen_max_workers,
+                                **kwargs)
+                generator.gen()
+            except Exception as err:
+                log_error(job_logger, "Delta generation failed: {0}".format(
+                          err))
+                log_debug(job_logger, traceback.format_exc())
+                # Only picklable errors could be passed from a worker
+                raise DeltaRepoError(str(err))
+
+        # A worker could also die (e.g. killed by OOM killer), such
+        # error is returned as well
+        return run_in_processes([lambda old=old, out=out: gen(old, out)
+                                 for old, out in zip(old_repo_paths,
+                                                     out_paths)],
+                                max_workers=max_workers,
+                                return_exceptions=True)
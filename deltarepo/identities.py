@@ -0,0 +1,184 @@
+"""
+Compact storage and fast diff of package identities.
+
+Package identity is a tuple (pkgId, location_href, location_base).
+Keeping a set of such tuples for a big repository (or several
+aggregated repositories) costs a lot of memory. Instead, identities
+are serialized into a single packed buffer addressed by offsets and
+each one is represented by a fixed-width digest. Digests are compared
+as sorted NumPy arrays (if NumPy is available) which makes the diff
+of two package lists vectorized.
+"""
+
+import array
+import hashlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ["DIGEST_SIZE", "identity_digest",
+           "PackageIdentities", "diff_identities"]
+
+# Size of an identity digest in bytes
+DIGEST_SIZE = 16
+
+# Typecode of the array with offsets of records in the packed buffer
+_OFFSET_TYPECODE = "L"
+
+_DIGEST_DTYPE = "S{0}".format(DIGEST_SIZE)
+
+
+def _identity_record(pkg_id_tuple):
+    return "\0".join(x or "" for x in pkg_id_tuple)
+
+
+def identity_digest(pkg_id_tuple):
+    """Return fixed-width digest of the identity tuple
+    (pkgId, location_href, location_base)."""
+    return hashlib.md5(_identity_record(pkg_id_tuple)).digest()
+
+
+class PackageIdentities(object):
+    """Compact ordered list of package identities.
+
+    Records of all identities are packed in a single buffer and
+    addressed by an array of offsets, so no per-package Python
+    object is kept. The object is picklable, so it could be passed
+    from a worker process.
+    """
+
+    def __init__(self, pkg_id_tuples=None):
+        self._data = bytearray()            # Concatenated records
+        self._offsets = array.array(_OFFSET_TYPECODE, [0])
+        self._digests = bytearray()         # Concatenated digests
+        for pkg_id_tuple in (pkg_id_tuples or []):
+            self.append(pkg_id_tuple)
+
+    @classmethod
+    def from_packed(cls, data, lengths, digests):
+        """Create the object from already serialized identities
+        (see packed_records, lengths and digests properties)"""
+        if len(digests) != len(lengths) * DIGEST_SIZE:
+            raise ValueError("Number of digests doesn't match "
+                             "number of records")
+        ids = cls()
+        offset = 0
+        for length in lengths:
+            offset += length
+            ids._offsets.append(offset)
+        if offset != len(data):
+            raise ValueError("Length of records doesn't match "
+                             "their total length")
+        ids._data = bytearray(data)
+        ids._digests = bytearray(digests)
+        return ids
+
+    @classmethod
+    def from_records(cls, records, digests):
+        """Create the object from a list of identity records
+        "pkgId\\0location_href\\0location_base" and their digests"""
+        return cls.from_packed("".join(records),
+                               [len(r) for r in records],
+                               digests)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.get(i)
+
+    def append(self, pkg_id_tuple):
+        """Append an identity tuple (pkgId, location_href, location_base)"""
+        record = _identity_record(pkg_id_tuple)
+        self._data.extend(record)
+        self._offsets.append(len(self._data))
+        self._digests.extend(hashlib.md5(record).digest())
+
+    def get(self, index):
+        """Return identity tuple at the index"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("identity index out of range")
+        record = str(self._data[self._offsets[index]:self._offsets[index+1]])
+        return tuple(x or None for x in record.split("\0"))
+
+    def digest(self, index):
+        """Return digest of identity at the index"""
+        start = index * DIGEST_SIZE
+        return str(self._digests[start:start+DIGEST_SIZE])
+
+    @property
+    def size(self):
+        """Approximate memory usage of the identities in bytes"""
+        return len(self._data) + len(self._digests) + \
+               len(self._offsets) * self._offsets.itemsize
+
+    @property
+    def lengths(self):
+        """Array of lengths of identity records (in the list order)"""
+        return array.array(_OFFSET_TYPECODE,
+                           (self._offsets[i+1] - self._offsets[i]
+                            for i in xrange(len(self))))
+
+    @property
+    def packed_records(self):
+        """Concatenated identity records
+        "pkgId\\0location_href\\0location_base" (in the list order)"""
+        return self._data
+
+    @property
+    def digests(self):
+        """Concatenated digests of all identities (in the list order)"""
+        return self._digests
+
+
+def _isin_sorted(values, sorted_unique):
+    """Vectorized membership test of values in a sorted unique array"""
+    if not len(sorted_unique):
+        return numpy.zeros(len(values), dtype=bool)
+    positions = numpy.searchsorted(sorted_unique, values)
+    positions[positions == len(sorted_unique)] = 0
+    return sorted_unique[positions] == values
+
+
+def _diff_masks_numpy(old, new):
+    old_digests = numpy.frombuffer(old.digests, dtype=_DIGEST_DTYPE)
+    new_digests = numpy.frombuffer(new.digests, dtype=_DIGEST_DTYPE)
+    removed = ~_isin_sorted(old_digests, numpy.unique(new_digests))
+    added = ~_isin_sorted(new_digests, numpy.unique(old_digests))
+    return numpy.flatnonzero(removed), numpy.flatnonzero(added)
+
+
+def _diff_masks_python(old, new):
+    old_digests = set(old.digest(i) for i in xrange(len(old)))
+    new_digests = set(new.digest(i) for i in xrange(len(new)))
+    removed = [i for i in xrange(len(old)) if old.digest(i) not in new_digests]
+    added = [i for i in xrange(len(new)) if new.digest(i) not in old_digests]
+    return removed, added
+
+
+def diff_identities(old, new):
+    """Diff two lists of package identities.
+
+    :param old: Identities of the old (source) repository
+    :type old: PackageIdentities
+    :param new: Identities of the new (target) repository
+    :type new: PackageIdentities
+    :returns: Tuple (removed, added). Removed is a sorted list of
+              identity tuples which are only in the old list.
+              Added is a list of indexes (in the new list order) of
+              packages which are only in the new list.
+    :rtype: tuple
+    """
+    if numpy is not None:
+        removed_indexes, added_indexes = _diff_masks_numpy(old, new)
+    else:
+        removed_indexes, added_indexes = _diff_masks_python(old, new)
+
+    removed = sorted(set(old.get(int(i)) for i in removed_indexes))
+    added = [int(i) for i in added_indexes]
+    return removed, added
@@ -0,0 +1,374 @@
+"""
+Sidecar manifests of repositories.
+
+A manifest is a compact binary file (MANIFEST_FILENAME) stored in
+the directory of a repository (next to the repodata/ subdirectory).
+It contains identities of all packages from primary.xml, their
+digests (also in sorted order) and byte offsets of <package> elements
+in the uncompressed primary, filelists and other XML files.
+
+With manifests of both repositories, delta generation doesn't need
+to parse the old repository at all and the package sets are diffed
+by a linear merge of the two sorted digest lists.
+
+The manifest is bound to the checksums of the metadata files
+from repomd.xml. A manifest that doesn't match the current repomd.xml
+is ignored.
+
+File format (all numbers are little endian):
+
+    MANIFEST_MAGIC
+    uint32      length of the header
+    header      JSON object (version, number of packages, checksums
+                of the metadata files, content hashes, ...)
+    uint32[N]   lengths of the identity records
+    bytes       identity records "pkgId\\0location_href\\0location_base"
+    bytes[N*16] identity digests (in the primary.xml order)
+    uint32[N]   indexes of the packages sorted by the digests
+    For each metadata type listed in the header:
+    uint64[2*N] (start, end) offsets of <package> elements
+                (NO_OFFSET if the package is missing in the file)
+"""
+
+import os
+import sys
+import json
+import array
+import struct
+import createrepo_c as cr
+
+from .identities import PackageIdentities, DIGEST_SIZE
+from .scanner import mapped, iter_package_ranges, iter_primary_ranges
+from .scanner import package_key
+from .util import log_warning, log_debug, content_hashes_from_ids
+from .errors import DeltaRepoError
+
+__all__ = ["MANIFEST_FILENAME", "Manifest", "repomd_records",
+           "build_manifest", "write_manifest", "load_manifest",
+           "diff_manifests"]
+
+MANIFEST_FILENAME = ".deltarepo-manifest"
+MANIFEST_MAGIC = "DELTAREPO-MANIFEST\n"
+MANIFEST_VERSION = 1
+
+# Metadata types with stored offsets
+OFFSETS_METADATA = ("primary", "filelists", "other")
+
+# Offset of a package which is missing in the metadata file
+NO_OFFSET = 2**64 - 1
+
+# Content hashes precalculated during writing of a manifest
+PRECALCULATED_CONTENTHASHES = ("sha256",)
+
+
+def _typed_array(typecode, itemsize):
+    """Return typecode of array with items of the itemsize bytes"""
+    for code in typecode:
+        if array.array(code).itemsize == itemsize:
+            return code
+    raise DeltaRepoError("No array type with {0} bytes items".format(itemsize))
+
+_UINT32 = _typed_array("IL", 4)
+_UINT64 = _typed_array("LQ", 8) if sys.maxsize > 2**32 else None
+
+
+def _to_le(arr):
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+
+def _uint64_array(values=()):
+    if _UINT64 is None:
+        raise DeltaRepoError("Manifests are not supported on this platform")
+    return array.array(_UINT64, values)
+
+
+class Manifest(object):
+    """Content of a manifest of a repository"""
+
+    def __init__(self):
+        self.checksums = {}     # { metadata_type: (checksum_type, checksum) }
+        self.contenthashes = {} # { checksum_type: contenthash }
+        self.identities = PackageIdentities()
+        self.sorted_order = array.array(_UINT32)
+        self.offsets = {}       # { metadata_type: array of (start, end) }
+
+    def __len__(self):
+        return len(self.identities)
+
+    def matches(self, records):
+        """Check that the manifest belongs to the metadata files.
+
+        :param records: Repomd records {metadata_type: record}
+        :type records: dict
+        :rtype: bool
+        """
+        if "primary" not in self.checksums:
+            return False
+        for metadata_type, checksum in self.checksums.items():
+            rec = records.get(metadata_type)
+            if rec is None or (rec.checksum_type, rec.checksum) != checksum:
+                return False
+        return True
+
+    def content_hash(self, checksum_type="sha256"):
+        """Return content hash of the repository"""
+        if checksum_type not in self.contenthashes:
+            contenthashes = content_hashes_from_ids(self.identities,
+                                                    [checksum_type])
+            self.contenthashes.update(contenthashes)
+        return self.contenthashes[checksum_type]
+
+    def iter_ranges(self, metadata_type):
+        """Yield (pkg_id_tuple, start, end) with offsets of <package>
+        elements in the uncompressed metadata file (in the primary.xml
+        order). Packages missing in the file are skipped."""
+        offsets = self.offsets.get(metadata_type)
+        if offsets is None:
+            return
+        for index in xrange(len(self.identities)):
+            start, end = offsets[2*index], offsets[2*index+1]
+            if start == NO_OFFSET:
+                continue
+            yield self.identities.get(index), start, end
+
+    def ranges(self, metadata_type):
+        """Return dict {key: (start, end)} with offsets of <package>
+        elements in the uncompressed metadata file (see
+        scanner.package_key()) or None if the offsets are not available"""
+        if metadata_type not in self.offsets:
+            return None
+        ranges = {}
+        for pkg_id_tuple, start, end in self.iter_ranges(metadata_type):
+            ranges[package_key(metadata_type, pkg_id_tuple)] = (start, end)
+        return ranges
+
+    def dump(self, fn):
+        """Write the manifest to the file"""
+        num = len(self.identities)
+        header = {
+            "version": MANIFEST_VERSION,
+            "packages": num,
+            "checksums": self.checksums,
+            "contenthashes": self.contenthashes,
+            "offsets": sorted(self.offsets.keys()),
+        }
+        header_str = json.dumps(header, sort_keys=True)
+
+        lengths = _to_le(array.array(_UINT32, self.identities.lengths))
+        sorted_order = _to_le(array.array(_UINT32, self.sorted_order))
+
+        tmp_fn = fn + ".tmp"
+        with open(tmp_fn, "wb") as f:
+            f.write(MANIFEST_MAGIC)
+            f.write(struct.pack("<I", len(header_str)))
+            f.write(header_str)
+            f.write(lengths.tostring())
+            f.write(str(self.identities.packed_records))
+            f.write(str(self.identities.digests))
+            f.write(sorted_order.tostring())
+            for metadata_type in header["offsets"]:
+                offsets = _to_le(_uint64_array(self.offsets[metadata_type]))
+                f.write(offsets.tostring())
+        os.rename(tmp_fn, fn)
+
+    @classmethod
+    def load(cls, fn):
+        """Load manifest from the file"""
+        with open(fn, "rb") as f:
+            data = f.read()
+
+        try:
+            if not data.startswith(MANIFEST_MAGIC):
+                raise ValueError("Bad magic")
+            pos = len(MANIFEST_MAGIC)
+            header_len, = struct.unpack_from("<I", data, pos)
+            pos += 4
+            header = json.loads(data[pos:pos+header_len])
+            pos += header_len
+            if header.get("version") != MANIFEST_VERSION:
+                raise ValueError("Unsupported version")
+            num = header["packages"]
+
+            def read(size):
+                if pos + size > len(data):
+                    raise ValueError("Unexpected end of file")
+                return data[pos:pos+size]
+
+            lengths = _to_le(array.array(_UINT32, read(4*num)))
+            pos += 4*num
+
+            manifest = cls()
+            records_len = sum(lengths)
+            records = read(records_len)
+            pos += records_len
+            digests = read(num*DIGEST_SIZE)
+            pos += num*DIGEST_SIZE
+            manifest.identities = PackageIdentities.from_packed(records,
+                                                                lengths,
+                                                                digests)
+            manifest.sorted_order = _to_le(array.array(_UINT32, read(4*num)))
+            pos += 4*num
+            for metadata_type in header["offsets"]:
+                manifest.offsets[str(metadata_type)] = \
+                        _to_le(_uint64_array(read(16*num)))
+                pos += 16*num
+        except (ValueError, KeyError, TypeError, struct.error) as err:
+            raise DeltaRepoError("Bad manifest {0}: {1}".format(fn, err))
+
+        for metadata_type, checksum in header["checksums"].items():
+            manifest.checksums[str(metadata_type)] = \
+                    tuple(str(x) for x in checksum)
+        for checksum_type, contenthash in header["contenthashes"].items():
+            manifest.contenthashes[str(checksum_type)] = str(contenthash)
+        return manifest
+
+
+def repomd_records(repo_path):
+    """Return dict {metadata_type: record} of records from repomd.xml
+    of the repository"""
+    repomd = cr.Repomd(os.path.join(repo_path, "repodata", "repomd.xml"))
+    return dict((rec.type, rec) for rec in repomd.records)
+
+
+def build_manifest(repo_path, records=None, logger=None):
+    """Scan metadata of the repository and return its manifest
+    (the manifest is not written, see write_manifest()).
+
+    :param repo_path: Path to a repository (a dir with repodata/)
+    :type repo_path: str
+    :param records: Repomd records {metadata_type: record} of the repo
+                    (loaded from repomd.xml if not specified)
+    :type records: dict or None
+    :rtype: Manifest
+    """
+    if records is None:
+        records = repomd_records(repo_path)
+    if "primary" not in records:
+        raise DeltaRepoError("{0}: Missing primary metadata".format(repo_path))
+
+    manifest = Manifest()
+    for metadata_type in OFFSETS_METADATA:
+        rec = records.get(metadata_type)
+        if rec is None:
+            continue
+        path = os.path.join(repo_path, rec.location_href)
+        if not os.path.isfile(path):
+            if metadata_type == "primary":
+                raise DeltaRepoError("{0}: Missing primary metadata "
+                                     "file".format(repo_path))
+            continue
+
+        log_debug(logger, "Manifest: Scanning {0}".format(path))
+        with mapped(path) as data:
+            if metadata_type == "primary":
+                offsets = _uint64_array()
+                for pkgid, href, base, start, end in \
+                        iter_primary_ranges(data):
+                    manifest.identities.append((pkgid, href, base))
+                    offsets.extend((start, end))
+            else:
+                ranges = {}
+                for pkgid, start, end in iter_package_ranges(data,
+                                                             metadata_type):
+                    ranges[pkgid] = (start, end)
+                offsets = _uint64_array()
+                for pkg_id_tuple in manifest.identities:
+                    offsets.extend(ranges.get(pkg_id_tuple[0],
+                                              (NO_OFFSET, NO_OFFSET)))
+
+        manifest.offsets[metadata_type] = offsets
+        manifest.checksums[metadata_type] = (rec.checksum_type, rec.checksum)
+
+    num = len(manifest.identities)
+    digests = manifest.identities.digests
+    manifest.sorted_order = array.array(_UINT32, sorted(xrange(num),
+            key=lambda i: digests[i*DIGEST_SIZE:(i+1)*DIGEST_SIZE]))
+    for checksum_type in PRECALCULATED_CONTENTHASHES:
+        manifest.content_hash(checksum_type)
+
+    return manifest
+
+
+def write_manifest(repo_path, logger=None):
+    """Scan metadata of the repository and write its manifest.
+
+    :param repo_path: Path to a repository (a dir with repodata/)
+    :type repo_path: str
+    :returns: The written manifest
+    :rtype: Manifest
+    """
+    manifest = build_manifest(repo_path, logger=logger)
+    manifest.dump(os.path.join(repo_path, MANIFEST_FILENAME))
+    return manifest
+
+
+def load_manifest(repo_path, records=None, logger=None):
+    """Load manifest of the repository.
+
+    :param repo_path: Path to a repository (a dir with repodata/)
+    :type repo_path: str
+    :param records: Repomd records {metadata_type: record} of the repo
+                    (loaded from repomd.xml if not specified)
+    :type records: dict or None
+    :returns: Manifest or None if the repository doesn't have
+              a valid manifest that matches its current repomd.xml
+    :rtype: Manifest or None
+    """
+    fn = os.path.join(repo_path, MANIFEST_FILENAME)
+    if not os.path.isfile(fn):
+        return None
+
+    try:
+        manifest = Manifest.load(fn)
+    except (DeltaRepoError, IOError) as err:
+        log_warning(logger, "Cannot load manifest: {0}".format(err))
+        return None
+
+    if records is None:
+        records = repomd_records(repo_path)
+    if not manifest.matches(records):
+        log_debug(logger, "Manifest {0} doesn't match the repomd.xml - "
+                          "Ignoring it".format(fn))
+        return None
+
+    return manifest
+
+
+def diff_manifests(old, new):
+    """Diff package sets of two manifests by a linear merge of their
+    sorted digests. The result is the same as the result
+    of identities.diff_identities().
+
+    :param old: Manifest of the old (source) repository
+    :type old: Manifest
+    :param new: Manifest of the new (target) repository
+    :type new: Manifest
+    :returns: Tuple (removed, added) - see identities.diff_identities()
+    :rtype: tuple
+    """
+    old_ids, new_ids = old.identities, new.identities
+    old_order, new_order = old.sorted_order, new.sorted_order
+    removed = set()
+    added = []
+
+    i = j = 0
+    while i < len(old_order) or j < len(new_order):
+        old_digest = old_ids.digest(old_order[i]) if i < len(old_order) else None
+        new_digest = new_ids.digest(new_order[j]) if j < len(new_order) else None
+        if new_digest is None or (old_digest is not None and
+                                  old_digest < new_digest):
+            removed.add(old_ids.get(old_order[i]))
+            i += 1
+        elif old_digest is None or new_digest < old_digest:
+            added.append(new_order[j])
+            j += 1
+        else:
+            # Skip all packages with the same digest
+            while i < len(old_order) and old_ids.digest(old_order[i]) == old_digest:
+                i += 1
+            while j < len(new_order) and new_ids.digest(new_order[j]) == new_digest:
+                j += 1
+
+    return sorted(removed), sorted(int(x) for x in added)
@@ -0,0 +1,114 @@
+"""
+Streaming merge of old packages with packages from a delta.
+
+Old metadata files are not loaded into the memory during application
+of a delta. Packages of the old repository are streamed (one by one)
+from the parser to the writer and the (few) packages from the delta
+are inserted into the stream at their positions. Only the packages
+from the delta are kept in the memory.
+
+The position of a delta package is determined by its sort key in the
+primary.xml stream. Filelists.xml and other.xml list the packages
+in the same order as primary.xml, so the positions from the primary
+stream are reused for them (their packages don't have the data
+for the sort key).
+
+Old packages could be streamed as RawPackage objects - raw <package>
+elements which are copied to the new metadata file as they are.
+"""
+
+import collections
+
+__all__ = ["RawPackage", "SortedMerge", "PositionalMerge"]
+
+# Old package that is copied without parsing and serialization.
+# Fragment is the raw <package> element from the old metadata file.
+RawPackage = collections.namedtuple("RawPackage", ["pkgId", "location_href",
+                                                   "location_base",
+                                                   "fragment"])
+
+
+class SortedMerge(object):
+    """Merge a stream of old packages (sorted by the key) with delta
+    packages. Every package is passed to the write function in the
+    merged order.
+
+    If the old stream is not sorted, all packages are still written
+    (exactly once), just the result is not sorted either.
+    """
+
+    def __init__(self, delta_pkgs, key, write):
+        """
+        :param delta_pkgs: Packages from the delta
+        :type delta_pkgs: list
+        :param key: Function that returns sort key of a package
+        :type key: callable
+        :param write: Function called with each merged package
+        :type write: callable
+        """
+        self._key = key
+        self._write = write
+        self._pending = sorted(delta_pkgs, key=key, reverse=True)
+        self.count = 0          # Number of written old packages
+        self.positions = []     # Number of old packages written before
+                                # each delta package (in the written order)
+        self.delta_order = []   # Written delta packages
+
+    def _write_delta(self):
+        pkg = self._pending.pop()
+        self.positions.append(self.count)
+        self.delta_order.append(pkg)
+        self._write(pkg)
+
+    def add(self, pkg):
+        """Write the old package and all delta packages before it"""
+        key = self._key(pkg)
+        while self._pending and self._key(self._pending[-1]) < key:
+            self._write_delta()
+        self._write(pkg)
+        self.count += 1
+
+    def finish(self):
+        """Write all remaining delta packages"""
+        while self._pending:
+            self._write_delta()
+
+
+class PositionalMerge(object):
+    """Merge a stream of old packages with delta packages at the
+    positions recorded by a SortedMerge."""
+
+    def __init__(self, delta_pkgs, positions, write):
+        """
+        :param delta_pkgs: Packages from the delta in the written order
+                           (see SortedMerge.delta_order)
+        :type delta_pkgs: list
+        :param positions: Positions of the delta packages
+                          (see SortedMerge.positions)
+        :type positions: list
+        :param write: Function called with each merged package
+        :type write: callable
+        """
+        if len(delta_pkgs) != len(positions):
+            raise ValueError("Each delta package must have a position")
+        self._write = write
+        self._delta_pkgs = delta_pkgs
+        self._positions = positions
+        self._next = 0
+        self.count = 0          # Number of written old packages
+
+    def _write_deltas(self, upto):
+        while self._next < len(self._positions) and \
+                self._positions[self._next] <= upto:
+            self._write(self._delta_pkgs[self._next])
+            self._next += 1
+
+    def add(self, pkg):
+        """Write the old package and all delta packages before it"""
+        self._write_deltas(self.count)
+        self._write(pkg)
+        self.count += 1
+
+    def finish(self):
+        """Write all remaining delta packages"""
+        self._write_deltas(float("inf"))
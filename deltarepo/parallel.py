@@ -0,0 +1,157 @@
+"""
+Helpers for running independent jobs in worker processes.
+
+Jobs are plain callables. They are not pickled - worker processes are
+forked, so a job could be a closure over any (even unpicklable) object
+of the calling process. Only return values (and raised exceptions)
+travel back to the caller, so they have to be picklable.
+"""
+
+import traceback
+import multiprocessing
+
+from .errors import DeltaRepoError
+
+__all__ = ["run_in_processes", "split_workers"]
+
+
+def _run_here(job):
+    """Run the job in the current process and return its message"""
+    try:
+        return (True, job(), None)
+    except Exception as err:
+        return (False, err, traceback.format_exc())
+
+
+def _worker(job, conn):
+    """Body of a worker process - run the job and send back its result"""
+    msg = _run_here(job)
+    try:
+        conn.send(msg)
+    except Exception as err:
+        # Result or exception is not picklable
+        conn.send((False,
+                   DeltaRepoError("Cannot pass a result of a worker process "
+                                  "to the parent process: {0}".format(err)),
+                   traceback.format_exc()))
+    conn.close()
+
+
+def _collect(process, conn):
+    """Wait for the worker process and return its message"""
+    try:
+        msg = conn.recv()
+    except EOFError:
+        msg = None
+    conn.close()
+    process.join()
+    if msg is None:
+        msg = (False,
+               DeltaRepoError("Worker process {0} died unexpectedly (exit "
+                              "code: {1})".format(process.pid,
+                                                  process.exitcode)),
+               None)
+    return msg
+
+
+def run_in_processes(jobs, max_workers=None, logger=None,
+                     return_exceptions=False):
+    """Run each callable from jobs in a separate worker process.
+
+    Objects of createrepo_c (e.g. RepomdRecord or Package) are not
+    picklable, so the jobs return plain tuples and dicts instead
+    (e.g. attributes of repomd records, see
+    plugins_common.repomd_record_to_dict()) and the caller rebuilds
+    the objects from them.
+
+    :param jobs: Callables without arguments
+    :type jobs: list
+    :param max_workers: Maximal number of simultaneously running
+                        workers (number of CPUs by default).
+                        If 1, jobs are run one by one in the current
+                        process.
+    :type max_workers: int or None
+    :param logger: A logger used to log tracebacks of failed jobs
+    :type logger: logging.Logger or None
+    :param return_exceptions: If True, exceptions raised by the jobs
+                              are returned in place of their results
+                              instead of being raised
+    :type return_exceptions: bool
+    :returns: Return values of the jobs (in the same order as the jobs)
+    :rtype: list
+    :raises: The first exception raised by a job (after all jobs finished)
+    """
+    jobs = list(jobs)
+
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+
+    if max_workers <= 1 or len(jobs) <= 1:
+        if not return_exceptions:
+            return [job() for job in jobs]
+        messages = [_run_here(job) for job in jobs]
+        return _results(messages, logger, return_exceptions)
+
+    messages = [None] * len(jobs)
+    running = []    # [(index, process, conn), ...]
+
+    for index, job in enumerate(jobs):
+        if len(running) >= max_workers:
+            i, process, conn = running.pop(0)
+            messages[i] = _collect(process, conn)
+
+        recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_worker,
+                                          args=(job, send_conn))
+        process.start()
+        send_conn.close()
+        running.append((index, process, recv_conn))
+
+    for i, process, conn in running:
+        messages[i] = _collect(process, conn)
+
+    return _results(messages, logger, return_exceptions)
+
+
+def split_workers(max_workers, num_jobs):
+    """Split the limit of worker processes between a pool of num_jobs
+    jobs and the pools which are started by the jobs.
+
+    If the jobs run simultaneously, each of them has to run its own
+    jobs in its process, otherwise the whole limit is left to the job
+    which runs at the time.
+
+    :param max_workers: Maximal number of worker processes
+                        (None means number of CPUs)
+    :type max_workers: int or None
+    :param num_jobs: Number of jobs of the outer pool
+    :type num_jobs: int
+    :returns: Tuple (outer, inner) - max_workers of the pool of the jobs
+              and max_workers of the pools started by the jobs
+    :rtype: tuple
+    """
+    outer = min(max_workers or multiprocessing.cpu_count(), num_jobs)
+    if outer > 1:
+        return outer, 1
+    return 1, max_workers
+
+
+def _results(messages, logger, return_exceptions):
+    """Return results from the messages of the jobs (or raise
+    the first error)"""
+    results = []
+    first_error = None
+    for ok, value, tb in messages:
+        if ok:
+            results.append(value)
+            continue
+        if tb and logger:
+            logger.debug("Worker process failed:\n{0}".format(tb))
+        if first_error is None:
+            first_error = value
+        results.append(value if return_exceptions else None)
+
+    if first_error is not None and not return_exceptions:
+        raise first_error
+
+    return results
@@ -0,0 +1,228 @@
+"""
+Disk backed storage of package identities.
+
+Delta generation keeps identities of all packages from the old and
+the new repository. When the identity lists should fit into a bounded
+memory (see max_memory of DeltaRepoGenerator), identities which don't
+fit into the memory are spilled into a temporary sqlite database and
+both the diff and the content hash calculation are done by sqlite
+(which sorts on the disk if needed). Only the identity lists are
+bounded, lists of the added and removed packages are always kept
+in memory.
+"""
+
+import os
+import sqlite3
+
+from .identities import PackageIdentities, identity_digest, diff_identities
+from .util import content_hashes_from_ids, content_hashes_from_id_strs
+
+__all__ = ["PackageIdentitiesStore", "collect_identities",
+           "identities_content_hashes", "diff_collected_identities"]
+
+# Number of inserted identities between two commits
+_COMMIT_INTERVAL = 10000
+
+# Expression of the identity string (see util.pkg_id_tuple_str())
+_ID_STR_SQL = "COALESCE(pkgid, '') || COALESCE(href, '') || COALESCE(base, '')"
+
+
+class PackageIdentitiesStore(object):
+    """Ordered list of package identities stored in a sqlite database.
+
+    It has the same interface as identities.PackageIdentities.
+    The object is picklable, only the path to the database
+    is pickled.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._len = 0
+        self._uncommitted = 0
+        self._conn = None
+        self._connect().execute("""CREATE TABLE identities (
+                                    idx INTEGER PRIMARY KEY,
+                                    digest BLOB,
+                                    pkgid TEXT,
+                                    href TEXT,
+                                    base TEXT)""")
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.text_factory = str
+        return self._conn
+
+    def __getstate__(self):
+        self.commit()
+        return {"path": self.path, "_len": self._len}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._len = state["_len"]
+        self._uncommitted = 0
+        self._conn = None
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        self.commit()
+        cur = self._connect().execute("SELECT pkgid, href, base "
+                                      "FROM identities ORDER BY idx")
+        for row in cur:
+            yield tuple(row)
+
+    def append(self, pkg_id_tuple):
+        """Append an identity tuple (pkgId, location_href, location_base)"""
+        pkgid, href, base = [x or None for x in pkg_id_tuple]
+        digest = sqlite3.Binary(identity_digest(pkg_id_tuple))
+        self._connect().execute("INSERT INTO identities VALUES (?, ?, ?, ?, ?)",
+                                (self._len, digest, pkgid, href, base))
+        self._len += 1
+        self._uncommitted += 1
+        if self._uncommitted >= _COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        """Write out all appended identities"""
+        if self._conn is not None:
+            self._conn.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        """Close the database (it is reopened on demand)"""
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+        self._uncommitted = 0
+
+    def get(self, index):
+        """Return identity tuple at the index"""
+        row = self._connect().execute("SELECT pkgid, href, base FROM "
+                                      "identities WHERE idx=?",
+                                      (index,)).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return tuple(row)
+
+    def digest(self, index):
+        """Return digest of identity at the index"""
+        row = self._connect().execute("SELECT digest FROM identities "
+                                      "WHERE idx=?", (index,)).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return str(row[0])
+
+    def iter_sorted_id_strs(self):
+        """Yield identity strings (see util.pkg_id_tuple_str())
+        of all packages in sorted order"""
+        self.commit()
+        cur = self._connect().execute("SELECT {0} AS idstr FROM identities "
+                                      "ORDER BY idstr".format(_ID_STR_SQL))
+        for row in cur:
+            yield row[0]
+
+
+def collect_identities(pkg_id_tuples, max_memory=None, path=None):
+    """Collect the identity tuples into a PackageIdentities object.
+    If the identities take more than max_memory bytes, all of them are
+    moved into a PackageIdentitiesStore at the path.
+
+    :param pkg_id_tuples: Identity tuples (pkgId, location_href, location_base)
+    :type pkg_id_tuples: iterable
+    :param max_memory: Memory limit in bytes (None means no limit)
+    :type max_memory: int or None
+    :param path: Path for the database (required if max_memory is set)
+    :type path: str or None
+    :returns: Collected identities
+    :rtype: PackageIdentities or PackageIdentitiesStore
+    """
+    ids = PackageIdentities()
+    store = None
+
+    for pkg_id_tuple in pkg_id_tuples:
+        if store is not None:
+            store.append(pkg_id_tuple)
+            continue
+        ids.append(pkg_id_tuple)
+        if max_memory and ids.size > max_memory:
+            store = PackageIdentitiesStore(path)
+            for item in ids:
+                store.append(item)
+            ids = None
+
+    if store is not None:
+        store.commit()
+        return store
+    return ids
+
+
+def _to_store(ids, path):
+    store = PackageIdentitiesStore(path)
+    for pkg_id_tuple in ids:
+        store.append(pkg_id_tuple)
+    store.commit()
+    return store
+
+
+def identities_content_hashes(ids, checksum_types=("sha256",), logger=None):
+    """Calculate content hashes of the identities.
+
+    :param ids: Identities
+    :type ids: PackageIdentities or PackageIdentitiesStore
+    :returns: Content hashes {checksum_type: content_hash}
+    :rtype: dict
+    """
+    if isinstance(ids, PackageIdentitiesStore):
+        return content_hashes_from_id_strs(ids.iter_sorted_id_strs(),
+                                           checksum_types)
+    return content_hashes_from_ids(ids, checksum_types, logger)
+
+
+def diff_collected_identities(old, new, tmpdir=None):
+    """Diff two lists of package identities returned by
+    collect_identities(). If any of them is stored in a database,
+    the diff is done by sqlite. The result is the same as the result
+    of identities.diff_identities().
+
+    :param old: Identities of the old (source) repository
+    :type old: PackageIdentities or PackageIdentitiesStore
+    :param new: Identities of the new (target) repository
+    :type new: PackageIdentities or PackageIdentitiesStore
+    :param tmpdir: Directory for a database of the in-memory identities
+                   (used only if the other identities are stored
+                   in a database)
+    :type tmpdir: str or None
+    :returns: Tuple (removed, added) - see identities.diff_identities()
+    :rtype: tuple
+    """
+    if not isinstance(old, PackageIdentitiesStore) and \
+            not isinstance(new, PackageIdentitiesStore):
+        return diff_identities(old, new)
+
+    if not isinstance(old, PackageIdentitiesStore):
+        old = _to_store(old, os.path.join(tmpdir or ".", "old-identities.sqlite"))
+    if not isinstance(new, PackageIdentitiesStore):
+        new = _to_store(new, os.path.join(tmpdir or ".", "new-identities.sqlite"))
+
+    old.close()
+    new.close()
+
+    conn = sqlite3.connect(new.path)
+    conn.text_factory = str
+    try:
+        conn.execute("ATTACH DATABASE ? AS old", (os.path.abspath(old.path),))
+        removed = [tuple(row) for row in conn.execute(
+                   "SELECT DISTINCT pkgid, href, base FROM old.identities "
+                   "WHERE digest NOT IN (SELECT digest FROM main.identities) "
+                   "ORDER BY pkgid, href, base")]
+        added = [row[0] for row in conn.execute(
+                 "SELECT idx FROM main.identities "
+                 "WHERE digest NOT IN (SELECT digest FROM old.identities) "
+                 "ORDER BY idx")]
+    finally:
+        conn.close()
+
+    return removed, added
@@ -1,11 +1,28 @@
 import os
 import os.path
 import shutil
-import hashlib
 import filecmp
+import itertools
+import sqlite3
+import tempfile
 import createrepo_c as cr
 from .plugins_common import GlobalBundle, Metadata
+from .plugins_common import repomd_record_to_dict, repomd_record_from_dict
+from .plugins_common import REPOMD_RECORD_ATTRS
 from .common import LoggingInterface, DEFAULT_CHECKSUM_NAME
+from .parallel import run_in_processes
+from .scanner import iter_primary_ids, write_raw_packages
+from .scanner import mapped, package_attrs
+from .scanner import iter_primary_ranges, iter_package_ranges
+from .elementdelta import ELEMENT_RES, index_base_fragments
+from .elementdelta import delta_fragment, patch_sequence
+from .merge import RawPackage, SortedMerge, PositionalMerge
+from .pkgstore import collect_identities, identities_content_hashes
+from .pkgstore import diff_collected_identities
+from .manifest import diff_manifests
+from .fragmentstore import FRAGMENT_METADATA
+from .dbpatch import db_checksum, package_count
+from .dbpatch import remove_packages, insert_packages
 from .errors import DeltaRepoPluginError
 
 # List of available plugins
@@ -35,6 +52,10 @@ class DeltaRepoPlugin(LoggingInterface):
     # Plugin version (integer number!)
     VERSION = 1
 
+    # Version of generated deltas which don't use any optional feature
+    # of the plugin (see _require_version())
+    BASE_VERSION = 1
+
     # List of Metadata this plugin takes care of.
     # The plugin HAS TO do deltas for each of listed metadata and be able
     # to apply deltas on them!
@@ -80,6 +101,17 @@ class DeltaRepoPlugin(LoggingInterface):
 
         return self.__metadata_notes_cache.get(type)
 
+    def _require_version(self, version):
+        """Note that the generated delta needs at least the version
+        of the plugin to be applied (the delta uses a feature that
+        was added in the version)"""
+        if version > self.VERSION:
+            raise DeltaRepoPluginError("Plugin version {0} required, but "
+                                       "the plugin has version {1}".format(
+                                       version, self.VERSION))
+        if self.pluginbundle.version < version:
+            self.pluginbundle.version = version
+
     def _metadata_notes_to_plugin_bundle(self, type, dictionary):
         """Store info about metadata persistently to pluginbundle"""
         notes = {"type": type}
@@ -415,16 +447,49 @@ GENERAL_PLUGIN = GeneralDeltaRepoPlugin
 class MainDeltaRepoPlugin(DeltaRepoPlugin):
 
     NAME = "MainDeltaPlugin"
-    VERSION = 1
+    # Version 4 added optional database deltas (*_dbdelta). Deltas with
+    # them still require only the base version - older applicators
+    # ignore the unknown records and build databases from xml.
+    VERSION = 4
     METADATA = ["primary", "filelists", "other",
-                "primary_db", "filelists_db", "other_db"]
+                "primary_db", "filelists_db", "other_db",
+                "primary_dbdelta", "filelists_dbdelta", "other_dbdelta"]
     METADATA_MAPPING = {
         "primary":         ["primary"],
         "filelists":       ["primary", "filelists"],
         "other":           ["primary", "other"],
-        "primary_db":      ["primary"],
-        "filelists_db":    ["primary", "filelists"],
-        "other_db":        ["primary", "other"],
+        "primary_db":      ["primary", "primary_dbdelta"],
+        "filelists_db":    ["primary", "filelists", "filelists_dbdelta"],
+        "other_db":        ["primary", "other", "other_dbdelta"],
+    }
+
+    # Element-level deltas of packages against their previous builds
+    # { metadata_type: (pluginbundle list, Package attribute,
+    #                   plugin version which introduced the feature) }
+    ELEMENT_DELTAS = {
+        "other":        ("changelogdelta", "changelogs", 2),
+        "filelists":    ("filelistdelta", "files", 3),
+    }
+
+    # XML file classes of the metadata types
+    XML_FILE_CLASSES = {
+        "primary":      cr.PrimaryXmlFile,
+        "filelists":    cr.FilelistsXmlFile,
+        "other":        cr.OtherXmlFile,
+    }
+
+    # Parsers of the metadata types
+    XML_PARSE_FUNCTIONS = {
+        "primary":      cr.xml_parse_primary,
+        "filelists":    cr.xml_parse_filelists,
+        "other":        cr.xml_parse_other,
+    }
+
+    # Database classes of the metadata types
+    DB_CLASSES = {
+        "primary":      cr.PrimarySqlite,
+        "filelists":    cr.FilelistsSqlite,
+        "other":        cr.OtherSqlite,
     }
 
     def _pkg_id_tuple(self, pkg):
@@ -446,6 +511,77 @@ class MainDeltaRepoPlugin(DeltaRepoPlugin):
                           pkg.location_base or '')
         return idstr
 
+    def _identities_max_memory(self):
+        """Memory limit for identities of one repo (or None)"""
+        if not self.globalbundle.max_memory:
+            return None
+        # Identities of the old and the new repo are kept simultaneously
+        return self.globalbundle.max_memory // 2
+
+    def _primary_identities(self, primary_path, store_path=None):
+        """Scan primary.xml and return tuple (contenthash, identities),
+        where identities is a PackageIdentities object with identities
+        of all packages in the order they appear in the file.
+        If the identities exceed a half of the memory limit
+        (globalbundle.max_memory), they are stored into a database
+        at the store_path (PackageIdentitiesStore is returned)."""
+        ids = collect_identities(iter_primary_ids(primary_path),
+                                 max_memory=self._identities_max_memory(),
+                                 path=store_path)
+        contenthash_type = self.globalbundle.contenthash_type_str
+        contenthash = identities_content_hashes(ids, [contenthash_type],
+                                                self._get_logger())
+        return contenthash[contenthash_type], ids
+
+    def _diff_primary(self, pri_md):
+        """Diff the old and the new primary.xml and return tuple
+        (src_contenthash, dst_contenthash, removed, added), where removed
+        is a sorted list of identity tuples of the removed packages
+        and added is a list of identity tuples of the added packages
+        (in the new primary.xml order).
+
+        Repos with a manifest (globalbundle.old_manifest and
+        globalbundle.new_manifest) are not scanned at all."""
+        contenthash_type = self.globalbundle.contenthash_type_str
+        manifests = [self.globalbundle.old_manifest,
+                     self.globalbundle.new_manifest]
+
+        tmpdir = tempfile.mkdtemp(prefix="deltarepo-")
+        try:
+            # Both primary files are independent till the diff, so they are
+            # parsed simultaneously in worker processes which return only
+            # the content hash and identities of the packages
+            paths = [(pri_md.old_fn, "old-identities.sqlite"),
+                     (pri_md.new_fn, "new-identities.sqlite")]
+            jobs = [lambda path=path, fn=fn: self._primary_identities(path,
+                                                os.path.join(tmpdir, fn))
+                    for (path, fn), manifest in zip(paths, manifests)
+                    if manifest is None]
+            results = run_in_processes(jobs,
+                                       max_workers=self.globalbundle.max_workers,
+                                       logger=self._get_logger())
+            identities = []
+            for manifest in manifests:
+                if manifest is None:
+                    identities.append(results.pop(0))
+                else:
+                    identities.append((manifest.content_hash(contenthash_type),
+                                       manifest.identities))
+            (src_contenthash, old_ids), (dst_contenthash, new_ids) = identities
+
+            # Diff the package sets (by digests of the identities)
+            if None not in manifests:
+                removed, added_indexes = diff_manifests(*manifests)
+            else:
+                removed, added_indexes = diff_collected_identities(old_ids,
+                                                                   new_ids,
+                                                                   tmpdir)
+            added = [new_ids.get(index) for index in added_indexes]
+        finally:
+            shutil.rmtree(tmpdir)
+
+        return src_contenthash, dst_contenthash, removed, added
+
     def _gen_db_from_xml(self, md):
         """Gen sqlite db from the delta metadata.
         """
@@ -492,6 +628,379 @@ class MainDeltaRepoPlugin(DeltaRepoPlugin):
 
         return db_rec
 
+    def _reuse_old_db(self, md, db_md):
+        """Copy the database of the old repo if the new xml file
+        is the same as the old one. Return its repomd record
+        or None if the database has to be generated from xml.
+        """
+        if not db_md or not db_md.old_rec or not db_md.old_fn_exists:
+            return None
+        if not md.old_rec or md.new_rec.checksum != md.old_rec.checksum or \
+                md.new_rec.checksum_type != md.old_rec.checksum_type:
+            # Checksum of the xml is stored in the database
+            return None
+
+        # The old database could be stale (generated from another xml)
+        tmp_fn = os.path.join(md.out_dir, "{0}.sqlite.tmp".format(
+                              md.metadata_type))
+        try:
+            cr.decompress_file(db_md.old_fn, tmp_fn,
+                               cr.AUTO_DETECT_COMPRESSION)
+            checksum = db_checksum(tmp_fn)
+        finally:
+            if os.path.exists(tmp_fn):
+                os.remove(tmp_fn)
+        if checksum != md.new_rec.checksum:
+            self._debug("Database {0} doesn't belong to {1} - It cannot be "
+                        "reused".format(db_md.old_fn, md.old_fn))
+            return None
+
+        self._debug("Using database from the old repo: {0}".format(
+                    db_md.old_fn))
+        suffix = cr.compression_suffix(
+                    cr.detect_compression(db_md.old_fn)) or ""
+        db_fn = os.path.join(md.out_dir, "{0}.sqlite{1}".format(
+                             md.metadata_type, suffix))
+        shutil.copy2(db_md.old_fn, db_fn)
+
+        # The old record is still valid (only the location is new)
+        old_rec = db_md.old_rec
+        rec = cr.RepomdRecord(old_rec.type, db_fn)
+        for attr in REPOMD_RECORD_ATTRS:
+            if attr in ("location_href", "location_base"):
+                continue
+            if getattr(old_rec, attr) is not None:
+                setattr(rec, attr, getattr(old_rec, attr))
+        if self.globalbundle.unique_md_filenames:
+            rec.rename_file()
+
+        return rec
+
+    def _gen_db_delta(self, md, delta_fn):
+        """Gen sqlite db with rows of the packages from the delta xml file.
+        The rows are inserted into the patched old database during
+        application (see dbpatch.insert_packages()), so the delta
+        packages don't have to be converted from xml by clients.
+        """
+        dbclass = self.DB_CLASSES[md.metadata_type]
+        parsefunc = self.XML_PARSE_FUNCTIONS[md.metadata_type]
+
+        db_fn = os.path.join(md.out_dir, "{0}_dbdelta.sqlite".format(
+                             md.metadata_type))
+        db = dbclass(db_fn)
+        parsefunc(delta_fn, pkgcb=db.add_pkg)
+        db.close()
+
+        db_stat = cr.ContentStat(md.checksum_type)
+        db_compressed = db_fn+".bz2"
+        cr.compress_file(db_fn, None, cr.BZ2, db_stat)
+        os.remove(db_fn)
+
+        rec = cr.RepomdRecord("{0}_dbdelta".format(md.metadata_type),
+                              db_compressed)
+        rec.load_contentstat(db_stat)
+        rec.fill(md.checksum_type)
+        if self.globalbundle.unique_md_filenames:
+            rec.rename_file()
+
+        return rec
+
+    def _pkg_sort_key(self, pkg):
+        """Sort key of packages in the new metadata
+        (filename and then full location_href)"""
+        location_href = pkg.location_href or ""
+        return (os.path.basename(location_href), location_href)
+
+    def _write_pkg(self, md, pkg):
+        """Write the package to the new xml file and database"""
+        md.num_written += 1
+        if isinstance(pkg, RawPackage):
+            md.new_f.add_chunk(pkg.fragment + "\n")
+            return
+        md.new_f.add_pkg(pkg)
+        if md.db and not md.db_complete:
+            md.db.add_pkg(pkg)
+
+    def _apply_plan(self, old_primary_path, delta_pkgs, is_removed):
+        """Scan the old primary.xml and return tuple
+        (src_contenthash, dst_contenthash, num_of_packages, plan,
+        removed_pkgids, removed_mask), where num_of_packages is a number
+        of packages in the new repo, plan is a SortedMerge with positions
+        of the delta packages in the new metadata (nothing is written
+        by it), removed_pkgids is a set of pkgIds of the removed old
+        packages and removed_mask is a bytearray with 1 for each removed
+        old package (in the old primary.xml order)."""
+        contenthash_type = self.globalbundle.contenthash_type_str
+        tmpdir = tempfile.mkdtemp(prefix="deltarepo-")
+        try:
+            src_contenthash, old_ids = self._primary_identities(
+                    old_primary_path,
+                    os.path.join(tmpdir, "old-identities.sqlite"))
+            new_ids = collect_identities(itertools.chain(
+                    (x for x in old_ids if not is_removed(x)),
+                    (self._pkg_id_tuple(pkg) for pkg in delta_pkgs)),
+                    max_memory=self._identities_max_memory(),
+                    path=os.path.join(tmpdir, "new-identities.sqlite"))
+            dst_contenthash = identities_content_hashes(new_ids,
+                    [contenthash_type], self._get_logger())[contenthash_type]
+            num_of_packages = len(new_ids)
+
+            # Delta packages are inserted into the stream of old packages
+            # by their filenames (the old primary.xml is sorted by them)
+            plan = SortedMerge(delta_pkgs, self._pkg_sort_key,
+                               lambda pkg: None)
+            removed_pkgids = set()
+            removed_mask = bytearray()
+            for pkgid, href, base in old_ids:
+                if is_removed((pkgid, href, base)):
+                    removed_pkgids.add(pkgid)
+                    removed_mask.append(1)
+                    continue
+                removed_mask.append(0)
+                plan.add(RawPackage(pkgid, href, base, None))
+            plan.finish()
+        finally:
+            shutil.rmtree(tmpdir)
+        return (src_contenthash, dst_contenthash, num_of_packages,
+                plan, removed_pkgids, removed_mask)
+
+    def _patch_old_db(self, md, num_of_old_packages, removed_pkgids=None,
+                      removed_locations=None):
+        """Prepare the new database (md.db_fn) from the old one by
+        deletion of the removed packages (see dbpatch module).
+        Return False if the old database cannot be used."""
+        self._debug("Patching database: {0}".format(md.old_db_fn))
+        cr.decompress_file(md.old_db_fn, md.db_fn, cr.AUTO_DETECT_COMPRESSION)
+
+        if db_checksum(md.db_fn) != md.old_rec.checksum:
+            self._debug("Database {0} doesn't belong to {1} - It cannot be "
+                        "patched".format(md.old_db_fn, md.old_fn))
+            os.remove(md.db_fn)
+            return False
+
+        remaining = remove_packages(md.db_fn, pkgids=removed_pkgids,
+                                    locations=removed_locations)
+        if remaining != num_of_old_packages:
+            self._warning("Database {0} contains unexpected number of "
+                          "packages ({1} != {2}) - It cannot be "
+                          "patched".format(md.old_db_fn, remaining,
+                                           num_of_old_packages))
+            os.remove(md.db_fn)
+            return False
+
+        return True
+
+    def _insert_db_delta(self, md, num_of_delta_packages):
+        """Insert rows of the delta packages from the database delta
+        (md.db_delta_fn) into the patched database.
+        Return False if the database delta cannot be used."""
+        self._debug("Inserting database delta: {0}".format(md.db_delta_fn))
+        tmp_fn = md.db_fn + ".dbdelta"
+        cr.decompress_file(md.db_delta_fn, tmp_fn, cr.AUTO_DETECT_COMPRESSION)
+        try:
+            num = package_count(tmp_fn)
+            if num != num_of_delta_packages:
+                self._warning("Database delta {0} contains unexpected number "
+                              "of packages ({1} != {2}) - Ignoring".format(
+                              md.db_delta_fn, num, num_of_delta_packages))
+                return False
+            insert_packages(md.db_fn, tmp_fn)
+        except sqlite3.Error as err:
+            self._warning("Database delta {0} cannot be inserted: "
+                          "{1} - Ignoring".format(md.db_delta_fn, err))
+            return False
+        finally:
+            os.remove(tmp_fn)
+        return True
+
+    def _open_metadata(self, md, num_of_old_packages, num_of_delta_packages,
+                       removed_pkgids=None, removed_locations=None):
+        """Open the new xml file (and database) of the metadata.
+        Files are opened by the worker which writes them.
+
+        If the old database is patched (md.db_patched), it already
+        contains all the old packages which are carried over. If also
+        the database delta is inserted (md.db_complete), it contains
+        all the packages."""
+        md.num_of_packages = num_of_old_packages + num_of_delta_packages
+        md.num_written = 0
+        md.new_f_stat = cr.ContentStat(md.checksum_type)
+        md.new_f = self.XML_FILE_CLASSES[md.metadata_type](md.new_fn,
+                                                          md.compression_type,
+                                                          md.new_f_stat)
+        md.db = None
+        md.db_patched = False
+        md.db_complete = False
+        if md.db_fn:
+            if md.old_db_fn:
+                md.db_patched = self._patch_old_db(md, num_of_old_packages,
+                                                   removed_pkgids,
+                                                   removed_locations)
+            if md.db_patched and md.db_delta_fn:
+                md.db_complete = self._insert_db_delta(md,
+                                                       num_of_delta_packages)
+            # createrepo_c doesn't recreate tables of an existing database
+            md.db = self.DB_CLASSES[md.metadata_type](md.db_fn)
+
+    def _finish_metadata(self, md):
+        """Close the new xml file (and database) of the metadata and
+        return list of attributes of their repomd records (the xml
+        file first, see repomd_record_from_dict())"""
+        # Close XML file
+        md.new_f.close()
+        if md.num_written != md.num_of_packages:
+            raise DeltaRepoPluginError("{0} contains unexpected number of "
+                    "packages ({1} != {2})".format(md.new_fn, md.num_written,
+                                                  md.num_of_packages))
+
+        # Prepare repomd record of xml file
+        rec = cr.RepomdRecord(md.metadata_type, md.new_fn)
+        rec.load_contentstat(md.new_f_stat)
+        rec.fill(md.checksum_type)
+        if self.globalbundle.unique_md_filenames:
+            rec.rename_file()
+        rec_attrs = [repomd_record_to_dict(rec)]
+
+        # Prepare database
+        if md.db:
+            self._debug("Generating database: {0}".format(md.db_fn))
+            md.db.dbinfo_update(rec.checksum)
+            md.db.close()
+            db_stat = cr.ContentStat(md.checksum_type)
+            db_compressed = md.db_fn+".bz2"
+            cr.compress_file(md.db_fn, None, cr.BZ2, db_stat)
+            os.remove(md.db_fn)
+
+            # Prepare repomd record of database file
+            db_rec = cr.RepomdRecord("{0}_db".format(md.metadata_type),
+                                     db_compressed)
+            db_rec.load_contentstat(db_stat)
+            db_rec.fill(md.checksum_type)
+            if self.globalbundle.unique_md_filenames:
+                db_rec.rename_file()
+            rec_attrs.append(repomd_record_to_dict(db_rec))
+
+        return rec_attrs
+
+    def _apply_primary_stream(self, md, plan, is_removed, removed_locations,
+                              num_of_packages):
+        """Write new primary.xml from the old one and the delta packages
+        (see plan) and return attributes of its repomd records"""
+        self._debug("Writing primary xml: {0}".format(md.new_fn))
+        self._open_metadata(md, num_of_packages - len(plan.delta_order),
+                            len(plan.delta_order),
+                            removed_locations=removed_locations)
+        md.new_f.set_num_of_pkgs(num_of_packages)
+        merge = PositionalMerge(plan.delta_order, plan.positions,
+                                lambda pkg: self._write_pkg(md, pkg))
+
+        if md.db is None or md.db_patched:
+            # Usually almost all packages are carried over from the old
+            # repo. Without a database (or with the patched one) there
+            # is no need to parse them, their <package> elements are
+            # copied as they are.
+            with mapped(md.old_fn) as data:
+                for pkgid, href, base, start, end in \
+                        iter_primary_ranges(data):
+                    if not is_removed((pkgid, href, base)):
+                        merge.add(RawPackage(pkgid, href, base,
+                                             data[start:end]))
+        else:
+            def old_pkgcb(pkg):
+                if not is_removed(self._pkg_id_tuple(pkg)):
+                    merge.add(pkg)
+
+            cr.xml_parse_primary(md.old_fn, pkgcb=old_pkgcb,
+                                 do_files=True)
+        merge.finish()
+        return self._finish_metadata(md)
+
+    def _apply_pkgs_stream(self, md, parsefunc, pri_merge, removed_pkgids,
+                           removed_mask, num_of_packages):
+        """Write new filelists.xml or other.xml from the old one and
+        the delta packages (see pri_merge and removed_mask) and return
+        attributes of its repomd records"""
+        self._debug("Writing {0} xml: {1}".format(md.metadata_type,
+                                                  md.new_fn))
+        self._open_metadata(md, num_of_packages - len(pri_merge.delta_order),
+                            len(pri_merge.delta_order),
+                            removed_pkgids=removed_pkgids)
+
+        # Parse the delta file
+        delta_pkgs = {}     # { 'pkgId': pkg }
+
+        def delta_pkgcb(pkg):
+            delta_pkgs[pkg.pkgId] = pkg
+
+        parsefunc(md.delta_fn, pkgcb=delta_pkgcb)
+
+        # Rebuild changelogs or files of packages from element deltas
+        listname, attr, _ = self.ELEMENT_DELTAS[md.metadata_type]
+        items = self.pluginbundle.get_list(listname, [])
+        if items:
+            # Base packages are removed packages which are not added
+            # again (see gen()), they are picked from the old file
+            # in advance
+            base_pkgids = set(item.get("base") for item in items)
+            base_packages = {}   # { 'pkgId': pkg }
+
+            def base_newpkgcb(pkgId, name, arch):
+                if pkgId in base_pkgids:
+                    return cr.Package()
+                return None
+
+            def base_pkgcb(pkg):
+                base_packages[pkg.pkgId] = pkg
+
+            parsefunc(md.old_fn, newpkgcb=base_newpkgcb, pkgcb=base_pkgcb)
+
+            for item in items:
+                pkg = delta_pkgs.get(item.get("pkgid"))
+                base = base_packages.get(item.get("base"))
+                if pkg is None or base is None:
+                    raise DeltaRepoPluginError("Cannot apply {0} delta of "
+                            "{1}: Package or its base package {2} is "
+                            "missing".format(md.metadata_type,
+                            item.get("pkgid"), item.get("base")))
+                setattr(pkg, attr, patch_sequence(getattr(base, attr),
+                                                  item.get("script", ""),
+                                                  getattr(pkg, attr)))
+
+        # Merge old and delta packages
+        delta_order = []
+        for pri_pkg in pri_merge.delta_order:
+            pkg = delta_pkgs.get(pri_pkg.pkgId)
+            if pkg is None:
+                raise DeltaRepoPluginError("Package {0} is missing in "
+                        "{1}".format(pri_pkg.pkgId, md.delta_fn))
+            delta_order.append(pkg)
+        md.new_f.set_num_of_pkgs(num_of_packages)
+        merge = PositionalMerge(delta_order, pri_merge.positions,
+                                lambda pkg: self._write_pkg(md, pkg))
+
+        # Old packages are listed in the same order as in the old
+        # primary.xml (a missing or an extra one is detected by the
+        # package count in _finish_metadata())
+        removed = iter(removed_mask)
+
+        if md.db is None or md.db_patched:
+            # Old packages are copied as they are (see apply())
+            with mapped(md.old_fn) as data:
+                for pkgid, start, end in iter_package_ranges(data,
+                                                        md.metadata_type):
+                    if not next(removed, 0):
+                        merge.add(RawPackage(pkgid, None, None,
+                                             data[start:end]))
+        else:
+            def newpkgcb(pkgId, name, arch):
+                if next(removed, 0):
+                    return None
+                return cr.Package()
+
+            parsefunc(md.old_fn, newpkgcb=newpkgcb, pkgcb=merge.add)
+        merge.finish()
+        return self._finish_metadata(md)
+
     def apply(self, metadata):
         # Check input arguments
         if "primary" not in metadata:
@@ -506,9 +1015,17 @@ class MainDeltaRepoPlugin(DeltaRepoPlugin):
         fil_md = metadata.get("filelists")
         oth_md = metadata.get("other")
 
+        def db_wanted(md, notes):
+            # Database which is not among the processed metadata
+            # (see target_metadata of DeltaRepoApplicator) is not needed
+            if md.metadata_type+"_db" not in metadata:
+                return False
+            return self.globalbundle.force_database or \
+                    notes.get("database") == "1"
+
         def try_simple_delta(md, dbclass):
             if not md:
-                return
+                return True
 
             notes = self._metadata_notes_from_plugin_bundle(md.metadata_type)
             if not notes:
@@ -525,8 +1042,14 @@ class MainDeltaRepoPlugin(DeltaRepoPlugin):
                 return True
 
             # Gen DB here
-            if self.globalbundle.force_database or notes.get("database") == "1":
-                rec = self._gen_db_from_xml(md)
+            if db_wanted(md, notes):
+                rec = None
+                if not md.delta_rec:
+                    # The xml file was copied from the old repo
+                    rec = self._reuse_old_db(md,
+                                    metadata.get(md.metadata_type+"_db"))
+                if rec is None:
+                    rec = self._gen_db_from_xml(md)
                 gen_repomd_recs.append(rec)
 
             return True
@@ -557,196 +1080,198 @@ class MainDeltaRepoPlugin(DeltaRepoPlugin):
             location_base = record.get("location_base")
             removed_packages[location_href] = location_base
 
-        # Prepare output xml files and check if dbs should be generated
+        # Prepare output paths and check if dbs should be generated
         # Note: This information are stored directly to the Metadata
         # object which someone could see as little hacky.
-        def prepare_paths_in_metadata(md, xmlclass, dbclass):
+        def prepare_paths_in_metadata(md):
             if md is None:
-                return
+                return None
 
             notes = self._metadata_notes_from_plugin_bundle(md.metadata_type)
             if not notes:
                 # TODO: Add flag to ignore this kind of warnings (?)
                 self._warning("Metadata \"{0}\" doesn't have a record in "
                               "deltametadata.xml - Ignoring")
-                return
+                return None
 
             suffix = cr.compression_suffix(md.compression_type) or ""
             md.new_fn = os.path.join(md.out_dir,
                                      "{0}.xml{1}".format(
                                      md.metadata_type, suffix))
-            md.new_f_stat = cr.ContentStat(md.checksum_type)
-            md.new_f = xmlclass(md.new_fn,
-                                md.compression_type,
-                                md.new_f_stat)
 
-            if self.globalbundle.force_database or notes.get("database") == "1":
+            if db_wanted(md, notes):
                 md.db_fn = os.path.join(md.out_dir, "{0}.sqlite".format(
                                         md.metadata_type))
-                md.db = dbclass(md.db_fn)
             else:
                 md.db_fn = None
-                md.db = None
 
-        # Primary
-        prepare_paths_in_metadata(pri_md,
-                                  cr.PrimaryXmlFile,
-                                  cr.PrimarySqlite)
-
-        # Filelists
-        prepare_paths_in_metadata(fil_md,
-                                  cr.FilelistsXmlFile,
-                                  cr.FilelistsSqlite)
+            # Old database which could be patched instead of building
+            # the new one from all packages. If the delta contains
+            # a database delta, the old database is always patched.
+            md.old_db_fn = None
+            md.db_delta_fn = None
+            db_md = metadata.get(md.metadata_type+"_db")
+            db_delta_md = metadata.get(md.metadata_type+"_dbdelta")
+            if md.db_fn and db_md and db_md.old_fn_exists:
+                if notes.get("dbdelta") == "1" and db_delta_md and \
+                        db_delta_md.delta_fn_exists:
+                    md.old_db_fn = db_md.old_fn
+                    md.db_delta_fn = db_delta_md.delta_fn
+                elif self.globalbundle.patch_databases:
+                    md.old_db_fn = db_md.old_fn
+            return md
 
-        # Other
-        prepare_paths_in_metadata(oth_md,
-                                  cr.OtherXmlFile,
-                                  cr.OtherSqlite)
+        pri_md = prepare_paths_in_metadata(pri_md)
+        fil_md = prepare_paths_in_metadata(fil_md)
+        oth_md = prepare_paths_in_metadata(oth_md)
 
         # Apply delta
-        all_packages = {}        # dict { 'pkgId': pkg }
-
-        old_contenthash_strings = []
-        new_contenthash_strings = []
-
-        def old_pkgcb(pkg):
-            old_contenthash_strings.append(self._pkg_id_str(pkg))
-            if pkg.location_href in removed_packages:
-                if removed_packages[pkg.location_href] == pkg.location_base:
-                    # This package won't be in new metadata
-                    return
-            new_contenthash_strings.append(self._pkg_id_str(pkg))
-            all_packages[pkg.pkgId] = pkg
-
-        def delta_pkgcb(pkg):
-            new_contenthash_strings.append(self._pkg_id_str(pkg))
-            all_packages[pkg.pkgId] = pkg
-
-        filelists_from_primary = True
-        if fil_md:
-            filelists_from_primary = False
-
-        # Parse both old and delta primary.xml files
-        cr.xml_parse_primary(pri_md.old_fn, pkgcb=old_pkgcb,
-                             do_files=filelists_from_primary)
-        cr.xml_parse_primary(pri_md.delta_fn, pkgcb=delta_pkgcb,
-                             do_files=filelists_from_primary)
-
-        # Calculate content hashes
-        h = hashlib.new(self.globalbundle.contenthash_type_str)
-        old_contenthash_strings.sort()
-        for i in old_contenthash_strings:
-            h.update(i)
-        self.globalbundle.calculated_old_contenthash = h.hexdigest()
-
-        h = hashlib.new(self.globalbundle.contenthash_type_str)
-        new_contenthash_strings.sort()
-        for i in new_contenthash_strings:
-            h.update(i)
-        self.globalbundle.calculated_new_contenthash = h.hexdigest()
-
-        # Sort packages
-        def cmp_pkgs(x, y):
-            # Compare only by filename
-            ret = cmp(os.path.basename(x.location_href),
-                      os.path.basename(y.location_href))
-            if ret != 0:
-                return ret
-
-            # Compare by full location_href path
-            return  cmp(x.location_href, y.location_href)
-
-        all_packages_sorted = sorted(all_packages.values(), cmp=cmp_pkgs)
-
-        def newpkgcb(pkgId, name, arch):
-            return all_packages.get(pkgId, None)
-
-        # Parse filelists
-        if fil_md:
-            self._debug("Parsing filelists xmls")
-            cr.xml_parse_filelists(fil_md.old_fn, newpkgcb=newpkgcb)
-            cr.xml_parse_filelists(fil_md.delta_fn, newpkgcb=newpkgcb)
-
-        if oth_md:
-            self._debug("Parsing other xmls")
-            cr.xml_parse_other(oth_md.old_fn, newpkgcb=newpkgcb)
-            cr.xml_parse_other(oth_md.delta_fn, newpkgcb=newpkgcb)
-
-        num_of_packages = len(all_packages_sorted)
-
-        # Write out primary
-        self._debug("Writing primary xml: {0}".format(pri_md.new_fn))
-        pri_md.new_f.set_num_of_pkgs(num_of_packages)
-        for pkg in all_packages_sorted:
-            pri_md.new_f.add_pkg(pkg)
-            if pri_md.db:
-                pri_md.db.add_pkg(pkg)
+        # Old metadata are streamed package by package from the parser
+        # to the writers. Only packages from the delta (and base packages
+        # of element deltas) are kept in memory.
+
+        # Parse delta primary.xml (it contains only the added packages)
+        # Primary is written before (and independently of) filelists,
+        # so the files listed in primary must be parsed from it
+        delta_pkgs = []
+        cr.xml_parse_primary(pri_md.delta_fn, pkgcb=delta_pkgs.append,
+                             do_files=True)
+
+        def is_removed(pkg_id_tuple):
+            _, location_href, location_base = pkg_id_tuple
+            return location_href in removed_packages and \
+                    removed_packages[location_href] == location_base
+
+        # Calculate content hashes, number of packages in the new repo
+        # and positions of the delta packages in the new metadata
+        src_contenthash, dst_contenthash, num_of_packages, plan, \
+                removed_pkgids, removed_mask = self._apply_plan(pri_md.old_fn,
+                                                                delta_pkgs,
+                                                                is_removed)
+        self.globalbundle.calculated_old_contenthash = src_contenthash
+        self.globalbundle.calculated_new_contenthash = dst_contenthash
 
-        # Write out filelists
+        # Write out primary, filelists and other
+        # All positions are known in advance, so each metadata file
+        # (and its database) is written by an independent worker
+        jobs = [lambda: self._apply_primary_stream(pri_md, plan, is_removed,
+                                                   removed_packages.items(),
+                                                   num_of_packages)]
         if fil_md:
-            self._debug("Writing filelists xml: {0}".format(fil_md.new_fn))
-            fil_md.new_f.set_num_of_pkgs(num_of_packages)
-            for pkg in all_packages_sorted:
-                fil_md.new_f.add_pkg(pkg)
-                if fil_md.db:
-                    fil_md.db.add_pkg(pkg)
-
-        # Write out other
+            jobs.append(lambda: self._apply_pkgs_stream(fil_md,
+                                    cr.xml_parse_filelists, plan,
+                                    removed_pkgids, removed_mask,
+                                    num_of_packages))
         if oth_md:
-            self._debug("Writing other xml: {0}".format(oth_md.new_fn))
-            oth_md.new_f.set_num_of_pkgs(num_of_packages)
-            for pkg in all_packages_sorted:
-                oth_md.new_f.add_pkg(pkg)
-                if oth_md.db:
-                    oth_md.db.add_pkg(pkg)
-
-        # Finish metadata
-        def finish_metadata(md):
-            if md is None:
-                return
-
-            # Close XML file
-            md.new_f.close()
-
-            # Prepare repomd record of xml file
-            rec = cr.RepomdRecord(md.metadata_type, md.new_fn)
-            rec.load_contentstat(md.new_f_stat)
-            rec.fill(md.checksum_type)
-            if self.globalbundle.unique_md_filenames:
-                rec.rename_file()
-
-            md.new_rec = rec
+            jobs.append(lambda: self._apply_pkgs_stream(oth_md,
+                                    cr.xml_parse_other, plan,
+                                    removed_pkgids, removed_mask,
+                                    num_of_packages))
+        results = run_in_processes(jobs,
+                                   max_workers=self.globalbundle.max_workers,
+                                   logger=self._get_logger())
+
+        # Add records to metadata objects
+        mds = [md for md in (pri_md, fil_md, oth_md) if md is not None]
+        for md, rec_attrs in zip(mds, results):
+            recs = [repomd_record_from_dict(attrs) for attrs in rec_attrs]
+            md.new_rec = recs[0]
+            md.new_fn = recs[0].location_real
             md.new_fn_exists = True
+            gen_repomd_recs.extend(recs)
 
-            gen_repomd_recs.append(rec)
-
-            # Prepare database
-            if hasattr(md, "db") and md.db:
-                self._debug("Generating database: {0}".format(md.db_fn))
-                md.db.dbinfo_update(rec.checksum)
-                md.db.close()
-                db_stat = cr.ContentStat(md.checksum_type)
-                db_compressed = md.db_fn+".bz2"
-                cr.compress_file(md.db_fn, None, cr.BZ2, db_stat)
-                os.remove(md.db_fn)
-
-                # Prepare repomd record of database file
-                db_rec = cr.RepomdRecord("{0}_db".format(md.metadata_type),
-                                         db_compressed)
-                db_rec.load_contentstat(db_stat)
-                db_rec.fill(md.checksum_type)
-                if self.globalbundle.unique_md_filenames:
-                    db_rec.rename_file()
+        return gen_repomd_recs
 
-                gen_repomd_recs.append(db_rec)
+    def _gen_pkgs_delta(self, md, added_pkgs, removed_pkgids):
+        """Write delta of primary, filelists or other with the added packages
+        and return tuple (rec_attrs, bundle_lists, db_delta_rec_attrs)"""
+        xmlclass = self.XML_FILE_CLASSES[md.metadata_type]
+        stat = cr.ContentStat(md.checksum_type)
+        delta_f = xmlclass(md.delta_fn, md.compression_type, stat)
+        bundle_lists = {}
+        pkgids = [pkg_id_tuple[0] for pkg_id_tuple in added_pkgs]
+
+        # Added packages are never parsed, their <package> elements
+        # are copied from the fragment store or from the new metadata
+        # file as they are
+        delta_f.set_num_of_pkgs(len(added_pkgs))
+        fragments = None
+        store = self.globalbundle.fragment_store
+        if store is not None and md.metadata_type in FRAGMENT_METADATA:
+            fragments = store.get_many(md.metadata_type, added_pkgs)
+            if fragments is None:
+                self._debug("Fragment store doesn't contain all added "
+                            "packages of {0}".format(md.metadata_type))
+        ranges = None
+        if fragments is None and self.globalbundle.new_manifest is not None:
+            ranges = self.globalbundle.new_manifest.ranges(md.metadata_type)
+        element_delta = {
+            "other": self.globalbundle.changelog_delta,
+            "filelists": self.globalbundle.filelist_delta,
+        }.get(md.metadata_type)
+
+        def write_packages(transform=None):
+            if fragments is None:
+                return write_raw_packages(md.new_fn, md.metadata_type,
+                                          added_pkgs, delta_f,
+                                          transform=transform,
+                                          ranges=ranges)
+            for pkgid, fragment in zip(pkgids, fragments):
+                if transform is not None:
+                    fragment = transform(pkgid, fragment)
+                delta_f.add_chunk(fragment + "\n")
+            return []
+
+        if element_delta:
+            listname = self.ELEMENT_DELTAS[md.metadata_type][0]
+            element_re = ELEMENT_RES[md.metadata_type]
+            deltas = bundle_lists.setdefault(listname, [])
+            with mapped(md.old_fn) as old_data:
+                # A package which is removed and added again (e.g. moved
+                # to another location) cannot be a base, its elements
+                # in the delta would be stripped against themselves
+                base_index = index_base_fragments(old_data, md.metadata_type,
+                                                  removed_pkgids.difference(
+                                                                    pkgids))
+
+                def transform(pkgid, fragment):
+                    attrs = package_attrs(fragment)
+                    key = (attrs.get("name"), attrs.get("arch"))
+                    if key not in base_index:
+                        return fragment
+                    base_pkgid, start, end = base_index[key]
+                    delta, script = delta_fragment(fragment,
+                                                   old_data[start:end],
+                                                   element_re)
+                    if delta is None:
+                        return fragment
+                    deltas.append({"pkgid": pkgid,
+                                   "base": base_pkgid,
+                                   "script": script})
+                    return delta
+
+                missing = write_packages(transform)
+        else:
+            missing = write_packages()
+        if missing:
+            raise DeltaRepoPluginError("Package(s) {0} missing in "
+                    "{1}".format(", ".join(map(str, missing)), md.new_fn))
+        delta_f.close()
 
-        # Add records to the bundle
+        # Prepare repomd record of xml file
+        rec = cr.RepomdRecord(md.metadata_type, md.delta_fn)
+        rec.load_contentstat(stat)
+        rec.fill(md.checksum_type)
+        if self.globalbundle.unique_md_filenames:
+            rec.rename_file()
 
-        finish_metadata(pri_md)
-        finish_metadata(fil_md)
-        finish_metadata(oth_md)
+        # Rows of element deltas cannot be prepared in advance
+        db_delta_rec_attrs = None
+        if md.gen_db_delta and not any(bundle_lists.values()):
+            db_delta_rec = self._gen_db_delta(md, rec.location_real)
+            db_delta_rec_attrs = repomd_record_to_dict(db_delta_rec)
 
-        return gen_repomd_recs
+        return repomd_record_to_dict(rec), bundle_lists, db_delta_rec_attrs
 
     def gen(self, metadata):
         # Check input arguments
@@ -801,10 +1326,10 @@ class MainDeltaRepoPlugin(DeltaRepoPlugin):
         if simple_oth_delta:
             oth_md = None
 
-        # Prepare output xml files and check if dbs should be generated
+        # Prepare output xml paths and check if dbs should be generated
         # Note: This information are stored directly to the Metadata
         # object which someone could see as little hacky.
-        def prepare_paths_in_metadata(md, xmlclass):
+        def prepare_paths_in_metadata(md):
             if md is None:
                 return None
 
@@ -814,72 +1339,29 @@ class MainDeltaRepoPlugin(DeltaRepoPlugin):
                 metadata_notes.setdefault(md.metadata_type, {})["database"] = "1"
             else:
                 metadata_notes.setdefault(md.metadata_type, {})["database"] = "0"
+            md.gen_db_delta = self.globalbundle.db_delta and \
+                    metadata_notes[md.metadata_type]["database"] == "1"
 
             suffix = cr.compression_suffix(md.compression_type) or ""
             md.delta_fn = os.path.join(md.out_dir,
                                      "{0}.xml{1}".format(
                                      md.metadata_type, suffix))
-            md.delta_f_stat = cr.ContentStat(md.checksum_type)
-            md.delta_f = xmlclass(md.delta_fn,
-                                  md.compression_type,
-                                  md.delta_f_stat)
             return md
 
         # Primary
-        pri_md = prepare_paths_in_metadata(pri_md, cr.PrimaryXmlFile)
+        pri_md = prepare_paths_in_metadata(pri_md)
 
         # Filelists
-        fil_md = prepare_paths_in_metadata(fil_md, cr.FilelistsXmlFile)
+        fil_md = prepare_paths_in_metadata(fil_md)
 
         # Other
-        oth_md = prepare_paths_in_metadata(oth_md, cr.OtherXmlFile)
+        oth_md = prepare_paths_in_metadata(oth_md)
 
         # Gen delta
 
-        old_packages = set()
-        added_packages = {}         # dict { 'pkgId': pkg }
-        added_packages_ids = []     # list of package ids
-
-        old_contenthash_strings = []
-        new_contenthash_strings = []
-
-        def old_pkgcb(pkg):
-            old_packages.add(self._pkg_id_tuple(pkg))
-            old_contenthash_strings.append(self._pkg_id_str(pkg))
-
-        def new_pkgcb(pkg):
-            new_contenthash_strings.append(self._pkg_id_str(pkg))
-            pkg_id_tuple = self._pkg_id_tuple(pkg)
-            if not pkg_id_tuple in old_packages:
-                # This package is only in new repodata
-                added_packages[pkg.pkgId] = pkg
-                added_packages_ids.append(pkg.pkgId)
-            else:
-                # This package is also in the old repodata
-                old_packages.remove(pkg_id_tuple)
-
-        filelists_from_primary = True
-        if fil_md:
-            # Filelists will be parsed from filelists
-            filelists_from_primary = False
-
-        cr.xml_parse_primary(pri_md.old_fn, pkgcb=old_pkgcb, do_files=False)
-        cr.xml_parse_primary(pri_md.new_fn, pkgcb=new_pkgcb,
-                             do_files=filelists_from_primary)
-
-        # Calculate content hashes
-        h = hashlib.new(self.globalbundle.contenthash_type_str)
-        old_contenthash_strings.sort()
-        for i in old_contenthash_strings:
-            h.update(i)
-        src_contenthash = h.hexdigest()
+        src_contenthash, dst_contenthash, removed_pkgs, added_pkgs = \
+                self._diff_primary(pri_md)
         self.globalbundle.calculated_old_contenthash = src_contenthash
-
-        h = hashlib.new(self.globalbundle.contenthash_type_str)
-        new_contenthash_strings.sort()
-        for i in new_contenthash_strings:
-            h.update(i)
-        dst_contenthash = h.hexdigest()
         self.globalbundle.calculated_new_contenthash = dst_contenthash
 
         # Set the content hashes to the plugin bundle
@@ -888,86 +1370,44 @@ class MainDeltaRepoPlugin(DeltaRepoPlugin):
         self.pluginbundle.set("dst_contenthash", dst_contenthash)
 
         # Prepare list of removed packages
-        removed_pkgs = sorted(old_packages)
         for _, location_href, location_base in removed_pkgs:
             dictionary = {"location_href": location_href}
             if location_base:
                 dictionary["location_base"] = location_base
             self.pluginbundle.append("removedpackage", dictionary)
 
-        num_of_packages = len(added_packages)
-
-        # Filelists and Other cb
-        def newpkgcb(pkgId, name, arch):
-            return added_packages.get(pkgId, None)
-
-        # Parse filelist.xml and write out its delta
-        if fil_md:
-            cr.xml_parse_filelists(fil_md.new_fn, newpkgcb=newpkgcb)
-            fil_md.delta_f.set_num_of_pkgs(num_of_packages)
-            for pkgid in added_packages_ids:
-                fil_md.delta_f.add_pkg(added_packages[pkgid])
-            fil_md.delta_f.close()
-
-        # Parse other.xml and write out its delta
-        if oth_md:
-            cr.xml_parse_other(oth_md.new_fn, newpkgcb=newpkgcb)
-            oth_md.delta_f.set_num_of_pkgs(num_of_packages)
-            for pkgid in added_packages_ids:
-                oth_md.delta_f.add_pkg(added_packages[pkgid])
-            oth_md.delta_f.close()
-
-        # Write out primary delta
-        # Note: Writing of primary delta has to be after parsing of filelists
-        # Otherwise cause missing files if filelists_from_primary was False
-        pri_md.delta_f.set_num_of_pkgs(num_of_packages)
-        for pkgid in added_packages_ids:
-            pri_md.delta_f.add_pkg(added_packages[pkgid])
-        pri_md.delta_f.close()
-
-        # Finish metadata
-        def finish_metadata(md):
-            if md is None:
-                return
-
-            # Close XML file
-            md.delta_f.close()
-
-            # Prepare repomd record of xml file
-            rec = cr.RepomdRecord(md.metadata_type, md.delta_fn)
-            rec.load_contentstat(md.delta_f_stat)
-            rec.fill(md.checksum_type)
-            if self.globalbundle.unique_md_filenames:
-                rec.rename_file()
+        # Write out the deltas
+        # Each metadata type is written by an independent worker,
+        # the workers share only the list of the added packages
+        removed_pkgids = set(pkg_id_tuple[0] for pkg_id_tuple in removed_pkgs)
+        mds = [md for md in (pri_md, fil_md, oth_md) if md is not None]
+        jobs = [lambda md=md: self._gen_pkgs_delta(md, added_pkgs,
+                                                   removed_pkgids)
+                for md in mds]
+        results = run_in_processes(jobs,
+                                   max_workers=self.globalbundle.max_workers,
+                                   logger=self._get_logger())
 
+        # Add records to medata objects
+        for md, (rec_attrs, bundle_lists, db_delta_rec_attrs) in \
+                zip(mds, results):
+            rec = repomd_record_from_dict(rec_attrs)
             md.delta_rec = rec
             md.delta_fn_exists = True
-
             gen_repomd_recs.append(rec)
 
-            # Prepare database
-            if hasattr(md, "db") and md.db:
-                md.db.dbinfo_update(rec.checksum)
-                md.db.close()
-                db_stat = cr.ContentStat(md.checksum_type)
-                db_compressed = md.db_fn+".bz2"
-                cr.compress_file(md.db_fn, None, cr.BZ2, db_stat)
-                os.remove(md.db_fn)
-
-                # Prepare repomd record of database file
-                db_rec = cr.RepomdRecord("{0}_db".format(md.metadata_type),
-                                         db_compressed)
-                db_rec.load_contentstat(db_stat)
-                db_rec.fill(md.checksum_type)
-                if self.globalbundle.unique_md_filenames:
-                    db_rec.rename_file()
-
-                gen_repomd_recs.append(db_rec)
+            if db_delta_rec_attrs:
+                gen_repomd_recs.append(repomd_record_from_dict(
+                                                    db_delta_rec_attrs))
+                metadata_notes[md.metadata_type]["dbdelta"] = "1"
 
-        # Add records to medata objects
-        finish_metadata(pri_md)
-        finish_metadata(fil_md)
-        finish_metadata(oth_md)
+            for listname, items in bundle_lists.items():
+                for item in items:
+                    self.pluginbundle.append(listname, item)
+
+        for listname, _, version in self.ELEMENT_DELTAS.values():
+            if self.pluginbundle.get_list(listname):
+                self._require_version(version)
 
         # Store data persistently
         for metadata_type, notes in metadata_notes.items():
@@ -1044,7 +1484,7 @@ class GroupsDeltaRepoPlugin(DeltaRepoPlugin):
             assert rc
             if rec:
                 gen_repomd_recs.append(rec)
-                if notes.get("gen_group_gz"):
+                if notes.get("gen_group_gz") and "group_gz" in metadata:
                     # Gen group_gz metadata from the group metadata
                     stat = cr.ContentStat(md_group.checksum_type)
                     group_gz_fn = md_group.new_fn+".gz"
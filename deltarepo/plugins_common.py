@@ -3,6 +3,15 @@ Classes related for communication between plugins
 and applicator/generator.
 """
 
+import createrepo_c as cr
+
+# Attributes of a repomd record that are needed to rebuild the record
+# in another process (createrepo_c.RepomdRecord is not picklable)
+REPOMD_RECORD_ATTRS = ("location_href", "location_base",
+                       "checksum", "checksum_type",
+                       "checksum_open", "checksum_open_type",
+                       "timestamp", "size", "size_open", "db_ver")
+
 class GlobalBundle(object):
 
     __slots__ = ("contenthash_type_str",
@@ -10,13 +19,33 @@ class GlobalBundle(object):
                  "calculated_old_contenthash",
                  "calculated_new_contenthash",
                  "force_database",
-                 "ignore_missing")
+                 "ignore_missing",
+                 "max_memory",
+                 "changelog_delta",
+                 "filelist_delta",
+                 "old_manifest",
+                 "new_manifest",
+                 "fragment_store",
+                 "patch_databases",
+                 "db_delta",
+                 "max_workers")
 
     def __init__(self):
         self.contenthash_type_str = "sha256"
         self.unique_md_filenames = True
         self.force_database = False
         self.ignore_missing = False
+        self.max_memory = None      # Memory limit for package identity
+                                    # lists (bytes)
+        self.changelog_delta = False    # Gen changelog-level deltas
+        self.filelist_delta = False     # Gen file-list-level deltas
+        self.old_manifest = None        # Manifest of the old repo
+        self.new_manifest = None        # Manifest of the new repo
+        self.fragment_store = None      # Store of <package> elements
+        self.patch_databases = False    # Patch old dbs instead of new ones
+        self.db_delta = False           # Gen databases of delta packages
+        self.max_workers = None         # Max. number of worker processes
+                                        # (None - number of CPUs)
 
         # Filled by plugins
         self.calculated_old_contenthash = None
@@ -50,4 +79,21 @@ class Metadata(object):
 
         # Settings
         self.checksum_type = None
-        self.compression_type = None
\ No newline at end of file
+        self.compression_type = None
+
+def repomd_record_to_dict(rec):
+    """Return picklable dict with all attributes of the
+    createrepo_c.RepomdRecord (see repomd_record_from_dict())"""
+    attrs = {"type": rec.type, "location_real": rec.location_real}
+    for attr in REPOMD_RECORD_ATTRS:
+        attrs[attr] = getattr(rec, attr)
+    return attrs
+
+def repomd_record_from_dict(attrs):
+    """Rebuild createrepo_c.RepomdRecord from the dict
+    returned by repomd_record_to_dict()"""
+    rec = cr.RepomdRecord(attrs["type"], attrs["location_real"])
+    for attr in REPOMD_RECORD_ATTRS:
+        if attrs.get(attr) is not None:
+            setattr(rec, attr, attrs[attr])
+    return rec
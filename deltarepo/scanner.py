@@ -0,0 +1,294 @@
+"""
+Fast scanners of repodata XML files.
+
+Scanners in this module don't build createrepo_c Package objects
+and don't parse the whole XML. They just find few elements of each
+<package> element by regular expressions. It is much faster and
+much less memory hungry than the full parsing when only a package
+identity is needed (e.g. during a content hash calculation) or when
+packages are just copied from one XML file to another one
+(the <package> elements are copied as raw byte ranges).
+
+Note: The scanners rely on the fact that a raw '<' could appear only
+as a start of a markup in a repodata XML (repodata don't use CDATA
+sections nor comments inside the <package> elements).
+"""
+
+import os
+import re
+import mmap
+import tempfile
+import contextlib
+import createrepo_c as cr
+
+__all__ = ["decompressed", "mapped", "iter_primary_ids", "iter_primary_ranges",
+           "iter_package_ranges", "package_attrs", "package_key",
+           "write_raw_packages"]
+
+# Elements of primary.xml which are interesting for the scanner
+_PRIMARY_RE = re.compile(r'<package\b|</package>|'
+                         r'<checksum\b([^>]*)>([^<]*)<|'
+                         r'<location\b([^>]*)>')
+
+# Package elements of filelists.xml and other.xml
+_PKGID_RE = re.compile(r'<package\b([^>]*)>|</package>')
+
+_ATTR_RE = re.compile(r'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+_ENTITY_RE = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);')
+
+_ENTITIES = {"amp": "&", "lt": "<", "gt": ">", "quot": '"', "apos": "'"}
+
+
+def _entity(match):
+    name = match.group(1)
+    if name.startswith("#x"):
+        return unichr(int(name[2:], 16)).encode("utf-8")
+    if name.startswith("#"):
+        return unichr(int(name[1:])).encode("utf-8")
+    return _ENTITIES[name]
+
+
+def _unescape(value):
+    """Replace XML entities and character references in the value"""
+    if "&" not in value:
+        return value
+    return _ENTITY_RE.sub(_entity, value)
+
+
+def _attrs(string):
+    """Parse attributes of an XML element into a dict"""
+    attrs = {}
+    for name, val1, val2 in _ATTR_RE.findall(string):
+        attrs[name] = _unescape(val1 or val2)
+    return attrs
+
+
+@contextlib.contextmanager
+def decompressed(path, tmpdir=None):
+    """Context manager that provides a path to the decompressed
+    content of the file. Uncompressed files are used directly,
+    compressed ones are decompressed to a temporary file which
+    is removed at the exit of the context.
+
+    :param path: Path to a (compressed) file
+    :type path: str
+    :param tmpdir: Directory for the temporary file
+    :type tmpdir: str or None
+    """
+    if cr.detect_compression(path) == cr.NO_COMPRESSION:
+        yield path
+        return
+
+    fd, tmp_path = tempfile.mkstemp(prefix="deltarepo-", dir=tmpdir)
+    os.close(fd)
+    try:
+        cr.decompress_file(path, tmp_path, cr.AUTO_DETECT_COMPRESSION)
+        yield tmp_path
+    finally:
+        os.remove(tmp_path)
+
+
+@contextlib.contextmanager
+def _mapped(path):
+    """Context manager that provides read only content of the file
+    as a mmap object (or as an empty string for an empty file)"""
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            yield ""
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield data
+        finally:
+            data.close()
+
+
+@contextlib.contextmanager
+def mapped(path, tmpdir=None):
+    """Context manager that provides read only content of the
+    (compressed) file as a mmap object (or as an empty string for
+    an empty file).
+
+    :param path: Path to a (compressed) file
+    :type path: str
+    :param tmpdir: Directory for a temporary file
+    :type tmpdir: str or None
+    """
+    with decompressed(path, tmpdir) as xml_path:
+        with _mapped(xml_path) as data:
+            yield data
+
+
+def _scan_primary(data):
+    """Yield (pkgId, location_href, location_base, start, end)
+    of all packages from primary.xml data, where start and end are
+    offsets of the <package> element in the data"""
+    in_package = False
+    pkgid = href = base = None
+    start = 0
+
+    for match in _PRIMARY_RE.finditer(data):
+        token = match.group(0)
+        if token.startswith("<package"):
+            in_package = True
+            pkgid = href = base = None
+            start = match.start()
+        elif not in_package:
+            continue
+        elif token.startswith("</package"):
+            in_package = False
+            yield (pkgid, href, base, start, match.end())
+        elif token.startswith("<checksum"):
+            if _attrs(match.group(1)).get("pkgid", "").upper() == "YES":
+                pkgid = _unescape(match.group(2).strip()) or None
+        else:
+            attrs = _attrs(match.group(3))
+            href = attrs.get("href") or None
+            base = attrs.get("xml:base") or None
+
+
+def _scan_pkgid_packages(data):
+    """Yield (pkgId, start, end) of all packages from filelists.xml
+    or other.xml data"""
+    pkgid = None
+    start = None
+
+    for match in _PKGID_RE.finditer(data):
+        if match.group(0).startswith("</package"):
+            if start is not None:
+                yield (pkgid, start, match.end())
+            start = None
+        else:
+            pkgid = _attrs(match.group(1)).get("pkgid") or None
+            start = match.start()
+
+
+def iter_primary_ids(path, tmpdir=None):
+    """Yield identity tuples (pkgId, location_href, location_base)
+    of all packages from a primary.xml file (in the order they
+    appear in the file). Missing values are None.
+
+    :param path: Path to a (compressed) primary.xml
+    :type path: str
+    :param tmpdir: Directory for temporary files
+    :type tmpdir: str or None
+    """
+    with mapped(path, tmpdir) as data:
+        for pkgid, href, base, _, _ in _scan_primary(data):
+            yield (pkgid, href, base)
+
+
+def iter_primary_ranges(data):
+    """Yield (pkgId, location_href, location_base, start, end) of all
+    <package> elements in the uncompressed primary.xml data (in the order
+    they appear in the data). Missing values are None.
+
+    :param data: Content of uncompressed primary.xml
+    :type data: str or mmap.mmap
+    """
+    return _scan_primary(data)
+
+
+def iter_package_ranges(data, metadata_type):
+    """Yield (pkgId, start, end) of all <package> elements
+    in the uncompressed XML data (in the order they appear in the data).
+
+    :param data: Content of uncompressed primary.xml, filelists.xml
+                 or other.xml
+    :type data: str or mmap.mmap
+    :param metadata_type: "primary", "filelists" or "other"
+    :type metadata_type: str
+    """
+    if metadata_type == "primary":
+        for pkgid, _, _, start, end in _scan_primary(data):
+            yield (pkgid, start, end)
+    else:
+        for item in _scan_pkgid_packages(data):
+            yield item
+
+
+def package_attrs(fragment):
+    """Return dict with attributes of the <package> element
+    at the beginning of the fragment (e.g. pkgid, name and arch
+    of a package from filelists.xml or other.xml)"""
+    match = _PKGID_RE.match(fragment)
+    if not match or match.group(1) is None:
+        return {}
+    return _attrs(match.group(1))
+
+
+def package_key(metadata_type, pkg_id_tuple):
+    """Return key of the <package> element of the package in the XML
+    file. The same package (pkgId) could be at more locations, elements
+    in primary.xml are identified by the whole identity tuple
+    (pkgId, location_href, location_base). Elements in filelists.xml
+    and other.xml don't contain the location, they are identified
+    just by the pkgId."""
+    pkgid, href, base = pkg_id_tuple
+    if metadata_type != "primary":
+        return pkgid
+    return (pkgid, href or None, base or None)
+
+
+def write_raw_packages(path, metadata_type, pkg_id_tuples, xml_file,
+                       tmpdir=None, transform=None, ranges=None):
+    """Copy <package> elements of the packages from the XML file
+    into the opened createrepo_c XmlFile as they are (without parsing
+    and serializing of the packages).
+
+    :param path: Path to a (compressed) primary.xml, filelists.xml
+                 or other.xml
+    :type path: str
+    :param metadata_type: "primary", "filelists" or "other"
+    :type metadata_type: str
+    :param pkg_id_tuples: Identities (pkgId, location_href, location_base)
+                          of the packages in the order in which the
+                          packages should be written
+    :type pkg_id_tuples: list
+    :param xml_file: Opened output file (with already set number
+                     of packages)
+    :type xml_file: createrepo_c.XmlFile
+    :param tmpdir: Directory for temporary files
+    :type tmpdir: str or None
+    :param transform: Function called with arguments (pkgId, fragment)
+                      for each written <package> element. It returns
+                      the fragment that is written instead.
+    :type transform: callable or None
+    :param ranges: Already known offsets {key: (start, end)} of
+                   <package> elements in the uncompressed file
+                   (e.g. from a manifest, see package_key()). The file
+                   is not scanned if they are specified.
+    :type ranges: dict or None
+    :returns: List of identities of packages which were not found
+              in the file
+    :rtype: list
+    """
+    with mapped(path, tmpdir) as data:
+        if ranges is None:
+            wanted = set(package_key(metadata_type, x) for x in pkg_id_tuples)
+            ranges = {}     # { key: (start, end) }
+            if metadata_type == "primary":
+                for pkgid, href, base, start, end in _scan_primary(data):
+                    key = package_key(metadata_type, (pkgid, href, base))
+                    if key in wanted:
+                        ranges[key] = (start, end)
+            else:
+                for pkgid, start, end in _scan_pkgid_packages(data):
+                    if pkgid in wanted:
+                        ranges[pkgid] = (start, end)
+
+        missing = []
+        for pkg_id_tuple in pkg_id_tuples:
+            key = package_key(metadata_type, pkg_id_tuple)
+            if key not in ranges:
+                missing.append(pkg_id_tuple)
+                continue
+            pkgid = pkg_id_tuple[0]
+            start, end = ranges[key]
+            fragment = data[start:end]
+            if transform is not None:
+                fragment = transform(pkgid, fragment)
+            xml_file.add_chunk(fragment + "\n")
+
+    return missing
@@ -1,16 +1,20 @@
 import shutil
 import os
 import pprint
+import hashlib
 import os.path
 import time
 import librepo
 import tempfile
 import createrepo_c as cr
 from .applicator import DeltaRepoApplicator
+from .fusedapplicator import FusedDeltaRepoApplicator
 from .deltarepos import DeltaRepos
 from .common import LoggingInterface
 from .util import calculate_content_hash
-from .errors import DeltaRepoError
+from .manifest import load_manifest
+from .checkpoint import UpdateJournal
+from .errors import DeltaRepoError, DeltaRepoCompositionError
 
 class _Repo(object):
     """Base class for LocalRepo and OriginRepo classes."""
@@ -28,6 +32,7 @@ class _Repo(object):
         self.repomd_contenthash_type = None # Content hash from repomd
         self.listed_metadata = []   # ["primary", "filelists", ...]
         self.present_metadata = []  # Metadata files which really exist in repo
+        self.primary_path = None    # Path to primary metadata (only for local repo)
         self._repomd = None          # createrepo_c.Repomd() object
 
     def __cmp__(self, other):
@@ -48,7 +53,8 @@ class _Repo(object):
         self.listed_metadata = listed_metadata
         self._repomd = repomd
 
-    def _fill_from_path(self, path, contenthash=True, contenthash_type="sha256"):
+    def _fill_from_path(self, path, contenthash=True, contenthash_type="sha256",
+                        use_manifest=False):
         """Fill attributes from a repository specified by path.
 
         :param path: Path to repository (a dir that contains repodata/ subdirectory)
@@ -57,6 +63,9 @@ class _Repo(object):
         :type contenthash: bool
         :param contenthash_type: type of the calculated content hash
         :type contenthash_type: str
+        :param use_manifest: Take the content hash from an up to date
+                             manifest of the repo (if available)
+        :type use_manifest: bool
         """
 
         if not os.path.isdir(path) or \
@@ -85,10 +94,18 @@ class _Repo(object):
             if not primary_path:
                 raise DeltaRepoError("{0} - primary metadata are missing"
                                      "".format(primary_path))
-            self.contenthash = calculate_content_hash(primary_path, contenthash_type)
+            manifest = None
+            if use_manifest:
+                records = dict((rec.type, rec) for rec in repomd.records)
+                manifest = load_manifest(path, records)
+            if manifest is not None:
+                self.contenthash = manifest.content_hash(contenthash_type)
+            else:
+                self.contenthash = calculate_content_hash(primary_path, contenthash_type)
             self.contenthash_type = contenthash_type
 
         self.path = path
+        self.primary_path = primary_path
         self.repodata = os.path.join(path, "repodata")
         self.basename = os.path.basename(path)
         self.repomd_size = os.path.getsize(repomd_path)
@@ -114,12 +131,14 @@ class LocalRepo(_Repo):
         return "<LocalRepo {0} ({1})>".format(self.path, self.timestamp)
 
     @classmethod
-    def from_path(cls, path, contenthash_type="sha256", calc_contenthash=True):
+    def from_path(cls, path, contenthash_type="sha256", calc_contenthash=True,
+                  use_manifest=False):
         """Create a LocalRepo object from a path to the repo."""
         lr = cls()
         lr._fill_from_path(path,
                            contenthash=calc_contenthash,
-                           contenthash_type=contenthash_type)
+                           contenthash_type=contenthash_type,
+                           use_manifest=use_manifest)
         return lr
 
 
@@ -164,6 +183,7 @@ class OriginRepo(_Repo):
         repo.path = None
         repo.repodata = None
         repo.basename = None
+        repo.primary_path = None
 
         repo.urls = urls
         repo.mirrorlist = mirrorlist
@@ -613,18 +633,28 @@ class Updater(LoggingInterface):
             self.h = h
             self.r = r
 
-    def __init__(self, localrepo, logger=None, outputdir=None):
+    def __init__(self, localrepo, logger=None, outputdir=None, workdir=None):
         LoggingInterface.__init__(self, logger)
         self.localrepo = localrepo
         self.outputdir = outputdir  # In case that result should be
                                     # writen to different location and
                                     # localrepo should not be overwritten
+        self.workdir = workdir      # Dir for checkpoints of the update
+                                    # (downloaded deltas, intermediate
+                                    # repos) - see checkpoint module
 
     def _get_tmpdir(self):
         tmpdir = tempfile.mkdtemp(prefix="deltarepos-", dir="/tmp")
         self._debug("Using temporary directory: {0}".format(tmpdir))
         return tmpdir
 
+    def _get_workdir(self):
+        if self.workdir:
+            return self.workdir
+        # Next to the destination repodata (the same device)
+        return os.path.join(os.path.dirname(self._get_dst()),
+                            ".deltarepos-update")
+
     def _get_dst(self):
         if self.outputdir:
             return os.path.join(self.outputdir, "repodata")
@@ -651,42 +681,178 @@ class Updater(LoggingInterface):
         shutil.rmtree(tmp_dst_backup)
         self._debug("Final move - COMPLETE".format(src, dst))
 
-    def apply_resolved_path(self, resolved_path, whitelisted_metadata=None):
+    @staticmethod
+    def _checkpoint_dirname(prefix, key):
+        return "{0}_{1}".format(prefix, hashlib.sha1(key).hexdigest()[:16])
+
+    @staticmethod
+    def _repomd_contenthash(path):
+        """Return content hash from repomd.xml of the repo or None"""
+        repomd_path = os.path.join(path, "repodata", "repomd.xml")
+        if not os.path.isfile(repomd_path):
+            return None
+        try:
+            return cr.Repomd(repomd_path).contenthash
+        except Exception:
+            return None
+
+    def _download_link(self, journal, link, counter, total,
+                       whitelisted_metadata):
+        """Download the delta repo (if it isn't already downloaded)
+        and return path to it"""
+        key = "{0}-{1}".format(link.src, link.dst)
+        url = link.deltarepourl
+
+        dirname = journal.get_download(key, url, whitelisted_metadata)
+        if dirname:
+            destdir = os.path.join(journal.workdir, dirname)
+            if self._repomd_contenthash(destdir) == key:
+                self._info("{0:2}/{1:<2} Using already downloaded delta "
+                           "repo {2}".format(counter, total, url))
+                return destdir
+            journal.remove_download(key)
+
+        self._info("{0:2}/{1:<2} Downloading delta repo {2}".format(
+            counter, total, url))
+        dirname = self._checkpoint_dirname("deltarepo", key)
+        destdir = os.path.join(journal.workdir, dirname)
+        if os.path.exists(destdir):
+            shutil.rmtree(destdir)
+        os.mkdir(destdir)
+        repo = Updater.DownloadedRepo(urls=[url])
+        repo.download(destdir, wanted_metadata=whitelisted_metadata)
+        if self._repomd_contenthash(destdir) != key:
+            raise DeltaRepoError("Downloaded delta repo {0} doesn't "
+                                 "match the expected content hashes "
+                                 "{1}".format(url, key))
+
+        journal.add_download(key, url, dirname, whitelisted_metadata)
+        journal.save()
+        return destdir
+
+    def _checkpoint_applied(self, journal, links, repo_path, prevrepo):
+        """Record the applied intermediate repo and remove data which
+        are not needed anymore (the previous intermediate repo and
+        the applied deltas)"""
+        journal.set_applied(os.path.basename(repo_path), links[-1].dst)
+        for link in links:
+            journal.remove_download("{0}-{1}".format(link.src, link.dst))
+        journal.save()
+        if os.path.dirname(prevrepo) == journal.workdir:
+            shutil.rmtree(prevrepo)
+        for dirname in os.listdir(journal.workdir):
+            if dirname.startswith("deltarepo_") and dirname not in \
+                    [x["dir"] for x in journal.downloaded.values()]:
+                shutil.rmtree(os.path.join(journal.workdir, dirname))
+
+    def _new_repo_dir(self, journal, contenthash):
+        """Prepare empty directory for an intermediate repo"""
+        path = os.path.join(journal.workdir,
+                            self._checkpoint_dirname("repo", contenthash))
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.mkdir(path)
+        return path
+
+    def apply_resolved_path(self, resolved_path, whitelisted_metadata=None,
+                            fused=True, target_metadata=None, resume=True):
+        """Download and apply the deltas of the resolved path.
+
+        Progress is recorded in a journal in the work directory
+        (see checkpoint module). If resume is True and a previous
+        update of the repo was interrupted, the update continues from
+        the last applied intermediate repo and already downloaded
+        deltas are reused.
+        """
         # TODO: Make it look better (progressbar, etc.)
-        counter = 1
-        tmpdir = self._get_tmpdir()
-        tmprepo = tempfile.mkdtemp(prefix="targetrepo", dir=tmpdir)
+        links = list(resolved_path)
+        link_keys = ["{0}-{1}".format(x.src, x.dst) for x in links]
+        workdir = self._get_workdir()
+
+        journal = None
+        if resume and os.path.isdir(workdir):
+            journal = UpdateJournal.load(workdir)
+            if not links or journal.source != links[0].src:
+                # Checkpoints of an update of a different repo state
+                journal = None
+        if journal is None:
+            if os.path.exists(workdir):
+                self._debug("Removing old checkpoints: {0}".format(workdir))
+                shutil.rmtree(workdir)
+            os.makedirs(workdir)
+            journal = UpdateJournal(workdir,
+                                    source=links[0].src if links else None)
+            journal.save()
+        self._debug("Using work directory: {0}".format(workdir))
+
+        # Continue from the last applied intermediate repo
         prevrepo = self.localrepo.path
-
-        for link in resolved_path:
-
-            # Download repo
-            self._info("{0:2}/{1:<2} Downloading delta repo {2}".format(
-                counter, len(resolved_path), link.deltarepourl))
-            dirname = "deltarepo_{0:02}".format(counter)
-            destdir = os.path.join(tmpdir, dirname)
-            os.mkdir(destdir)
-            repo = Updater.DownloadedRepo(urls=[link.deltarepourl])
-            repo.download(destdir, wanted_metadata=whitelisted_metadata)
-
-            # Apply repo
-            self._info("{0:2}/{1:<2} Applying delta repo".format(
-                counter, len(resolved_path)))
-            da = DeltaRepoApplicator(prevrepo,
-                                     destdir,
-                                     out_path=tmprepo,
-                                     logger=self.logger,
-                                     ignore_missing=True)
-            da.apply()
-
-            counter += 1
-            prevrepo = tmprepo
+        start = journal.resume_index(link_keys)
+        if start:
+            path = os.path.join(workdir, journal.applied["dir"])
+            if self._repomd_contenthash(path) == \
+                    journal.applied["contenthash"]:
+                if start < len(links):
+                    self._info("Resuming the update from delta repo "
+                               "{0}/{1}".format(start + 1, len(links)))
+                else:
+                    self._info("All delta repos are already applied")
+                prevrepo = path
+            else:
+                start = 0
+        links = links[start:]
+
+        # Download repos
+        destdirs = []
+        for counter, link in enumerate(links, start + 1):
+            destdirs.append(self._download_link(journal, link, counter,
+                                                start + len(links),
+                                                whitelisted_metadata))
+
+        # Apply all repos at once (the repo is rewritten only once)
+        applied = False
+        if fused and len(destdirs) > 1:
+            self._info("Applying {0} delta repos at once".format(len(destdirs)))
+            tmprepo = self._new_repo_dir(journal, links[-1].dst)
+            try:
+                da = FusedDeltaRepoApplicator(prevrepo,
+                                              destdirs,
+                                              out_path=tmprepo,
+                                              logger=self.logger,
+                                              ignore_missing=True,
+                                              target_metadata=target_metadata)
+                da.apply()
+                applied = True
+            except DeltaRepoCompositionError as err:
+                self._debug("Delta repos cannot be applied at once: {0} - "
+                            "Applying them one by one".format(err))
+                shutil.rmtree(tmprepo)
+            if applied:
+                self._checkpoint_applied(journal, links, tmprepo, prevrepo)
+                prevrepo = tmprepo
+
+        # Apply repos one by one
+        if not applied:
+            for counter, (link, destdir) in enumerate(zip(links, destdirs),
+                                                      start + 1):
+                self._info("{0:2}/{1:<2} Applying delta repo".format(
+                    counter, start + len(destdirs)))
+                tmprepo = self._new_repo_dir(journal, link.dst)
+                da = DeltaRepoApplicator(prevrepo,
+                                         destdir,
+                                         out_path=tmprepo,
+                                         logger=self.logger,
+                                         ignore_missing=True,
+                                         target_metadata=target_metadata)
+                da.apply()
+                self._checkpoint_applied(journal, [link], tmprepo, prevrepo)
+                prevrepo = tmprepo
 
         # Move updated repo to the final destination
-        src = os.path.join(tmprepo, "repodata")
+        src = os.path.join(prevrepo, "repodata")
         dst = self._get_dst()
         self._final_move(src, dst)
-        shutil.rmtree(tmpdir)
+        shutil.rmtree(workdir)
 
     def update_from_origin(self, origin_repo, wanted_metadata=None):
         tmpdir = self._get_tmpdir()
@@ -6,6 +6,7 @@ import createrepo_c as cr
 
 import deltarepo
 from deltarepo.errors import DeltaRepoError
+from deltarepo.scanner import iter_primary_ids
 
 
 def log(logger, level, msg):
@@ -82,6 +83,17 @@ def log_critical(logger, msg):
         logger.critical(msg)
 
 
+class PrefixLoggerAdapter(logging.LoggerAdapter):
+    """Logger adapter which prefixes all messages
+    (e.g. by a name of a job run in parallel with others)"""
+
+    def __init__(self, logger, prefix):
+        logging.LoggerAdapter.__init__(self, logger, {"prefix": prefix})
+
+    def process(self, msg, kwargs):
+        return "{0}{1}".format(self.extra["prefix"], msg), kwargs
+
+
 def pkg_id_str(pkg, logger=None):
     """Return string identifying a package in repodata.
     This strings are used for the RepoId calculation."""
@@ -101,22 +113,85 @@ def pkg_id_str(pkg, logger=None):
     return idstr
 
 
-def calculate_content_hash(path_to_primary_xml, checksum_type="sha256", logger=None):
-    pkg_id_strs = []
+def pkg_id_tuple_str(pkg_id_tuple, logger=None):
+    """Return string identifying a package in repodata.
+    The same as pkg_id_str() but for an identity tuple
+    (pkgId, location_href, location_base)."""
+    pkgid, location_href, location_base = pkg_id_tuple
 
-    if checksum_type == "sha":
-        # Classical createrepo says sha but means sha1 - so let's keep things around packaging stack compatible
-        checksum_type = "sha1"
+    if not pkgid:
+        log(logger, logging.WARNING, "Missing pkgId in a package!")
 
-    def pkgcb(pkg):
-        pkg_id_strs.append(pkg_id_str(pkg, logger))
+    if not location_href:
+        log(logger, logging.WARNING, "Missing location_href at "
+                                     "package %s" % pkgid)
+
+    idstr = "%s%s%s" % (pkgid or '',
+                        location_href or '',
+                        location_base or '')
+    return idstr
 
-    cr.xml_parse_primary(path_to_primary_xml, pkgcb=pkgcb, do_files=False)
 
-    h = hashlib.new(checksum_type)
-    for i in sorted(pkg_id_strs):
-        h.update(i)
-    return h.hexdigest()
+def content_hashes_from_ids(pkg_id_tuples, checksum_types=("sha256",), logger=None):
+    """Calculate content hashes from package identity tuples.
+
+    :param pkg_id_tuples: Identity tuples (pkgId, location_href, location_base)
+    :type pkg_id_tuples: iterable
+    :param checksum_types: Types of requested content hashes
+    :type checksum_types: list of str
+    :param logger: A logger
+    :type logger: logging.Logger or None
+    :returns: Content hashes {checksum_type: content_hash}
+    :rtype: dict
+    """
+    pkg_id_strs = sorted(pkg_id_tuple_str(x, logger) for x in pkg_id_tuples)
+    return content_hashes_from_id_strs(pkg_id_strs, checksum_types)
+
+
+def content_hashes_from_id_strs(sorted_pkg_id_strs, checksum_types=("sha256",)):
+    """Calculate content hashes from already sorted package identity
+    strings (see pkg_id_tuple_str()). The strings are iterated only once.
+
+    :param sorted_pkg_id_strs: Sorted identity strings
+    :type sorted_pkg_id_strs: iterable
+    :param checksum_types: Types of requested content hashes
+    :type checksum_types: list of str
+    :returns: Content hashes {checksum_type: content_hash}
+    :rtype: dict
+    """
+    hashes = {}
+    for checksum_type in checksum_types:
+        hash_type = checksum_type
+        if hash_type == "sha":
+            # Classical createrepo says sha but means sha1 - so let's keep things around packaging stack compatible
+            hash_type = "sha1"
+        hashes[checksum_type] = hashlib.new(hash_type)
+
+    for i in sorted_pkg_id_strs:
+        for h in hashes.itervalues():
+            h.update(i)
+
+    contenthashes = {}
+    for checksum_type, h in hashes.items():
+        contenthashes[checksum_type] = h.hexdigest()
+    return contenthashes
+
+
+def calculate_content_hashes(path_to_primary_xml, checksum_types=("sha256",), logger=None):
+    """Calculate multiple content hashes with a single pass
+    over the primary.xml file.
+
+    :returns: Content hashes {checksum_type: content_hash}
+    :rtype: dict
+    """
+    return content_hashes_from_ids(iter_primary_ids(path_to_primary_xml),
+                                   checksum_types, logger)
+
+
+def calculate_content_hash(path_to_primary_xml, checksum_type="sha256", logger=None):
+    return calculate_content_hashes(path_to_primary_xml,
+                                    [checksum_type],
+                                    logger)[checksum_type]
 
 
 def size_to_human_readable_str(size_in_bytes):
@@ -236,6 +311,28 @@ def ts_to_str(ts):
     return datetime.datetime.fromtimestamp(int(ts)).strftime("%Y-%m-%d %H:%M:%S")
 
 
+def skip_delta_distances(num_revisions):
+    """Return distances (1, 2, 4, 8, ...) of previous revisions from
+    which deltas to the current revision should be generated.
+
+    If every revision gets deltas by this schedule, any previous
+    revision is connected to the current one by a path of at most
+    log2(n) + 1 deltas (the distance is decomposed into powers of two),
+    while only about log2(n) deltas are generated for each revision.
+
+    :param num_revisions: Number of available previous revisions
+    :type num_revisions: int
+    :returns: Distances (1 = the newest previous revision)
+    :rtype: list
+    """
+    distances = []
+    distance = 1
+    while distance <= num_revisions:
+        distances.append(distance)
+        distance *= 2
+    return distances
+
+
 def deltareposrecord_from_repopath(path, prefix_to_strip=None, logger=None):
     """Create DeltaRepoRecord object from a delta repository
 
@@ -29,6 +29,8 @@ REPO_01_PATH = os.path.join(TEST_DATA_PATH, "repo_01")
 REPO_01_PRIMARY = os.path.join(REPO_01_PATH, "repodata", "341297672077ef71a5f8db569932d20975e906f192986cdfa8ab535f0c224d4d-primary.xml.gz")
 REPO_02_PATH = os.path.join(TEST_DATA_PATH, "repo_02")
 REPO_02_PRIMARY = os.path.join(REPO_02_PATH, "repodata", "a7715505059733a63c49e66fffc7cf3aee6217ae05bede274a2b3e3e143de7c6-primary.xml.gz")
+REPO_02_FILELISTS = os.path.join(REPO_02_PATH, "repodata", "9917099255ceb957d84978fe48725a2fc3ca8bfd360a8842931b3876aa4a8e2b-filelists.xml.gz")
+REPO_02_OTHER = os.path.join(REPO_02_PATH, "repodata", "ca8286461c13f20f438bc843116f859d5897d1d0dcb1cce55b644c488964f9bf-other.xml.gz")
 
 
 def cp(src, dst):
@@ -0,0 +1,164 @@
+import os
+import shutil
+import unittest
+import tempfile
+import createrepo_c as cr
+
+from deltarepo.generator import DeltaRepoGenerator
+from deltarepo.applicator import DeltaRepoApplicator
+
+from .fixtures import *
+
+
+def primary_packages(repo_path):
+    """Return (pkgId, location_href, files) of packages in primary.xml"""
+    repomd = cr.Repomd(os.path.join(repo_path, "repodata", "repomd.xml"))
+    primary = [rec for rec in repomd.records if rec.type == "primary"][0]
+    pkgs = []
+    cr.xml_parse_primary(os.path.join(repo_path, primary.location_href),
+                         pkgcb=pkgs.append, do_files=True)
+    return [(pkg.pkgId, pkg.location_href, sorted(pkg.files)) for pkg in pkgs]
+
+
+def package_elements(repo_path, metadata_type):
+    """Return (pkgId, changelogs or files) of packages in other.xml
+    or filelists.xml"""
+    parsefunc, attr = {
+        "other": (cr.xml_parse_other, "changelogs"),
+        "filelists": (cr.xml_parse_filelists, "files"),
+    }[metadata_type]
+    repomd = cr.Repomd(os.path.join(repo_path, "repodata", "repomd.xml"))
+    rec = [rec for rec in repomd.records if rec.type == metadata_type][0]
+    pkgs = []
+    parsefunc(os.path.join(repo_path, rec.location_href), pkgcb=pkgs.append)
+    return [(pkg.pkgId, getattr(pkg, attr)) for pkg in pkgs]
+
+
+def rewritten_repo(repo_path, out_path, locations):
+    """Write primary, filelists and other of the repo to the out_path,
+    each package is written at the locations returned by
+    locations(location_href) (its pkgId, files and changelogs are kept)"""
+    repomd = cr.Repomd(os.path.join(repo_path, "repodata", "repomd.xml"))
+    paths = dict((rec.type, os.path.join(repo_path, rec.location_href))
+                 for rec in repomd.records)
+    pkgs = []
+    cr.xml_parse_primary(paths["primary"], pkgcb=pkgs.append, do_files=True)
+    pkgs_by_id = dict((pkg.pkgId, pkg) for pkg in pkgs)
+    for metadata_type, parsefunc in (("filelists", cr.xml_parse_filelists),
+                                     ("other", cr.xml_parse_other)):
+        parsefunc(paths[metadata_type],
+                  newpkgcb=lambda pkgId, name, arch: pkgs_by_id.get(pkgId),
+                  pkgcb=lambda pkg: None)
+
+    repodata = os.path.join(out_path, "repodata")
+    os.makedirs(repodata)
+    files = []
+    for metadata_type, xmlclass in (("primary", cr.PrimaryXmlFile),
+                                    ("filelists", cr.FilelistsXmlFile),
+                                    ("other", cr.OtherXmlFile)):
+        fn = os.path.join(repodata, "{0}.xml.gz".format(metadata_type))
+        files.append((metadata_type, fn, xmlclass(fn)))
+
+    pkg_locations = [(pkg, locations(pkg.location_href)) for pkg in pkgs]
+    for _, _, f in files:
+        f.set_num_of_pkgs(sum(len(hrefs) for _, hrefs in pkg_locations))
+    for pkg, hrefs in pkg_locations:
+        for href in hrefs:
+            pkg.location_href = href
+            for _, _, f in files:
+                f.add_pkg(pkg)
+
+    new_repomd = cr.Repomd()
+    new_repomd.set_revision(repomd.revision)
+    for metadata_type, fn, f in files:
+        f.close()
+        rec = cr.RepomdRecord(metadata_type, fn)
+        rec.fill(cr.SHA256)
+        new_repomd.set_record(rec)
+    with open(os.path.join(repodata, "repomd.xml"), "w") as f:
+        f.write(new_repomd.xml_dump())
+    return out_path
+
+
+def relocated_repo(repo_path, out_path, subdir):
+    """Copy the repo with all packages moved to the subdir"""
+    return rewritten_repo(repo_path, out_path,
+                          lambda href: [os.path.join(subdir, href)])
+
+
+class TestCaseGenerateApply(unittest.TestCase):
+    """Tests for generation and application of a delta (round trip)"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="deltarepo-test-")
+        self.delta_path = os.path.join(self.tmpdir, "delta")
+        self.new_path = os.path.join(self.tmpdir, "new")
+        os.mkdir(self.delta_path)
+        os.mkdir(self.new_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def roundtrip(self, old_path, new_path, gen_kwargs=None, **kwargs):
+        DeltaRepoGenerator(old_path, new_path,
+                           out_path=self.delta_path,
+                           **(gen_kwargs or {})).gen()
+        DeltaRepoApplicator(old_path, self.delta_path,
+                            out_path=self.new_path, **kwargs).apply()
+
+    def test_primary_of_applied_delta(self):
+        self.roundtrip(REPO_01_PATH, REPO_02_PATH)
+        expected = primary_packages(REPO_02_PATH)
+        self.assertTrue([x for x in expected if x[2]])
+        self.assertEqual(primary_packages(self.new_path), expected)
+
+    def test_primary_of_applied_delta_with_database(self):
+        # Database is built from all packages - also the old ones
+        # are parsed and written to primary.xml
+        self.roundtrip(REPO_01_PATH, REPO_02_PATH, force_database=True)
+        self.assertEqual(primary_packages(self.new_path),
+                         primary_packages(REPO_02_PATH))
+
+    def test_relocated_package_with_changelog_delta(self):
+        # The package is removed and added with the same pkgId,
+        # it must not be used as a base package of itself
+        new_path = relocated_repo(REPO_01_PATH,
+                                  os.path.join(self.tmpdir, "relocated"),
+                                  "sub")
+        self.roundtrip(REPO_01_PATH, new_path,
+                       gen_kwargs={"changelog_delta": True})
+        self.assertEqual(primary_packages(self.new_path),
+                         primary_packages(new_path))
+        expected = package_elements(new_path, "other")
+        self.assertTrue([x for x in expected if x[1]])
+        self.assertEqual(package_elements(self.new_path, "other"), expected)
+
+    def test_relocated_package_with_filelist_delta(self):
+        new_path = relocated_repo(REPO_01_PATH,
+                                  os.path.join(self.tmpdir, "relocated"),
+                                  "sub")
+        self.roundtrip(REPO_01_PATH, new_path,
+                       gen_kwargs={"filelist_delta": True})
+        expected = package_elements(new_path, "filelists")
+        self.assertTrue([x for x in expected if x[1]])
+        self.assertEqual(package_elements(self.new_path, "filelists"),
+                         expected)
+
+    def test_same_pkgid_at_more_locations_one_removed(self):
+        # Only the copy at the removed location is dropped
+        # from filelists and other
+        old_path = rewritten_repo(REPO_01_PATH,
+                                  os.path.join(self.tmpdir, "old"),
+                                  lambda href: [href, "sub/" + href])
+        new_path = rewritten_repo(REPO_01_PATH,
+                                  os.path.join(self.tmpdir, "new_repo"),
+                                  lambda href: ["sub/" + href])
+        self.roundtrip(old_path, new_path)
+        self.assertEqual(primary_packages(self.new_path),
+                         primary_packages(new_path))
+        for metadata_type in ("filelists", "other"):
+            self.assertEqual(package_elements(self.new_path, metadata_type),
+                             package_elements(new_path, metadata_type))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import unittest
+import tempfile
+
+from deltarepo.checkpoint import JOURNAL_FILENAME, UpdateJournal
+
+
+class TestCaseUpdateJournal(unittest.TestCase):
+    """Tests for checkpoint module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="deltarepo-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_and_load(self):
+        journal = UpdateJournal(self.tmpdir, source="aaa")
+        journal.add_download("aaa-bbb", "http://x/1", "deltarepo_1",
+                             ["primary", "deltametadata"])
+        journal.set_applied("repo_1", "bbb")
+        journal.save()
+
+        journal = UpdateJournal.load(self.tmpdir)
+        self.assertEqual(journal.source, "aaa")
+        self.assertEqual(journal.applied,
+                         {"dir": "repo_1", "contenthash": "bbb"})
+        self.assertEqual(journal.get_download("aaa-bbb", "http://x/1",
+                                              ["deltametadata", "primary"]),
+                         "deltarepo_1")
+        self.assertEqual(journal.get_download("aaa-bbb", "http://y/1",
+                                              ["deltametadata", "primary"]),
+                         None)
+        self.assertEqual(journal.get_download("aaa-bbb", "http://x/1"), None)
+
+        journal.remove_download("aaa-bbb")
+        self.assertEqual(journal.get_download("aaa-bbb", "http://x/1",
+                                              ["deltametadata", "primary"]),
+                         None)
+
+    def test_load_missing_or_broken(self):
+        journal = UpdateJournal.load(self.tmpdir)
+        self.assertEqual(journal.source, None)
+        self.assertEqual(journal.applied, None)
+
+        open(os.path.join(self.tmpdir, JOURNAL_FILENAME), "w").write("{")
+        journal = UpdateJournal.load(self.tmpdir)
+        self.assertEqual(journal.source, None)
+        self.assertEqual(journal.downloaded, {})
+
+    def test_resume_index(self):
+        keys = ["aaa-bbb", "bbb-ccc", "ccc-ddd"]
+        journal = UpdateJournal(self.tmpdir, source="aaa")
+        self.assertEqual(journal.resume_index(keys), 0)
+        journal.set_applied("repo_1", "ccc")
+        self.assertEqual(journal.resume_index(keys), 2)
+        journal.set_applied("repo_1", "ddd")
+        self.assertEqual(journal.resume_index(keys), 3)
+        journal.set_applied("repo_1", "xxx")
+        self.assertEqual(journal.resume_index(keys), 0)
+
+if __name__ == "__main__":
+    unittest.main()
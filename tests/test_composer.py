@@ -0,0 +1,63 @@
+import unittest
+
+from deltarepo.composer import PackageChanges
+from deltarepo.errors import DeltaRepoCompositionError
+
+
+class TestCasePackageChanges(unittest.TestCase):
+    """Tests for composition of package changes of chained deltas"""
+
+    OLD = [("a1", "a.rpm", None), ("b1", "b.rpm", None), ("c1", "c.rpm", None)]
+
+    def test_compose(self):
+        changes = PackageChanges()
+        changes.add_delta(0, [("a.rpm", None)],
+                          [("a2", "a.rpm", None), ("d1", "d.rpm", None)])
+        changes.add_delta(1, [("b.rpm", None)], [("e1", "e.rpm", None)])
+        self.assertEqual(list(changes.removed), [("a.rpm", None),
+                                                 ("b.rpm", None)])
+        self.assertEqual(changes.added_by(0), [("a2", "a.rpm", None),
+                                               ("d1", "d.rpm", None)])
+        self.assertEqual(changes.added_by(1), [("e1", "e.rpm", None)])
+        self.assertEqual(sorted(changes.identities(self.OLD)),
+                         [("a2", "a.rpm", None), ("c1", "c.rpm", None),
+                          ("d1", "d.rpm", None), ("e1", "e.rpm", None)])
+
+    def test_added_and_removed_cancel_out(self):
+        changes = PackageChanges()
+        changes.add_delta(0, [], [("d1", "d.rpm", None)])
+        changes.add_delta(1, [("d.rpm", None)], [("d2", "d.rpm", "http://x/")])
+        changes.add_delta(2, [("d.rpm", "http://x/")], [])
+        self.assertEqual(list(changes.removed), [])
+        self.assertEqual(list(changes.added), [])
+        self.assertEqual(list(changes.identities(self.OLD)), self.OLD)
+
+    def test_removed_and_added_again(self):
+        changes = PackageChanges()
+        changes.add_delta(0, [("a.rpm", None)], [])
+        changes.add_delta(1, [], [("a2", "a.rpm", None)])
+        changes.add_delta(2, [("a.rpm", None)], [("a3", "a.rpm", None)])
+        self.assertEqual(list(changes.removed), [("a.rpm", None)])
+        self.assertEqual(changes.added_by(1), [])
+        self.assertEqual(changes.added_by(2), [("a3", "a.rpm", None)])
+        self.assertEqual(sorted(changes.identities(self.OLD)),
+                         [("a3", "a.rpm", None), ("b1", "b.rpm", None),
+                          ("c1", "c.rpm", None)])
+
+    def test_same_pkgid_at_more_locations(self):
+        changes = PackageChanges()
+        changes.add_delta(0, [], [("d1", "d.rpm", None),
+                                  ("d1", "x/d.rpm", None)])
+        changes.add_delta(1, [("d.rpm", None)], [])
+        self.assertEqual(changes.added_by(0), [("d1", "x/d.rpm", None)])
+        self.assertEqual(sorted(changes.identities(self.OLD)),
+                         self.OLD + [("d1", "x/d.rpm", None)])
+
+    def test_removed_twice(self):
+        changes = PackageChanges()
+        changes.add_delta(0, [("a.rpm", None)], [])
+        self.assertRaises(DeltaRepoCompositionError, changes.add_delta,
+                          1, [("a.rpm", None)], [])
+
+if __name__ == "__main__":
+    unittest.main()
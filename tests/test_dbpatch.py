@@ -0,0 +1,92 @@
+import os
+import shutil
+import sqlite3
+import unittest
+import tempfile
+
+from deltarepo.dbpatch import db_checksum, package_count
+from deltarepo.dbpatch import remove_packages, insert_packages
+
+
+class TestCaseDbPatch(unittest.TestCase):
+    """Tests for dbpatch module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="deltarepo-test-")
+        self.db_fn = os.path.join(self.tmpdir, "primary.sqlite")
+        self._create_db(self.db_fn, ((1, "a1", "a.rpm", None),
+                                     (2, "b1", "b.rpm", None),
+                                     (3, "c1", "c.rpm", "http://x/")))
+
+    def _create_db(self, path, packages):
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE db_info (dbversion INTEGER, "
+                     "checksum TEXT)")
+        conn.execute("CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, "
+                     "pkgId TEXT, location_href TEXT, location_base TEXT)")
+        conn.execute("CREATE TABLE files (name TEXT, type TEXT, "
+                     "pkgKey INTEGER)")
+        conn.execute("INSERT INTO db_info VALUES (10, 'abc')")
+        for key, pkgid, href, base in packages:
+            conn.execute("INSERT INTO packages VALUES (?, ?, ?, ?)",
+                         (key, pkgid, href, base))
+            conn.execute("INSERT INTO files VALUES (?, 'file', ?)",
+                         ("/usr/bin/" + pkgid, key))
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _rows(self, table, column):
+        conn = sqlite3.connect(self.db_fn)
+        rows = [row[0] for row in conn.execute(
+                "SELECT {0} FROM {1} ORDER BY {0}".format(column, table))]
+        conn.close()
+        return rows
+
+    def test_db_checksum(self):
+        self.assertEqual(db_checksum(self.db_fn), "abc")
+        self.assertEqual(db_checksum(os.path.join(self.tmpdir, "foo")), None)
+
+    def test_remove_packages_by_pkgid(self):
+        self.assertEqual(remove_packages(self.db_fn, pkgids=["a1", "x1"]), 2)
+        self.assertEqual(self._rows("packages", "pkgId"), ["b1", "c1"])
+        self.assertEqual(self._rows("files", "name"),
+                         ["/usr/bin/b1", "/usr/bin/c1"])
+
+    def test_remove_packages_by_location(self):
+        self.assertEqual(remove_packages(self.db_fn,
+                                         locations=[("b.rpm", None),
+                                                    ("c.rpm", None)]), 2)
+        self.assertEqual(remove_packages(self.db_fn,
+                                         locations=[("c.rpm", "http://x/")]), 1)
+        self.assertEqual(self._rows("packages", "pkgId"), ["a1"])
+        self.assertEqual(self._rows("files", "pkgKey"), [1])
+
+    def test_insert_packages(self):
+        payload_fn = os.path.join(self.tmpdir, "payload.sqlite")
+        self._create_db(payload_fn, ((1, "d1", "d.rpm", None),
+                                     (2, "e1", "e.rpm", None)))
+        remove_packages(self.db_fn, pkgids=["c1"])
+        self.assertEqual(insert_packages(self.db_fn, payload_fn), 2)
+        self.assertEqual(package_count(self.db_fn), 4)
+        self.assertEqual(self._rows("packages", "pkgKey"), [1, 2, 3, 4])
+        self.assertEqual(self._rows("files", "name"),
+                         ["/usr/bin/a1", "/usr/bin/b1",
+                          "/usr/bin/d1", "/usr/bin/e1"])
+
+    def test_insert_packages_different_tables(self):
+        payload_fn = os.path.join(self.tmpdir, "payload.sqlite")
+        conn = sqlite3.connect(payload_fn)
+        conn.execute("CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, "
+                     "pkgId TEXT, location_href TEXT, location_base TEXT)")
+        conn.execute("INSERT INTO packages VALUES (1, 'd1', 'd.rpm', NULL)")
+        conn.commit()
+        conn.close()
+        self.assertRaises(sqlite3.Error, insert_packages, self.db_fn,
+                          payload_fn)
+        self.assertEqual(package_count(self.db_fn), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+from deltarepo.errors import DeltaRepoError
+from deltarepo.elementdelta import ELEMENT_RES
+from deltarepo.elementdelta import diff_sequences
+from deltarepo.elementdelta import patch_sequence
+from deltarepo.elementdelta import index_base_fragments
+from deltarepo.elementdelta import delta_fragment
+
+
+OLD_FRAGMENT = """<package pkgid="aaa" name="foo" arch="noarch">
+  <version epoch="0" ver="1.0" rel="1"/>
+  <changelog author="Bob - 0.9-1" date="1">- First</changelog>
+  <changelog author="Bob - 1.0-1" date="2">- Second</changelog>
+</package>"""
+
+NEW_FRAGMENT = """<package pkgid="bbb" name="foo" arch="noarch">
+  <version epoch="0" ver="1.1" rel="1"/>
+  <changelog author="Bob - 0.9-1" date="1">- First</changelog>
+  <changelog author="Bob - 1.0-1" date="2">- Second</changelog>
+  <changelog author="Bob - 1.1-1" date="3">- Third &amp; last</changelog>
+</package>"""
+
+DELTA_FRAGMENT = """<package pkgid="bbb" name="foo" arch="noarch">
+  <version epoch="0" ver="1.1" rel="1"/>
+  <changelog author="Bob - 1.1-1" date="3">- Third &amp; last</changelog>
+</package>"""
+
+
+class TestCaseElementDelta(unittest.TestCase):
+    """Tests for elementdelta module"""
+
+    def test_diff_and_patch_sequences(self):
+        for old, new in ((list("abcdef"), list("abcdefgh")),
+                         (list("abcdef"), list("cdefgh")),
+                         (list("abcdef"), list("axcdyf")),
+                         ([], list("ab")),
+                         (list("ab"), [])):
+            script, inserted = diff_sequences(old, new)
+            self.assertEqual(patch_sequence(old, script,
+                                            [new[i] for i in inserted]),
+                             new)
+
+        self.assertEqual(diff_sequences(list("abc"), list("abcd")),
+                         ("k0:3,i1", [3]))
+
+    def test_patch_sequence_bad_script(self):
+        for script in ("k0:5", "k2:1", "i2", "x1", "k1"):
+            self.assertRaises(DeltaRepoError, patch_sequence,
+                              list("ab"), script, ["c"])
+        # Unused inserted items
+        self.assertRaises(DeltaRepoError, patch_sequence,
+                          list("ab"), "k0:2", ["c"])
+
+    def test_index_base_fragments(self):
+        data = "<otherdata>\n%s\n%s\n</otherdata>" % (OLD_FRAGMENT, NEW_FRAGMENT)
+        index = index_base_fragments(data, "other", set(["aaa"]))
+        self.assertEqual(index.keys(), [("foo", "noarch")])
+        pkgid, start, end = index[("foo", "noarch")]
+        self.assertEqual(pkgid, "aaa")
+        self.assertEqual(data[start:end], OLD_FRAGMENT)
+
+        # Ambiguous base packages
+        index = index_base_fragments(data, "other", set(["aaa", "bbb"]))
+        self.assertEqual(index, {})
+
+    def test_delta_fragment(self):
+        element_re = ELEMENT_RES["other"]
+        delta, script = delta_fragment(NEW_FRAGMENT, OLD_FRAGMENT, element_re)
+        self.assertEqual(delta, DELTA_FRAGMENT)
+        self.assertEqual(script, "k0:2,i1")
+        self.assertEqual(patch_sequence(element_re.findall(OLD_FRAGMENT),
+                                        script,
+                                        element_re.findall(delta)),
+                         element_re.findall(NEW_FRAGMENT))
+
+    def test_delta_fragment_nothing_shared(self):
+        element_re = ELEMENT_RES["other"]
+        self.assertEqual(delta_fragment(DELTA_FRAGMENT, OLD_FRAGMENT,
+                                        element_re),
+                         (None, None))
+
+    def test_delta_fragment_filelists(self):
+        element_re = ELEMENT_RES["filelists"]
+        old = ('<package pkgid="aaa" name="foo" arch="noarch">\n'
+               '  <version epoch="0" ver="1.0" rel="1"/>\n'
+               '  <file>/usr/bin/foo</file>\n'
+               '  <file type="dir">/usr/share/doc/foo-1.0</file>\n'
+               '  <file>/usr/share/doc/foo-1.0/README</file>\n'
+               '</package>')
+        new = ('<package pkgid="bbb" name="foo" arch="noarch">\n'
+               '  <version epoch="0" ver="1.1" rel="1"/>\n'
+               '  <file>/usr/bin/foo</file>\n'
+               '  <file type="dir">/usr/share/doc/foo-1.1</file>\n'
+               '  <file>/usr/share/doc/foo-1.1/README</file>\n'
+               '</package>')
+        delta, script = delta_fragment(new, old, element_re)
+        self.assertEqual(script, "k0:1,i2")
+        self.assertEqual(len(element_re.findall(delta)), 2)
+        self.assertFalse("/usr/bin/foo" in delta)
+        self.assertEqual(patch_sequence(element_re.findall(old), script,
+                                        element_re.findall(delta)),
+                         element_re.findall(new))
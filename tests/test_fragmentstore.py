@@ -0,0 +1,72 @@
+import os
+import pickle
+import shutil
+import unittest
+import tempfile
+
+from deltarepo.scanner import mapped, iter_package_ranges, iter_primary_ids
+from deltarepo.manifest import write_manifest
+from deltarepo.fragmentstore import FragmentStore
+
+from fixtures import *
+
+
+class TestCaseFragmentStore(unittest.TestCase):
+    """Tests for fragmentstore module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="deltarepo-test-")
+        self.store = FragmentStore(os.path.join(self.tmpdir, "store.sqlite"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _fragments(self, path, metadata_type):
+        with mapped(path) as data:
+            return [data[start:end] for _, start, end in
+                    iter_package_ranges(data, metadata_type)]
+
+    def test_add_and_get(self):
+        pkg = ("abc", "foo.rpm", None)
+        self.assertFalse(self.store.has("primary", pkg))
+        self.store.add("primary", pkg, "<package>foo</package>")
+        self.store.add("primary", pkg, "<package>bar</package>")
+        self.store.commit()
+        self.assertTrue(self.store.has("primary", pkg))
+        self.assertFalse(self.store.has("primary", ("abc", "bar.rpm", None)))
+        self.assertEqual(self.store.get_many("primary", [pkg, pkg]),
+                         ["<package>foo</package>"] * 2)
+        self.assertEqual(self.store.get_many("other", [pkg]), None)
+
+        store = pickle.loads(pickle.dumps(self.store))
+        self.assertEqual(len(store), 1)
+
+    def test_add_repo(self):
+        pkgs = list(iter_primary_ids(REPO_02_PRIMARY))
+        self.assertEqual(self.store.add_repo(REPO_02_PATH), 3 * len(pkgs))
+        self.assertEqual(self.store.add_repo(REPO_02_PATH), 0)
+        self.assertEqual(self.store.get_many("primary", pkgs),
+                         self._fragments(REPO_02_PRIMARY, "primary"))
+        self.assertEqual(self.store.get_many("filelists", pkgs),
+                         self._fragments(REPO_02_FILELISTS, "filelists"))
+        self.assertEqual(self.store.get_many("other", pkgs),
+                         self._fragments(REPO_02_OTHER, "other"))
+
+    def test_add_repo_with_manifest_and_prune(self):
+        repo = os.path.join(self.tmpdir, "repo_02")
+        shutil.copytree(REPO_02_PATH, repo)
+        manifest = write_manifest(repo)
+        pkgs = list(manifest.identities)
+        self.store.add_repo(repo, manifest=manifest)
+        self.assertEqual(self.store.get_many("primary", pkgs),
+                         self._fragments(REPO_02_PRIMARY, "primary"))
+
+        self.store.add("primary", ("abc", "foo.rpm", None), "<package/>")
+        self.assertEqual(self.store.prune([manifest]), 1)
+        self.assertEqual(len(self.store), 3 * len(pkgs))
+        self.assertEqual(self.store.prune([]), 3 * len(pkgs))
+        self.assertEqual(len(self.store), 0)
+
+if __name__ == "__main__":
+    unittest.main()
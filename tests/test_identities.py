@@ -0,0 +1,93 @@
+import pickle
+import unittest
+
+import deltarepo.identities
+from deltarepo.identities import DIGEST_SIZE
+from deltarepo.identities import identity_digest
+from deltarepo.identities import PackageIdentities
+from deltarepo.identities import diff_identities
+
+
+OLD_IDS = [
+    ("aaa", "foo-1.0-1.noarch.rpm", None),
+    ("bbb", "bar-1.0-1.noarch.rpm", None),
+    ("ccc", "baz-1.0-1.noarch.rpm", "http://baseurl/"),
+    ("ddd", "qux-1.0-1.noarch.rpm", None),
+]
+
+NEW_IDS = [
+    ("eee", "foo-1.0-2.noarch.rpm", None),
+    ("bbb", "bar-1.0-1.noarch.rpm", None),
+    ("ccc", "baz-1.0-1.noarch.rpm", None),   # Changed location_base
+    ("fff", "new-1.0-1.noarch.rpm", None),
+]
+
+
+class TestCasePackageIdentities(unittest.TestCase):
+    """Tests for identities.PackageIdentities class"""
+
+    def test_identity_digest(self):
+        digest = identity_digest(OLD_IDS[0])
+        self.assertEqual(len(digest), DIGEST_SIZE)
+        self.assertEqual(digest, identity_digest(OLD_IDS[0]))
+        self.assertNotEqual(digest, identity_digest(OLD_IDS[1]))
+
+    def test_packageidentities(self):
+        ids = PackageIdentities(OLD_IDS)
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(list(ids), OLD_IDS)
+        self.assertEqual(ids.get(2), OLD_IDS[2])
+        self.assertEqual(ids.digest(3), identity_digest(OLD_IDS[3]))
+        self.assertEqual(len(ids.digests), 4 * DIGEST_SIZE)
+
+    def test_packageidentities_from_packed(self):
+        ids = PackageIdentities(OLD_IDS)
+        packed = PackageIdentities.from_packed(str(ids.packed_records),
+                                               ids.lengths,
+                                               str(ids.digests))
+        self.assertEqual(list(packed), OLD_IDS)
+        self.assertEqual(packed.digests, ids.digests)
+        self.assertEqual(packed.size, ids.size)
+        self.assertRaises(ValueError, PackageIdentities.from_packed,
+                          str(ids.packed_records), ids.lengths[1:],
+                          str(ids.digests[DIGEST_SIZE:]))
+
+    def test_packageidentities_pickle(self):
+        ids = pickle.loads(pickle.dumps(PackageIdentities(OLD_IDS), 2))
+        self.assertEqual(list(ids), OLD_IDS)
+
+
+class TestCaseDiffIdentities(unittest.TestCase):
+    """Tests for identities.diff_identities function"""
+
+    def _check_diff(self):
+        removed, added = diff_identities(PackageIdentities(OLD_IDS),
+                                         PackageIdentities(NEW_IDS))
+        self.assertEqual(removed, sorted([OLD_IDS[0], OLD_IDS[2], OLD_IDS[3]]))
+        self.assertEqual(added, [0, 2, 3])
+
+        removed, added = diff_identities(PackageIdentities(),
+                                         PackageIdentities(NEW_IDS))
+        self.assertEqual(removed, [])
+        self.assertEqual(added, [0, 1, 2, 3])
+
+        removed, added = diff_identities(PackageIdentities(OLD_IDS),
+                                         PackageIdentities())
+        self.assertEqual(removed, sorted(OLD_IDS))
+        self.assertEqual(added, [])
+
+        removed, added = diff_identities(PackageIdentities(OLD_IDS),
+                                         PackageIdentities(OLD_IDS))
+        self.assertEqual(removed, [])
+        self.assertEqual(added, [])
+
+    def test_diff_identities(self):
+        self._check_diff()
+
+    def test_diff_identities_without_numpy(self):
+        numpy = deltarepo.identities.numpy
+        deltarepo.identities.numpy = None
+        try:
+            self._check_diff()
+        finally:
+            deltarepo.identities.numpy = numpy
@@ -0,0 +1,85 @@
+import os
+import shutil
+import unittest
+import tempfile
+
+from deltarepo.identities import diff_identities
+from deltarepo.scanner import iter_primary_ids, package_key
+from deltarepo.util import calculate_content_hash
+from deltarepo.manifest import MANIFEST_FILENAME, Manifest
+from deltarepo.manifest import build_manifest, write_manifest
+from deltarepo.manifest import load_manifest, diff_manifests
+
+from fixtures import *
+
+
+class TestCaseManifest(unittest.TestCase):
+    """Tests for manifest module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="deltarepo-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _copy_repo(self, path):
+        dst = os.path.join(self.tmpdir, os.path.basename(path))
+        shutil.copytree(path, dst)
+        return dst
+
+    def test_write_and_load_manifest(self):
+        repo = self._copy_repo(REPO_02_PATH)
+        self.assertEqual(load_manifest(repo), None)
+
+        written = write_manifest(repo)
+        self.assertTrue(os.path.isfile(os.path.join(repo, MANIFEST_FILENAME)))
+
+        manifest = load_manifest(repo)
+        self.assertTrue(manifest is not None)
+        self.assertEqual(list(manifest.identities),
+                         list(iter_primary_ids(REPO_02_PRIMARY)))
+        self.assertEqual(list(manifest.identities), list(written.identities))
+        self.assertEqual(manifest.content_hash("sha256"),
+                         calculate_content_hash(REPO_02_PRIMARY, "sha256"))
+        self.assertEqual(manifest.content_hash("md5"),
+                         calculate_content_hash(REPO_02_PRIMARY, "md5"))
+        for metadata_type in ("primary", "filelists", "other"):
+            ranges = manifest.ranges(metadata_type)
+            self.assertEqual(sorted(ranges.keys()),
+                             sorted(package_key(metadata_type, x)
+                                    for x in manifest.identities))
+
+    def test_build_manifest(self):
+        repo = self._copy_repo(REPO_02_PATH)
+        manifest = build_manifest(repo)
+        self.assertFalse(os.path.exists(os.path.join(repo, MANIFEST_FILENAME)))
+        self.assertEqual(list(manifest.identities),
+                         list(write_manifest(repo).identities))
+        self.assertEqual(manifest.ranges("filelists"),
+                         load_manifest(repo).ranges("filelists"))
+
+    def test_load_broken_manifest(self):
+        repo = self._copy_repo(REPO_01_PATH)
+        with open(os.path.join(repo, MANIFEST_FILENAME), "w") as f:
+            f.write("foobar")
+        self.assertEqual(load_manifest(repo), None)
+
+    def test_load_stale_manifest(self):
+        repo = self._copy_repo(REPO_01_PATH)
+        write_manifest(repo)
+        manifest = Manifest.load(os.path.join(repo, MANIFEST_FILENAME))
+        manifest.checksums["primary"] = ("sha256", "0" * 64)
+        manifest.dump(os.path.join(repo, MANIFEST_FILENAME))
+        self.assertEqual(load_manifest(repo), None)
+
+    def test_diff_manifests(self):
+        old = write_manifest(self._copy_repo(REPO_01_PATH))
+        new = write_manifest(self._copy_repo(REPO_02_PATH))
+        self.assertEqual(diff_manifests(old, new),
+                         diff_identities(old.identities, new.identities))
+        self.assertEqual(diff_manifests(new, old),
+                         diff_identities(new.identities, old.identities))
+        self.assertEqual(diff_manifests(new, new), ([], []))
+
+if __name__ == "__main__":
+    unittest.main()
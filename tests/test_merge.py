@@ -0,0 +1,65 @@
+import unittest
+import collections
+
+from deltarepo.merge import RawPackage, SortedMerge, PositionalMerge
+
+
+class TestCaseMerge(unittest.TestCase):
+    """Tests for merge module"""
+
+    def test_sorted_merge(self):
+        written = []
+        merge = SortedMerge(["f", "a", "d"], lambda x: x, written.append)
+        for pkg in ("b", "c", "e"):
+            merge.add(pkg)
+        merge.finish()
+        self.assertEqual(written, list("abcdef"))
+        self.assertEqual(merge.count, 3)
+        self.assertEqual(merge.delta_order, ["a", "d", "f"])
+        self.assertEqual(merge.positions, [0, 2, 3])
+
+    def test_sorted_merge_unsorted_stream(self):
+        written = []
+        merge = SortedMerge(["b", "d"], lambda x: x, written.append)
+        for pkg in ("e", "a", "c"):
+            merge.add(pkg)
+        merge.finish()
+        self.assertEqual(sorted(written), list("abcde"))
+
+    def test_sorted_merge_raw_packages(self):
+        Package = collections.namedtuple("Package", ["pkgId", "location_href"])
+        written = []
+        merge = SortedMerge([Package("b", "b.rpm")],
+                            lambda x: x.location_href, written.append)
+        merge.add(RawPackage("a", "a.rpm", None, "<package/>"))
+        merge.add(RawPackage("c", "c.rpm", None, "<package/>"))
+        merge.finish()
+        self.assertEqual([x.pkgId for x in written], list("abc"))
+        self.assertEqual([type(x) for x in written],
+                         [RawPackage, Package, RawPackage])
+
+    def test_positional_merge(self):
+        sorted_written = []
+        merge = SortedMerge(["f", "a", "d"], lambda x: x,
+                            sorted_written.append)
+        for pkg in ("b", "c", "e"):
+            merge.add(pkg)
+        merge.finish()
+
+        written = []
+        merge = PositionalMerge([x.upper() for x in merge.delta_order],
+                                merge.positions, written.append)
+        for pkg in ("B", "C", "E"):
+            merge.add(pkg)
+        merge.finish()
+        self.assertEqual(written, list("ABCDEF"))
+
+    def test_positional_merge_no_old_packages(self):
+        written = []
+        merge = PositionalMerge(["a", "b"], [0, 0], written.append)
+        merge.finish()
+        self.assertEqual(written, ["a", "b"])
+        self.assertRaises(ValueError, PositionalMerge, ["a"], [], None)
+
+if __name__ == "__main__":
+    unittest.main()
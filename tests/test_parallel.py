@@ -0,0 +1,47 @@
+import os
+import unittest
+
+from deltarepo.parallel import run_in_processes, split_workers
+from deltarepo.errors import DeltaRepoError
+
+
+def _fail():
+    raise ValueError("failed")
+
+
+class TestCaseParallel(unittest.TestCase):
+    """Tests for parallel module"""
+
+    def test_run_in_processes(self):
+        jobs = [lambda i=i: (i, os.getpid()) for i in range(4)]
+        results = run_in_processes(jobs, max_workers=2)
+        self.assertEqual([x[0] for x in results], [0, 1, 2, 3])
+        self.assertTrue(all(x[1] != os.getpid() for x in results))
+
+        results = run_in_processes(jobs, max_workers=1)
+        self.assertTrue(all(x[1] == os.getpid() for x in results))
+
+    def test_run_in_processes_failure(self):
+        jobs = [lambda: 1, _fail, lambda: os._exit(1)]
+        self.assertRaises(ValueError, run_in_processes, jobs, max_workers=2)
+
+        results = run_in_processes(jobs, max_workers=2,
+                                   return_exceptions=True)
+        self.assertEqual(results[0], 1)
+        self.assertTrue(isinstance(results[1], ValueError))
+        self.assertTrue(isinstance(results[2], DeltaRepoError))
+
+        results = run_in_processes(jobs[:2], max_workers=1,
+                                   return_exceptions=True)
+        self.assertEqual(results[0], 1)
+        self.assertTrue(isinstance(results[1], ValueError))
+
+    def test_split_workers(self):
+        self.assertEqual(split_workers(4, 3), (3, 1))
+        self.assertEqual(split_workers(2, 3), (2, 1))
+        self.assertEqual(split_workers(4, 1), (1, 4))
+        self.assertEqual(split_workers(1, 3), (1, 1))
+        self.assertEqual(split_workers(None, 1), (1, None))
+
+if __name__ == "__main__":
+    unittest.main()
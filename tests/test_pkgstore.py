@@ -0,0 +1,69 @@
+import os
+import pickle
+import shutil
+import unittest
+import tempfile
+
+from deltarepo.identities import PackageIdentities, diff_identities
+from deltarepo.util import content_hashes_from_ids
+from deltarepo.pkgstore import PackageIdentitiesStore
+from deltarepo.pkgstore import collect_identities
+from deltarepo.pkgstore import identities_content_hashes
+from deltarepo.pkgstore import diff_collected_identities
+
+
+def _ids(start, stop):
+    return [("%064x" % i, "pkg-%d.rpm" % i, None if i % 3 else "http://base/")
+            for i in xrange(start, stop)]
+
+OLD_IDS = _ids(0, 300)
+NEW_IDS = _ids(100, 400)
+
+
+class TestCasePackageIdentitiesStore(unittest.TestCase):
+    """Tests for pkgstore module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="deltarepo-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _collect(self, ids, name, max_memory):
+        return collect_identities(ids, max_memory=max_memory,
+                                  path=os.path.join(self.tmpdir, name))
+
+    def test_collect_identities_in_memory(self):
+        ids = self._collect(OLD_IDS, "old.sqlite", None)
+        self.assertTrue(isinstance(ids, PackageIdentities))
+        self.assertEqual(list(ids), OLD_IDS)
+
+    def test_collect_identities_spilled(self):
+        ids = self._collect(OLD_IDS, "old.sqlite", 1024)
+        self.assertTrue(isinstance(ids, PackageIdentitiesStore))
+        ids = pickle.loads(pickle.dumps(ids))
+        self.assertEqual(len(ids), len(OLD_IDS))
+        self.assertEqual(list(ids), OLD_IDS)
+        self.assertEqual(ids.get(5), OLD_IDS[5])
+        self.assertRaises(IndexError, ids.get, len(OLD_IDS))
+
+    def test_identities_content_hashes(self):
+        expected = content_hashes_from_ids(OLD_IDS, ["sha256", "md5"])
+        for max_memory in (None, 1024):
+            ids = self._collect(OLD_IDS, "old-%s.sqlite" % max_memory,
+                                max_memory)
+            self.assertEqual(identities_content_hashes(ids, ["sha256", "md5"]),
+                             expected)
+
+    def test_diff_collected_identities(self):
+        expected = diff_identities(PackageIdentities(OLD_IDS),
+                                   PackageIdentities(NEW_IDS))
+        for old_limit, new_limit in ((None, None), (1024, 1024),
+                                     (1024, None), (None, 1024)):
+            tmpdir = tempfile.mkdtemp(dir=self.tmpdir)
+            old = collect_identities(OLD_IDS, old_limit,
+                                     os.path.join(tmpdir, "old.sqlite"))
+            new = collect_identities(NEW_IDS, new_limit,
+                                     os.path.join(tmpdir, "new.sqlite"))
+            self.assertEqual(diff_collected_identities(old, new, tmpdir),
+                             expected)
@@ -0,0 +1,29 @@
+import pickle
+import unittest
+import createrepo_c as cr
+
+from deltarepo.plugins_common import repomd_record_to_dict
+from deltarepo.plugins_common import repomd_record_from_dict
+
+from fixtures import *
+
+
+class TestCaseRepomdRecordDict(unittest.TestCase):
+    """Tests for repomd_record_to_dict and repomd_record_from_dict"""
+
+    def test_repomd_record_dict(self):
+        rec = cr.RepomdRecord("primary", REPO_01_PRIMARY)
+        rec.fill(cr.SHA256)
+
+        attrs = pickle.loads(pickle.dumps(repomd_record_to_dict(rec)))
+        new_rec = repomd_record_from_dict(attrs)
+
+        self.assertEqual(new_rec.type, "primary")
+        self.assertEqual(new_rec.location_real, REPO_01_PRIMARY)
+        self.assertEqual(new_rec.location_href, rec.location_href)
+        self.assertEqual(new_rec.checksum, rec.checksum)
+        self.assertEqual(new_rec.checksum_type, "sha256")
+        self.assertEqual(new_rec.checksum_open, rec.checksum_open)
+        self.assertEqual(new_rec.timestamp, rec.timestamp)
+        self.assertEqual(new_rec.size, rec.size)
+        self.assertEqual(new_rec.size_open, rec.size_open)
@@ -0,0 +1,174 @@
+import os
+import re
+import shutil
+import unittest
+import tempfile
+import createrepo_c as cr
+
+from deltarepo.scanner import decompressed
+from deltarepo.scanner import iter_primary_ids
+from deltarepo.scanner import iter_package_ranges
+from deltarepo.scanner import write_raw_packages
+
+from fixtures import *
+
+
+class TestCaseDecompressed(unittest.TestCase):
+    """Tests for scanner.decompressed context manager"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="deltarepo-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_decompressed_compressed_file(self):
+        with decompressed(REPO_01_PRIMARY, tmpdir=self.tmpdir) as path:
+            self.assertNotEqual(path, REPO_01_PRIMARY)
+            self.assertTrue(os.path.isfile(path))
+            self.assertTrue(open(path).read().startswith("<?xml"))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_decompressed_plain_file(self):
+        plain = os.path.join(self.tmpdir, "primary.xml")
+        cr.decompress_file(REPO_01_PRIMARY, plain, cr.AUTO_DETECT_COMPRESSION)
+        with decompressed(plain) as path:
+            self.assertEqual(path, plain)
+        self.assertTrue(os.path.isfile(plain))
+
+
+class TestCasePrimaryIds(unittest.TestCase):
+    """Tests for scanner.iter_primary_ids function"""
+
+    def _parsed_ids(self, path):
+        ids = []
+        def pkgcb(pkg):
+            ids.append((pkg.pkgId, pkg.location_href, pkg.location_base))
+        cr.xml_parse_primary(path, pkgcb=pkgcb, do_files=False)
+        return ids
+
+    def test_iter_primary_ids_empty_primary(self):
+        self.assertEqual(list(iter_primary_ids(REPO_00_PRIMARY)), [])
+
+    def test_iter_primary_ids(self):
+        ids = list(iter_primary_ids(REPO_01_PRIMARY))
+        self.assertEqual(ids, [("4e0b775220c67f0f2c1fd2177e626b9c863a098130224ff09778ede25cea9a9e",
+                                "Archer-3.4.5-6.x86_64.rpm",
+                                None)])
+
+    def test_iter_primary_ids_matches_parser(self):
+        for path in (REPO_00_PRIMARY, REPO_01_PRIMARY, REPO_02_PRIMARY):
+            self.assertEqual(list(iter_primary_ids(path)),
+                             self._parsed_ids(path))
+
+    def test_iter_primary_ids_escaped_values(self):
+        path = os.path.join(tempfile.mkdtemp(prefix="deltarepo-test-"), "primary.xml")
+        try:
+            open(path, "w").write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<metadata xmlns="http://linux.duke.edu/metadata/common" packages="1">\n'
+                '<package type="rpm">\n'
+                '  <checksum type="sha256" pkgid="YES">abc</checksum>\n'
+                '  <location xml:base="http://foo/?a=1&amp;b=2" href="a&amp;b&#x21;.rpm"/>\n'
+                '</package>\n'
+                '</metadata>\n')
+            self.assertEqual(list(iter_primary_ids(path)),
+                             [("abc", "a&b!.rpm", "http://foo/?a=1&b=2")])
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_iter_primary_ids_badfile(self):
+        # Non primary XML has no packages
+        self.assertEqual(list(iter_primary_ids(DELTAREPOS_01)), [])
+
+
+class TestCaseRawPackages(unittest.TestCase):
+    """Tests for scanner.iter_package_ranges and
+    scanner.write_raw_packages functions"""
+
+    ARCHER = "4e0b775220c67f0f2c1fd2177e626b9c863a098130224ff09778ede25cea9a9e"
+    RIMMER = "60dee92d523e8390eb7430fca8ffce461b5b2ad4eb19878cde5c16d72955ee49"
+    RIMMER_ID = (RIMMER, "Rimmer-1.0.2-2.x86_64.rpm", None)
+
+    XML_FILES = (
+        ("primary", REPO_02_PRIMARY, cr.PrimaryXmlFile),
+        ("filelists", REPO_02_FILELISTS, cr.FilelistsXmlFile),
+        ("other", REPO_02_OTHER, cr.OtherXmlFile),
+    )
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="deltarepo-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _parsed_packages(self):
+        pkgs = {}
+        def pkgcb(pkg):
+            pkgs[pkg.pkgId] = pkg
+        def newpkgcb(pkgId, name, arch):
+            return pkgs.get(pkgId)
+        cr.xml_parse_primary(REPO_02_PRIMARY, pkgcb=pkgcb, do_files=False)
+        cr.xml_parse_filelists(REPO_02_FILELISTS, newpkgcb=newpkgcb)
+        cr.xml_parse_other(REPO_02_OTHER, newpkgcb=newpkgcb)
+        return pkgs
+
+    def _write(self, name, xmlclass, fill):
+        path = os.path.join(self.tmpdir, name)
+        f = xmlclass(path, cr.NO_COMPRESSION)
+        f.set_num_of_pkgs(1)
+        fill(f)
+        f.close()
+        return open(path).read()
+
+    def test_iter_package_ranges(self):
+        for metadata_type, path, _ in self.XML_FILES:
+            with decompressed(path) as xml_path:
+                data = open(xml_path).read()
+            ranges = list(iter_package_ranges(data, metadata_type))
+            self.assertEqual([r[0] for r in ranges], [self.ARCHER, self.RIMMER])
+            for _, start, end in ranges:
+                self.assertTrue(data[start:end].startswith("<package"))
+                self.assertTrue(data[start:end].endswith("</package>"))
+
+    def test_write_raw_packages(self):
+        pkgs = self._parsed_packages()
+        for metadata_type, path, xmlclass in self.XML_FILES:
+            raw = self._write("raw.xml", xmlclass,
+                lambda f: self.assertEqual(
+                    write_raw_packages(path, metadata_type,
+                                       [self.RIMMER_ID], f),
+                    []))
+            serialized = self._write("serialized.xml", xmlclass,
+                lambda f: f.add_pkg(pkgs[self.RIMMER]))
+            self.assertEqual(raw, serialized)
+
+    def test_write_raw_packages_same_pkgid_at_more_locations(self):
+        with decompressed(REPO_02_PRIMARY) as xml_path:
+            data = open(xml_path).read()
+        _, start, end = [r for r in iter_package_ranges(data, "primary")
+                         if r[0] == self.RIMMER][0]
+        moved = data[start:end].replace('href="Rimmer', 'href="moved/Rimmer')
+        path = os.path.join(self.tmpdir, "primary.xml")
+        open(path, "w").write(data[:end] + "\n" + moved + data[end:])
+
+        moved_id = (self.RIMMER, "moved/Rimmer-1.0.2-2.x86_64.rpm", None)
+        raw = self._write("raw.xml", cr.PrimaryXmlFile,
+            lambda f: self.assertEqual(
+                write_raw_packages(path, "primary",
+                                   [moved_id, self.RIMMER_ID], f),
+                []))
+        self.assertEqual(re.findall(r'<location href="([^"]*)"', raw),
+                         [moved_id[1], self.RIMMER_ID[1]])
+
+    def test_write_raw_packages_missing(self):
+        path = os.path.join(self.tmpdir, "primary.xml")
+        f = cr.PrimaryXmlFile(path, cr.NO_COMPRESSION)
+        f.set_num_of_pkgs(0)
+        missing = write_raw_packages(REPO_02_PRIMARY, "primary",
+                                     [("foo", "foo.rpm", None),
+                                      (self.RIMMER, "foo.rpm", None)], f)
+        f.close()
+        self.assertEqual(missing, [("foo", "foo.rpm", None),
+                                   (self.RIMMER, "foo.rpm", None)])
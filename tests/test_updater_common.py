@@ -1,7 +1,12 @@
+import os
 import os.path
+import shutil
 import logging
 import unittest
+import tempfile
+import deltarepo.updater_common
 from deltarepo.updater_common import LocalRepo, OriginRepo, DRMirror, Solver, UpdateSolver
+from deltarepo.updater_common import Updater
 from deltarepo.errors import DeltaRepoError
 
 from .fixtures import *
@@ -16,6 +21,7 @@ class LinkMock(object):
         self.contenthash_dst = dst
         self.contenthash_type = type
         self.mirrorurl = mirrorurl
+        self.deltarepourl = "{0}/{1}-{2}".format(mirrorurl, src, dst)
         self._cost = cost
 
         # User can set these remaining values by yourself
@@ -266,3 +272,148 @@ class TestCaseUpdateSolver(unittest.TestCase):
         type, hash = updatesolver.find_repo_contenthash(repo, contenthash_type="md5")
         self.assertEqual(type, "md5")
         self.assertEqual(hash, None)
+
+def write_contenthash(path, contenthash):
+    """Create a mocked repo with the content hash"""
+    os.makedirs(os.path.join(path, "repodata"))
+    with open(os.path.join(path, "repodata", "contenthash"), "w") as f:
+        f.write(contenthash)
+
+def read_contenthash(path):
+    fn = os.path.join(path, "repodata", "contenthash")
+    if not os.path.isfile(fn):
+        return None
+    with open(fn) as f:
+        return f.read()
+
+class DownloadedRepoMock(object):
+    """Mock object - "downloads" a delta repo with the content hash
+    from the end of the url"""
+    downloaded = []
+
+    def __init__(self, urls=[], mirrorlist=None, metalink=None):
+        self.urls = urls
+
+    def download(self, destdir, wanted_metadata=None):
+        DownloadedRepoMock.downloaded.append(self.urls[0])
+        write_contenthash(destdir, self.urls[0].rsplit("/", 1)[-1])
+
+class ApplicatorMock(object):
+    """Mock object - "applies" delta repos (records them) and creates
+    a repo with the destination content hash of the last one"""
+    applied = []
+    fail_at = None  # Destination content hash which cannot be reached
+
+    def __init__(self, old_repo_path, delta_repo_paths, out_path=None,
+                 **kwargs):
+        if not isinstance(delta_repo_paths, list):
+            delta_repo_paths = [delta_repo_paths]
+        self.old_repo_path = old_repo_path
+        self.links = [read_contenthash(x) for x in delta_repo_paths]
+        self.out_path = out_path
+
+    def apply(self):
+        contenthash = self.links[-1].split("-")[1]
+        if contenthash == ApplicatorMock.fail_at:
+            raise KeyboardInterrupt
+        ApplicatorMock.applied.append(
+            (read_contenthash(self.old_repo_path), self.links))
+        write_contenthash(self.out_path, contenthash)
+
+class UpdaterMock(Updater):
+    """Updater which works with the mocked repos"""
+    @staticmethod
+    def _repomd_contenthash(path):
+        return read_contenthash(path)
+
+class TestCaseUpdater(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="deltarepo-test-")
+        self.workdir = os.path.join(self.tmpdir, "work")
+        self.localrepo = LocalRepo()
+        self.localrepo.path = os.path.join(self.tmpdir, "repo")
+        write_contenthash(self.localrepo.path, "aaa")
+        self.links = [LinkMock("aaa", "bbb"),
+                      LinkMock("bbb", "ccc"),
+                      LinkMock("ccc", "ddd")]
+
+        self.orig = (Updater.DownloadedRepo,
+                     deltarepo.updater_common.DeltaRepoApplicator,
+                     deltarepo.updater_common.FusedDeltaRepoApplicator)
+        Updater.DownloadedRepo = DownloadedRepoMock
+        deltarepo.updater_common.DeltaRepoApplicator = ApplicatorMock
+        deltarepo.updater_common.FusedDeltaRepoApplicator = ApplicatorMock
+        DownloadedRepoMock.downloaded = []
+        ApplicatorMock.applied = []
+        ApplicatorMock.fail_at = None
+
+    def tearDown(self):
+        (Updater.DownloadedRepo,
+         deltarepo.updater_common.DeltaRepoApplicator,
+         deltarepo.updater_common.FusedDeltaRepoApplicator) = self.orig
+        shutil.rmtree(self.tmpdir)
+
+    def interrupted_update(self):
+        """Apply the links one by one and interrupt the update
+        before the last one"""
+        ApplicatorMock.fail_at = "ddd"
+        updater = UpdaterMock(self.localrepo, workdir=self.workdir)
+        self.assertRaises(KeyboardInterrupt, updater.apply_resolved_path,
+                          self.links, fused=False)
+        ApplicatorMock.fail_at = None
+        DownloadedRepoMock.downloaded = []
+        ApplicatorMock.applied = []
+        return updater
+
+    def test_updater_apply_resolved_path(self):
+        updater = UpdaterMock(self.localrepo, workdir=self.workdir)
+        updater.apply_resolved_path(self.links)
+        self.assertEqual(len(DownloadedRepoMock.downloaded), 3)
+        self.assertEqual(ApplicatorMock.applied,
+                         [("aaa", ["aaa-bbb", "bbb-ccc", "ccc-ddd"])])
+        self.assertEqual(read_contenthash(self.localrepo.path), "ddd")
+        self.assertFalse(os.path.exists(self.workdir))
+
+    def test_updater_checkpoint_prunes_applied_deltas(self):
+        self.interrupted_update()
+        # Only the delta repo which is not applied yet is kept
+        self.assertEqual(sorted(x for x in os.listdir(self.workdir)
+                                if x.startswith("deltarepo_")),
+                         [Updater._checkpoint_dirname("deltarepo",
+                                                      "ccc-ddd")])
+        # Only the last applied intermediate repo is kept
+        workdir_content = os.listdir(self.workdir)
+        self.assertTrue(Updater._checkpoint_dirname("repo", "ccc")
+                        in workdir_content)
+        self.assertFalse(Updater._checkpoint_dirname("repo", "bbb")
+                         in workdir_content)
+        self.assertEqual(read_contenthash(self.localrepo.path), "aaa")
+
+    def test_updater_resume(self):
+        updater = self.interrupted_update()
+        updater.apply_resolved_path(self.links, fused=False)
+        # Downloaded delta is reused and only the remaining link
+        # is applied to the recorded intermediate repo
+        self.assertEqual(DownloadedRepoMock.downloaded, [])
+        self.assertEqual(ApplicatorMock.applied, [("ccc", ["ccc-ddd"])])
+        self.assertEqual(read_contenthash(self.localrepo.path), "ddd")
+        self.assertFalse(os.path.exists(self.workdir))
+
+    def test_updater_resume_changed_intermediate_repo(self):
+        updater = self.interrupted_update()
+        repo = os.path.join(self.workdir,
+                            Updater._checkpoint_dirname("repo", "ccc"))
+        shutil.rmtree(repo)
+        write_contenthash(repo, "xxx")
+        updater.apply_resolved_path(self.links, fused=False)
+        # Intermediate repo doesn't match the journal - the update
+        # starts again from the local repo
+        self.assertEqual(DownloadedRepoMock.downloaded,
+                         ["mockedlink/aaa-bbb", "mockedlink/bbb-ccc"])
+        self.assertEqual(ApplicatorMock.applied,
+                         [("aaa", ["aaa-bbb"]),
+                          ("bbb", ["bbb-ccc"]),
+                          ("ccc", ["ccc-ddd"])])
+        self.assertEqual(read_contenthash(self.localrepo.path), "ddd")
+        self.assertFalse(os.path.exists(self.workdir))
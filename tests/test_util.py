@@ -7,8 +7,10 @@ import createrepo_c as cr
 
 from deltarepo.util import pkg_id_str
 from deltarepo.util import calculate_content_hash
+from deltarepo.util import calculate_content_hashes
 from deltarepo.util import time_period_to_sec
 from deltarepo.util import compute_file_checksum
+from deltarepo.util import skip_delta_distances
 from deltarepo.util import deltareposrecord_from_repopath
 from deltarepo.util import gen_deltarepos_file
 from deltarepo.errors import DeltaRepoError
@@ -99,6 +101,14 @@ class TestCaseContentHashCalculation(unittest.TestCase):
         ch = calculate_content_hash(fixtures.REPO_01_PRIMARY, checksum_type="sha512")
         self.assertEqual(ch, "882e705c2f95d222ae525295ff440b4da4d30a0a857062ece3c05cc2a45b32ecfadf5614613eecb222a01aea8e4cf91695eed54433afb0a27341ca061de18933")
 
+    def test_contenthashescalculation(self):
+        chs = calculate_content_hashes(fixtures.REPO_01_PRIMARY,
+                                       checksum_types=["sha256", "sha", "md5"])
+        self.assertEqual(chs, {
+            "sha256": "4d1c9f8b7c442adb5f90fda368ec7eb267fa42759a5d125001585bc8928b3967",
+            "sha": "c35d59311257eff6890e79e48526f4cd2bf66113",
+            "md5": "357a4ca1d69f48f2a278158079153211"})
+
     def test_contenthashcalculation_for_badfile(self):
         # Bad XML type (e.g. other.xml instead of primary.xml) should return the same hash as for empty file
         ch = calculate_content_hash(fixtures.DELTAREPOS_01)
@@ -124,6 +134,16 @@ class TestCaseTimePeriodToSec(unittest.TestCase):
         self.assertRaises(ValueError, time_period_to_sec, "4c")
         self.assertRaises(ValueError, time_period_to_sec, "-")
 
+class TestCaseSkipDeltaDistances(unittest.TestCase):
+    """Tests for util.skip_delta_distances function"""
+
+    def test_skipdeltadistances(self):
+        self.assertEqual(skip_delta_distances(0), [])
+        self.assertEqual(skip_delta_distances(1), [1])
+        self.assertEqual(skip_delta_distances(3), [1, 2])
+        self.assertEqual(skip_delta_distances(4), [1, 2, 4])
+        self.assertEqual(skip_delta_distances(20), [1, 2, 4, 8, 16])
+
 class TestCaseComputeFileChecksum(unittest.TestCase):
     """Tests for util.compute_file_checksum function"""
 